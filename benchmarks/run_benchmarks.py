@@ -0,0 +1,329 @@
+"""Times and memory-profiles each stage of downloading and saving participant files.
+
+Synthetic psiTurk databases are generated (and cached) for each experiment size,
+and results are saved as json in benchmarks/results, named after the current commit,
+so they can be compared between commits:
+
+    python benchmarks/run_benchmarks.py --sizes 1000 10000
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<commit>.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import dill as pickle
+import numpy as np
+import pandas as pd
+
+from download_tools import json_decoding
+from download_tools.download_from_database import download_from_database
+from download_tools.labeler import Labeler
+from download_tools.save_participant_files import (
+    decode_datastrings,
+    get_participant_data,
+    save_participant_files,
+)
+from download_tools.synthetic_database import (
+    create_synthetic_database,
+    write_hit_id_file,
+)
+
+BENCHMARK_PATH = Path(__file__).parents[0]
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def stage_query(context):
+    """Download participants from the database."""
+    context["participant_dicts"] = download_from_database(
+        context["hit_id_file_path"], context["database_uri_key"]
+    )
+    return len(context["participant_dicts"])
+
+
+def stage_json_parse_stdlib(context):
+    """Decode every datastring with the standard library, for comparison."""
+    json_decoding.set_json_backend("json")
+    try:
+        decode_datastrings(context["participant_dicts"])
+    finally:
+        json_decoding.set_json_backend()
+    return len(context["participant_dicts"])
+
+
+def stage_json_parse(context):
+    """Decode every datastring, with the default (fastest installed) backend."""
+    context["decoded_datastrings"] = decode_datastrings(context["participant_dicts"])
+    return len(context["participant_dicts"])
+
+
+def stage_labeling(context):
+    """Label every worker ID."""
+    Labeler().label_many(
+        [
+            participant_dict["workerid"]
+            for participant_dict in context["participant_dicts"]
+        ]
+    )
+    return len(context["participant_dicts"])
+
+
+def stage_dataframes(context):
+    """Build general info, question, event and trial dataframes from decoded data."""
+    context["tables"] = get_participant_data(
+        context["participant_dicts"],
+        Labeler(),
+        decoded_datastrings=context.get("decoded_datastrings"),
+    )
+    return sum(len(table) for table in context["tables"].values())
+
+
+def stage_csv_writing(context):
+    """Write all dataframes to csv, with one file per trial type."""
+    output_path = Path(context["work_dir"]).joinpath("csv")
+    output_path.mkdir(exist_ok=True, parents=True)
+    tables = context["tables"]
+    for table_name in ["general_info", "question_data", "event_data"]:
+        tables[table_name].to_csv(output_path.joinpath(f"{table_name}.csv"))
+    trial_data = tables["trial_data"]
+    for trial_type in np.unique(trial_data["trial_type"]):
+        trial_data[trial_data["trial_type"] == trial_type].to_csv(
+            output_path.joinpath(f"{trial_type}.csv"), index=False
+        )
+    return sum(len(table) for table in tables.values())
+
+
+def stage_export(context):
+    """Run save_participant_files end to end."""
+    labeler_path = Path(context["work_dir"]).joinpath("labeler.pickle")
+    with open(labeler_path, "wb") as f:
+        pickle.dump(Labeler().labels, f)
+    save_participant_files(
+        context["participant_dicts"],
+        "benchmark",
+        labeler=labeler_path,
+        save_path=Path(context["work_dir"]).joinpath("export"),
+    )
+    return len(context["participant_dicts"])
+
+
+# stages are run in order, later stages use what earlier stages stored in context
+STAGES = [
+    ("query", stage_query),
+    ("json_parse_stdlib", stage_json_parse_stdlib),
+    ("json_parse", stage_json_parse),
+    ("labeling", stage_labeling),
+    ("dataframes", stage_dataframes),
+    ("csv_writing", stage_csv_writing),
+    ("export", stage_export),
+]
+
+
+def run_stage(stage, context, profile_memory=True):
+    """
+    Time a stage, then (optionally) run it again to measure its peak memory.
+
+    :param stage: stage function, taking context
+    :param context: dictionary shared between stages
+    :param profile_memory: whether to measure peak memory with tracemalloc
+    :return: dictionary of results
+    """
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    rows = stage(context)
+    results = {
+        "wall_time": time.perf_counter() - start_wall,
+        "cpu_time": time.process_time() - start_cpu,
+        "rows": rows,
+    }
+
+    if profile_memory:
+        # tracemalloc slows code down, so memory is measured in a separate run
+        tracemalloc.start()
+        stage(context)
+        results["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return results
+
+
+def get_database(num_participants, work_dir, **generator_options):
+    """
+    Get synthetic database of a given size, generating it if it isn't cached yet.
+
+    :param num_participants: number of participants
+    :param work_dir: directory databases are cached in
+    :param generator_options: keyword arguments for create_synthetic_database
+    :return: (database_path, hit_id_file_path)
+    """
+    # databases generated with different options are cached separately
+    database_name = "_".join(
+        ["synthetic", str(num_participants)]
+        + [str(generator_options[option]) for option in sorted(generator_options)]
+    )
+    database_path = Path(work_dir).joinpath(f"{database_name}.db")
+    hit_id_file_path = Path(work_dir).joinpath(f"{database_name}.txt")
+    if not (database_path.exists() and hit_id_file_path.exists()):
+        if database_path.exists():
+            database_path.unlink()
+        hit_list = create_synthetic_database(
+            database_path, num_participants=num_participants, **generator_options
+        )
+        write_hit_id_file(hit_list, hit_id_file_path)
+    return database_path, hit_id_file_path
+
+
+def run_benchmarks(
+    sizes, work_dir, stages=None, profile_memory=True, **generator_options
+):
+    """
+    Run all benchmark stages for each experiment size.
+
+    :param sizes: list of numbers of participants
+    :param work_dir: directory for databases and output files
+    :param stages: list of stage names to run, or None for all stages
+    :param profile_memory: whether to measure peak memory
+    :param generator_options: keyword arguments for create_synthetic_database
+    :return: dictionary of {size : {stage name : results}}
+    """
+    all_results = {}
+    for num_participants in sizes:
+        database_path, hit_id_file_path = get_database(
+            num_participants, work_dir, **generator_options
+        )
+        os.environ["BENCHMARK_DATABASE"] = f"sqlite:///{database_path.resolve()}"
+        context = {
+            "hit_id_file_path": hit_id_file_path,
+            "database_uri_key": "BENCHMARK_DATABASE",
+            "work_dir": Path(work_dir).joinpath(str(num_participants)),
+        }
+
+        all_results[num_participants] = {}
+        for stage_name, stage in STAGES:
+            # the query stage is always needed, to give later stages their input
+            if stages is not None and stage_name not in stages + ["query"]:
+                continue
+            all_results[num_participants][stage_name] = run_stage(
+                stage, context, profile_memory=profile_memory
+            )
+            print(
+                num_participants,
+                stage_name,
+                all_results[num_participants][stage_name],
+            )
+    return all_results
+
+
+def get_commit():
+    """
+    Get hash of current git commit.
+
+    :return: short commit hash, or "unknown" outside of a git repository
+    """
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=BENCHMARK_PATH,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+def compare_results(results, baseline):
+    """
+    Compare benchmark results to those of an earlier run.
+
+    :param results: results of this run, see run_benchmarks
+    :param baseline: results loaded from an earlier run's json file
+    :return: dataframe of wall time and peak memory ratios (this run / baseline)
+    """
+    rows = []
+    for size, stage_results in results.items():
+        for stage_name, stage_result in stage_results.items():
+            baseline_result = baseline["results"].get(str(size), {}).get(stage_name)
+            if baseline_result is None:
+                continue
+            row = {
+                "size": size,
+                "stage": stage_name,
+                "wall_time_ratio": stage_result["wall_time"]
+                / baseline_result["wall_time"],
+            }
+            if "peak_memory" in stage_result and "peak_memory" in baseline_result:
+                row["peak_memory_ratio"] = (
+                    stage_result["peak_memory"] / baseline_result["peak_memory"]
+                )
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def main():
+    """Run benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        default=None,
+        help="stages to run (csv_writing needs dataframes), default all",
+    )
+    parser.add_argument("--trials-per-participant", type=int, default=20)
+    parser.add_argument("--events-per-participant", type=int, default=10)
+    parser.add_argument("--datastring-size", type=int, default=None)
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--work-dir", default=None)
+    parser.add_argument("--output-dir", default=BENCHMARK_PATH.joinpath("results"))
+    parser.add_argument("--compare", default=None)
+    args = parser.parse_args()
+
+    # load baseline first, it may be overwritten by this run's results
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+    work_dir = args.work_dir or Path(tempfile.gettempdir()).joinpath(
+        "download_tools_benchmarks"
+    )
+    results = run_benchmarks(
+        args.sizes,
+        work_dir,
+        stages=args.stages,
+        profile_memory=not args.no_memory,
+        trials_per_participant=args.trials_per_participant,
+        events_per_participant=args.events_per_participant,
+        datastring_size=args.datastring_size,
+    )
+
+    commit = get_commit()
+    output_path = Path(args.output_dir).joinpath(f"{commit}.json")
+    output_path.parent.mkdir(exist_ok=True, parents=True)
+    with open(output_path, "w") as f:
+        json.dump(
+            {
+                "commit": commit,
+                "date": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "pandas": pd.__version__,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Saved results to {output_path}")
+
+    if baseline is not None:
+        print(compare_results(results, baseline).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""Asyncio counterparts of the functions in download_from_database."""
+import asyncio
+import heapq
+import threading
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from download_tools.download_from_database import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_HIT_CHUNK_SIZE,
+    DEFAULT_MAX_WORKERS,
+    get_database_uris,
+    get_dialect_name,
+    get_filters,
+    get_hit_ids,
+    get_participant_order_key,
+    get_sql_queries_for_hits,
+    merge_participant_dicts,
+    remove_participants_without_data,
+)
+from download_tools.engines import get_engine_kwargs
+
+# async drivers used for database URIs that name a blocking driver (or none)
+ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite",
+    "mysql": "aiomysql",
+}
+
+# (event loop, engine) by (id of event loop, database uri), as pooled connections can
+# only be used on the event loop they were created on
+_async_engines = {}
+_async_engines_lock = threading.Lock()
+
+
+def get_async_database_uri(database_uri):
+    """
+    Get database URI using an async driver, e.g. postgresql+asyncpg for postgresql.
+
+    :param database_uri: a database uri as a string
+    :return: database uri as a string
+    """
+    url = make_url(database_uri)
+    backend_name = url.get_backend_name()
+    if backend_name in ASYNC_DRIVERS and url.get_driver_name() != (
+        ASYNC_DRIVERS[backend_name]
+    ):
+        url = url.set(drivername=f"{backend_name}+{ASYNC_DRIVERS[backend_name]}")
+    return url.render_as_string(hide_password=False)
+
+
+def get_async_engine(database_uri, **settings):
+    """
+    Get async engine for a database, creating it the first time the database is used on the running event loop.
+
+    Like download_tools.engines.get_engine, engines are cached by URI, but separately for each event loop
+    (e.g. each asyncio.run call). Engines of event loops that were closed are dropped.
+
+    :param database_uri: a database uri as a string (with a blocking or async driver)
+    :param settings: keyword arguments overriding download_tools.engines.engine_settings
+    :return: sqlalchemy async engine
+    """  # noqa: E501
+    database_uri = get_async_database_uri(database_uri)
+    loop = asyncio.get_running_loop()
+    engine_key = (id(loop), database_uri)
+    with _async_engines_lock:
+        for key, (engine_loop, _) in list(_async_engines.items()):
+            if engine_loop.is_closed():
+                del _async_engines[key]
+        if engine_key not in _async_engines:
+            _async_engines[engine_key] = (
+                loop,
+                create_async_engine(
+                    database_uri, **get_engine_kwargs(database_uri, settings)
+                ),
+            )
+        return _async_engines[engine_key][1]
+
+
+async def dispose_async_engines():
+    """
+    Close all pooled connections of the async engines of the running event loop.
+
+    :return: nothing
+    """
+    loop = asyncio.get_running_loop()
+    with _async_engines_lock:
+        engine_keys = [
+            key
+            for key, (engine_loop, _) in _async_engines.items()
+            if engine_loop is loop
+        ]
+        engines = [_async_engines.pop(key)[1] for key in engine_keys]
+    for engine in engines:
+        await engine.dispose()
+
+
+async def astream_sql_query(sql_query, database_uri, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Run a SQL query on a given database, yielding the results in batches.
+
+    :param sql_query: a sql query, as a sqlalchemy text clause
+    :param database_uri: a database uri as a string
+    :param batch_size: number of rows fetched from the database at a time
+    :return: async generator of lists of at most batch_size rows, with a dictionary for each row
+    """  # noqa: E501
+    async with get_async_engine(database_uri).connect() as connection:
+        results = await connection.stream(sql_query)
+        async for batch in results.partitions(batch_size):
+            yield [dict(entry._mapping) for entry in batch]
+
+
+async def astream_participants_for_hits(
+    hit_list,
+    database_uri,
+    batch_size=DEFAULT_BATCH_SIZE,
+    hit_chunk_size=DEFAULT_HIT_CHUNK_SIZE,
+    filters=None,
+):
+    """
+    Stream all participants for a list of hits from a given database, in batches.
+
+    Chunks of hits are queried one after another, so participants are only ordered within each chunk.
+
+    :param hit_list: list of hits as strings
+    :param database_uri: a database uri as a string
+    :param batch_size: number of rows fetched from the database at a time
+    :param hit_chunk_size: maximum number of hits in one query, or None for a single query
+    :param filters: dictionary of filters compiled into the query (see get_sql_filters), or None
+    :return: async generator of lists of at most batch_size rows, with a dictionary for each participant
+    """  # noqa: E501
+    for sql_query in get_sql_queries_for_hits(
+        hit_list,
+        hit_chunk_size=hit_chunk_size,
+        dialect=get_dialect_name(database_uri),
+        filters=filters,
+    ):
+        async for batch in astream_sql_query(
+            sql_query, database_uri, batch_size=batch_size
+        ):
+            yield batch
+
+
+async def astream_from_database(
+    hit_id_file_path,
+    database_uri_keys=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+    yield_batches=False,
+    hit_chunk_size=DEFAULT_HIT_CHUNK_SIZE,
+    filters=None,
+):
+    """
+    Stream experiment off of database, one participant (or batch of participants) at a time.
+
+    :param hit_id_file_path: path to text file containing a list of all HIT IDs
+    :param database_uri_keys: uri key, or list of uri keys
+    :param batch_size: number of participants fetched from the database at a time
+    :param yield_batches: if True, yield lists of participant dicts instead of single participant dicts
+    :param hit_chunk_size: maximum number of hits in one query, or None for a single query
+    :param filters: dictionary of filters compiled into the query (see get_sql_filters), added to DEFAULT_FILTERS
+    :return: async generator of participant dicts (or lists of participant dicts)
+    """  # noqa: E501
+    database_uris = get_database_uris(database_uri_keys)
+
+    # get list of HITs and experiment name
+    hits, exp_name = get_hit_ids(hit_id_file_path)
+
+    for _, database_uri in database_uris:
+        async for batch in astream_participants_for_hits(
+            hits,
+            database_uri,
+            batch_size=batch_size,
+            hit_chunk_size=hit_chunk_size,
+            filters=get_filters(filters),
+        ):
+            participant_dicts = remove_participants_without_data(batch)
+            if yield_batches:
+                if participant_dicts:
+                    yield participant_dicts
+            else:
+                for participant_dict in participant_dicts:
+                    yield participant_dict
+
+
+async def adownload_participants_for_hits(
+    hit_list,
+    database_uri,
+    hit_chunk_size=DEFAULT_HIT_CHUNK_SIZE,
+    semaphore=None,
+    filters=None,
+):
+    """
+    Download all participants with data for a list of hits, querying each chunk of hits concurrently.
+
+    :param hit_list: list of hits as strings
+    :param database_uri: a database uri as a string
+    :param hit_chunk_size: maximum number of hits in one query, or None for a single query
+    :param semaphore: asyncio.Semaphore bounding the number of concurrent queries, or None
+    :param filters: dictionary of filters compiled into the query (see get_sql_filters), added to DEFAULT_FILTERS
+    :return: participant_dicts, a list containing a dictionary for each participant
+    """  # noqa: E501
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(DEFAULT_MAX_WORKERS)
+
+    async def run_query(sql_query):
+        async with semaphore:
+            participant_dicts = []
+            async for batch in astream_sql_query(sql_query, database_uri):
+                participant_dicts.extend(remove_participants_without_data(batch))
+            return participant_dicts
+
+    dialect = get_dialect_name(database_uri)
+    chunk_participant_dicts = await asyncio.gather(
+        *[
+            run_query(sql_query)
+            for sql_query in get_sql_queries_for_hits(
+                hit_list,
+                hit_chunk_size=hit_chunk_size,
+                dialect=dialect,
+                filters=get_filters(filters),
+            )
+        ]
+    )
+    # each chunk is in participant order, so merge them as a single query would be
+    return list(
+        heapq.merge(*chunk_participant_dicts, key=get_participant_order_key(dialect))
+    )
+
+
+async def adownload_from_database(
+    hit_id_file_path,
+    database_uri_keys=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    drop_duplicates=False,
+    hit_chunk_size=DEFAULT_HIT_CHUNK_SIZE,
+    filters=None,
+):
+    """
+    Download experiment off of database, without blocking the event loop.
+
+    All databases, and all chunks of hits within a database, are queried concurrently.
+
+    :param hit_id_file_path: path to text file containing a list of all HIT IDs
+    :param database_uri_keys: uri key, or list of uri keys
+    :param max_workers: maximum number of queries running at the same time
+    :param drop_duplicates: if True, only keep the first participant with each uniqueid (in order of database_uri_keys)
+    :param hit_chunk_size: maximum number of hits in one query, or None for a single query
+    :param filters: dictionary of filters compiled into the query (see get_sql_filters), added to DEFAULT_FILTERS
+    :return: participant_dicts, a list containing a dictionary for each participant
+    """  # noqa: E501
+    database_uris = get_database_uris(database_uri_keys)
+
+    # get list of HITs and experiment name
+    hits, exp_name = get_hit_ids(hit_id_file_path)
+
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+    database_participant_dicts = await asyncio.gather(
+        *[
+            adownload_participants_for_hits(
+                hits,
+                database_uri,
+                hit_chunk_size=hit_chunk_size,
+                semaphore=semaphore,
+                filters=filters,
+            )
+            for _, database_uri in database_uris
+        ]
+    )
+
+    return merge_participant_dicts(
+        database_participant_dicts, drop_duplicates=drop_duplicates
+    )
@@ -0,0 +1,302 @@
+"""Exports many experiments in one process, from the command line.
+
+Experiments are given as HIT ID files, directories of HIT ID files or experiment YAMLs
+(whose sessions name HIT ID files), and are downloaded and saved concurrently, sharing
+database connections and one labeler:
+
+    download-tools-export hit_ids/ --databases NEW --labeler mturk_id_mapping.pickle
+"""
+import argparse
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover
+    yaml = None
+
+from download_tools.download_from_database import (
+    download_from_database,
+    load_database_uris,
+)
+from download_tools.labeler import LockedLabeler, load_labeler, save_labeler
+from download_tools.profiling import get_datastring_bytes, profile
+from download_tools.save_participant_files import save_participant_files
+
+# number of experiments exported at the same time
+DEFAULT_MAX_WORKERS = 4
+
+# suffixes of experiment YAMLs, see tests/data/yamls/experiments
+YAML_SUFFIXES = [".yaml", ".yml"]
+
+
+def get_yaml_hit_id_files(yaml_path, hit_id_dir):
+    """
+    Get HIT ID files of an experiment YAML's sessions.
+
+    :param yaml_path: path to experiment YAML, with a list of sessions
+    :param hit_id_dir: directory with a <SESSION>.txt HIT ID file for each session
+    :return: list of paths to HIT ID files
+    """
+    if yaml is None:
+        raise ValueError(
+            "Reading experiment YAMLs needs pyyaml, install with pip install -e .[yaml]"
+        )
+    with open(yaml_path, "r") as f:
+        experiment = yaml.safe_load(f)
+    if not experiment or not experiment.get("sessions"):
+        raise ValueError(f"No sessions in experiment YAML: {yaml_path}")
+    return [
+        Path(hit_id_dir).joinpath(f"{session}.txt")
+        for session in experiment["sessions"]
+    ]
+
+
+def get_hit_id_files(paths, hit_id_dir=None):
+    """
+    Get HIT ID files of experiments given as files, directories or YAMLs.
+
+    :param paths: list of paths to HIT ID files, directories of HIT ID files or experiment YAMLs
+    :param hit_id_dir: directory with HIT ID files of YAML sessions, default None uses the directory of each YAML
+    :return: list of paths to HIT ID files, without duplicates, in the order given (files in directories sorted)
+    """  # noqa: E501
+    hit_id_files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            hit_id_files.extend(sorted(path.glob("*.txt")))
+        elif path.suffix in YAML_SUFFIXES:
+            hit_id_files.extend(
+                get_yaml_hit_id_files(
+                    path, path.parent if hit_id_dir is None else hit_id_dir
+                )
+            )
+        else:
+            hit_id_files.append(path)
+
+    missing_files = [str(path) for path in hit_id_files if not path.is_file()]
+    if missing_files:
+        raise ValueError(f"HIT ID files not found: {missing_files}")
+    # an experiment's files are only saved once
+    return list(dict.fromkeys(hit_id_files))
+
+
+def export_experiment(
+    hit_id_file_path, database_uri_keys, labeler, save_path=None, **save_options
+):
+    """
+    Download an experiment's participants and save their files.
+
+    :param hit_id_file_path: path to text file containing a list of all HIT IDs
+    :param database_uri_keys: uri key, or list of uri keys
+    :param labeler: Labeler shared by all exports, saved by the caller
+    :param save_path: location to save data
+    :param save_options: keyword arguments for save_participant_files, e.g. format
+    :return: summary dictionary with experiment name, number of participants, datastring bytes, number of files and rows saved, and seconds taken to download and to save
+    """  # noqa: E501
+    exp_name = Path(hit_id_file_path).stem
+    start_time = time.perf_counter()
+    participant_dicts = download_from_database(hit_id_file_path, database_uri_keys)
+    download_seconds = time.perf_counter() - start_time
+
+    reports = {}
+    if participant_dicts:
+        reports = save_participant_files(
+            participant_dicts,
+            exp_name,
+            labeler=labeler,
+            save_path=save_path,
+            **save_options,
+        )
+    return {
+        "experiment": exp_name,
+        "participants": len(participant_dicts),
+        "datastring_bytes": get_datastring_bytes(participant_dicts),
+        "files": len(reports),
+        "rows": sum(report["rows"] for report in reports.values()),
+        "download_seconds": download_seconds,
+        "save_seconds": time.perf_counter() - start_time - download_seconds,
+    }
+
+
+def export_experiments(
+    hit_id_file_paths,
+    database_uri_keys,
+    labeler="mturk_id_mapping.pickle",
+    save_path=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    profile_dir=None,
+    progress=None,
+    **save_options,
+):
+    """
+    Export experiments concurrently on a pool of threads, sharing one labeler.
+
+    An experiment that fails doesn't stop the others, its summary has the error instead.
+    Labels are saved once all experiments are done, also if some failed.
+
+    :param hit_id_file_paths: list of paths to HIT ID files, see get_hit_id_files
+    :param database_uri_keys: uri key, or list of uri keys
+    :param labeler: location of existing labeler dictionary or store (see labeler.is_labeler_store)
+    :param save_path: location to save data
+    :param max_workers: maximum number of experiments exported at the same time
+    :param profile_dir: directory to save a profile (see profiling.profile) of each experiment in, default None doesn't profile
+    :param progress: function called with each experiment's summary once it is done, default None
+    :param save_options: keyword arguments for save_participant_files, e.g. format
+    :return: list of summaries (see export_experiment), in the order of hit_id_file_paths
+    """  # noqa: E501
+    pid_labeler = load_labeler(labeler, labeler_class=LockedLabeler)
+    if profile_dir is not None:
+        Path(profile_dir).mkdir(exist_ok=True, parents=True)
+
+    def export(hit_id_file_path):
+        exp_name = Path(hit_id_file_path).stem
+        profile_context = nullcontext()
+        if profile_dir is not None:
+            profile_context = profile(
+                output_path=Path(profile_dir).joinpath(f"{exp_name}.json")
+            )
+        try:
+            with profile_context:
+                summary = export_experiment(
+                    hit_id_file_path,
+                    database_uri_keys,
+                    pid_labeler,
+                    save_path=save_path,
+                    **save_options,
+                )
+        except Exception:
+            summary = {"experiment": exp_name, "error": traceback.format_exc()}
+        if progress is not None:
+            progress(summary)
+        return summary
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map keeps summaries in the order of the experiments
+            return list(executor.map(export, hit_id_file_paths))
+    finally:
+        save_labeler(labeler, pid_labeler)
+
+
+def format_summary(summaries, seconds):
+    """
+    Format a throughput summary of exported experiments.
+
+    :param summaries: list of experiment summaries, see export_experiment
+    :param seconds: wall time taken to export all experiments
+    :return: summary as a string, with a line per experiment and the totals
+    """
+    lines = [
+        f"{'experiment':<30} {'participants':>12} {'MB':>9} {'files':>5} "
+        f"{'rows':>9} {'download s':>10} {'save s':>8}"
+    ]
+    for summary in summaries:
+        if "error" in summary:
+            lines.append(f"{summary['experiment']:<30} failed")
+            continue
+        lines.append(
+            f"{summary['experiment']:<30} {summary['participants']:>12} "
+            f"{summary['datastring_bytes'] / 1e6:>9.2f} {summary['files']:>5} "
+            f"{summary['rows']:>9} {summary['download_seconds']:>10.2f} "
+            f"{summary['save_seconds']:>8.2f}"
+        )
+
+    exported = [summary for summary in summaries if "error" not in summary]
+    participants = sum(summary["participants"] for summary in exported)
+    megabytes = sum(summary["datastring_bytes"] for summary in exported) / 1e6
+    lines.append(
+        f"{len(exported)} of {len(summaries)} experiments exported: {participants} "
+        f"participants, {megabytes:.2f} MB of datastrings in {seconds:.2f} s "
+        f"({participants / max(seconds, 1e-9):.1f} participants/s, "
+        f"{megabytes / max(seconds, 1e-9):.2f} MB/s)"
+    )
+    return "\n".join(lines)
+
+
+def get_parser():
+    """
+    Get parser of command line arguments.
+
+    :return: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help="HIT ID files (<EXPERIMENT_NAME>.txt), directories of them, or experiment YAMLs",  # noqa: E501
+    )
+    parser.add_argument(
+        "--databases", nargs="+", required=True, help="database uri keys"
+    )
+    parser.add_argument(
+        "--database-uris-dir",
+        default=".",
+        help="directory of the .database_uris file (see load_database_uris)",
+    )
+    parser.add_argument(
+        "--hit-id-dir",
+        default=None,
+        help="directory of HIT ID files of YAML sessions, default the YAML's directory",
+    )
+    parser.add_argument("--labeler", default="mturk_id_mapping.pickle")
+    parser.add_argument("--save-path", default=None)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help="number of experiments exported at the same time",
+    )
+    parser.add_argument(
+        "--format", default="csv", choices=["csv", "parquet", "feather"]
+    )
+    parser.add_argument("--optimize-dtypes", action="store_true")
+    parser.add_argument(
+        "--profile-dir",
+        default=None,
+        help="directory to save a profile of each experiment's export in",
+    )
+    return parser
+
+
+def main(argv=None):
+    """
+    Export experiments from the command line, printing a throughput summary.
+
+    :param argv: list of command line arguments, default None uses sys.argv
+    :return: exit code, 1 if any experiment failed
+    """
+    args = get_parser().parse_args(argv)
+    load_database_uris(args.database_uris_dir)
+    hit_id_file_paths = get_hit_id_files(args.paths, hit_id_dir=args.hit_id_dir)
+
+    def progress(summary):
+        if "error" in summary:
+            print(f"{summary['experiment']} failed:\n{summary['error']}", flush=True)
+        else:
+            print(
+                f"{summary['experiment']}: {summary['participants']} participants",
+                flush=True,
+            )
+
+    start_time = time.perf_counter()
+    summaries = export_experiments(
+        hit_id_file_paths,
+        args.databases,
+        labeler=args.labeler,
+        save_path=args.save_path,
+        max_workers=args.workers,
+        profile_dir=args.profile_dir,
+        progress=progress,
+        format=args.format,
+        optimize_dtypes=args.optimize_dtypes,
+    )
+    print(format_summary(summaries, time.perf_counter() - start_time))
+    return int(any("error" in summary for summary in summaries))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""Builds dataframes from records by appending values to per-column buffers."""
+import numpy as np
+import pandas as pd
+
+# value of a column in rows without it, as in a dataframe built from a list of dicts
+MISSING = np.nan
+
+
+# a value of each kind of group (see get_group_kind), to find concatenated dtypes
+KIND_SAMPLES = {
+    "int": 1,
+    "float": 1.5,
+    "nan": MISSING,
+    "bool": True,
+    "object": "",
+    "none": None,
+}
+
+
+def get_group_kind(values):
+    """
+    Get the dtype pandas infers for a group's values of a column, in a dataframe of its own.
+
+    :param values: list of values of one column for one group of rows, MISSING for rows without the column
+    :return: "absent" if no row has the column, "none" if all values are None, "nan" if all values are missing, or "int", "float", "bool" or "object"
+    """  # noqa: E501
+    present_types = set()
+    has_missing = False
+    for value in values:
+        if value is MISSING:
+            has_missing = True
+        else:
+            present_types.add(type(value))
+
+    if not present_types:
+        return "absent"
+    has_none = type(None) in present_types
+    present_types.discard(type(None))
+    if not present_types:
+        # None is NaN in a float column when some rows don't have the column
+        return "nan" if has_missing else "none"
+    if present_types <= {int, float}:
+        if present_types == {int} and not (has_missing or has_none):
+            return "int"
+        if all(value is None or value != value for value in values):
+            return "nan"
+        return "float"
+    if present_types == {bool} and not (has_missing or has_none):
+        return "bool"
+    return "object"
+
+
+def to_float_values(values):
+    """
+    Convert a group's values as pandas does for a float column.
+
+    :param values: list of ints, floats, None and MISSING
+    :return: list of floats
+    """
+    return [MISSING if value is None else float(value) for value in values]
+
+
+class ColumnBuilder(object):
+    """
+    Accumulate records (dicts) column by column, then build one dataframe.
+
+    Columns are ordered by first appearance, and rows without a column get NaN, as when
+    building a dataframe from a list of dicts. Rows can be appended in groups (e.g. a participant's
+    trials), in which case the dataframe is the same as concatenating a dataframe for each group.
+    (Except for columns pandas types by the layout of its internal blocks when concatenating,
+    e.g. a column that is None for all of one group's rows and numeric in another group.)
+    """  # noqa: E501
+
+    def __init__(self):  # noqa D107
+        # buffer for each column, shorter than num_rows if the last rows don't have it
+        self.columns = {}
+        self.num_rows = 0
+        # (start, end) rows of each group, see start_group
+        self.groups = []
+        self.group_start = None
+        # filled values of groups without rows, see fill_group
+        self.empty_groups = []
+        self.empty_group_values = []
+
+    def get_column(self, key):
+        """
+        Get a column's buffer, padded with missing values up to the current row.
+
+        :param key: column name
+        :return: list of column values
+        """
+        column = self.columns.get(key)
+        if column is None:
+            column = self.columns[key] = []
+        if len(column) < self.num_rows:
+            column.extend([MISSING] * (self.num_rows - len(column)))
+        return column
+
+    def append(self, record):
+        """
+        Append a record as a row.
+
+        :param record: dictionary of {column : value}
+        :return: nothing
+        """
+        for key, value in record.items():
+            self.get_column(key).append(value)
+        self.num_rows += 1
+
+    def extend(self, records):
+        """
+        Append records as rows.
+
+        :param records: iterable of dictionaries of {column : value}
+        :return: nothing
+        """
+        for record in records:
+            self.append(record)
+
+    def start_group(self):
+        """
+        Start a group of rows, see fill_group and end_group.
+
+        :return: nothing
+        """
+        self.group_start = self.num_rows
+        self.empty_group_values = []
+
+    def fill_group(self, key, value):
+        """
+        Set a column to the same value for all rows of the current group.
+
+        :param key: column name
+        :param value: value for every row of the group
+        :return: nothing
+        """
+        num_rows = self.num_rows
+        # pad up to the start of the group only
+        self.num_rows = self.group_start
+        column = self.get_column(key)
+        self.num_rows = num_rows
+
+        if len(column) > self.group_start:
+            # column set by the group's records, overwrite as dataframe assignment would
+            del column[self.group_start :]
+        column.extend([value] * (num_rows - self.group_start))
+        self.empty_group_values.append((key, value))
+
+    def end_group(self):
+        """
+        End the current group, whose rows are indexed from 0 as in their own dataframe.
+
+        :return: nothing
+        """
+        if self.num_rows == self.group_start:
+            self.empty_groups.append(self.empty_group_values)
+        else:
+            self.groups.append((self.group_start, self.num_rows))
+        self.group_start = None
+
+    def get_dtype(self, key, kinds):
+        """
+        Get the dtype pandas gives a column when concatenating a dataframe for each group.
+
+        pandas is asked directly, by concatenating a one row dataframe for each kind of group
+        (and each group without rows), so the result is the same for every pandas version.
+
+        :param key: column name
+        :param kinds: set of kinds of groups, see get_group_kind
+        :return: numpy dtype
+        """  # noqa: E501
+        probes = [
+            (
+                pd.DataFrame(index=[0])
+                if kind == "absent"
+                else pd.DataFrame({key: [KIND_SAMPLES[kind]]})
+            )
+            for kind in sorted(kinds)
+        ] + self.get_empty_dataframes()
+        return pd.concat(probes)[key].dtype
+
+    def get_empty_dataframes(self):
+        """
+        Get a dataframe for each group without rows, as pandas builds an empty group.
+
+        :return: list of dataframes
+        """
+        empty_dataframes = []
+        for empty_group_values in self.empty_groups:
+            empty_dataframe = pd.DataFrame([])
+            for key, value in empty_group_values:
+                empty_dataframe[key] = value
+            empty_dataframes.append(empty_dataframe)
+        return empty_dataframes
+
+    def build(self):
+        """
+        Build a dataframe from all rows appended so far.
+
+        :return: dataframe, with a range index, or an index per group if groups were used
+        """  # noqa: E501
+        data = {key: self.get_column(key) for key in list(self.columns)}
+        if not self.groups and not self.empty_groups:
+            return pd.DataFrame(data, columns=list(data))
+        if not self.groups:
+            return pd.concat(self.get_empty_dataframes())
+
+        empty_group_keys = [{key for key, _ in values} for values in self.empty_groups]
+        dtypes = {}
+        columns = {}
+        for key, values in data.items():
+            group_kinds = [
+                get_group_kind(values[start:end]) for start, end in self.groups
+            ]
+            kinds = frozenset(group_kinds)
+            # the dtype also depends on which groups without rows have the column
+            dtype_key = (kinds, tuple(key in values for values in empty_group_keys))
+            if dtype_key not in dtypes:
+                dtypes[dtype_key] = self.get_dtype(key, kinds)
+            dtype = dtypes[dtype_key]
+
+            if dtype == object and ("float" in kinds or "nan" in kinds):
+                # values of float groups stay floats in an object column
+                values = [
+                    value
+                    for (start, end), kind in zip(self.groups, group_kinds)
+                    for value in (
+                        to_float_values(values[start:end])
+                        if kind in ("float", "nan")
+                        else values[start:end]
+                    )
+                ]
+            columns[key] = pd.Series(values, dtype=dtype)
+
+        dataframe = pd.DataFrame(columns, columns=list(columns))
+        dataframe.index = np.concatenate(
+            [np.arange(end - start) for start, end in self.groups]
+        )
+        return dataframe
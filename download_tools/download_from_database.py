@@ -1,10 +1,94 @@
 """Code to download from database, given URI."""
-
+import functools
+import heapq
+import itertools
 import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.engine import make_url
+
+from download_tools.engines import get_engine
+from download_tools.mirror import (
+    create_mirror,
+    decompress_participant,
+    get_mirror_uri,
+    load_mirror_watermarks,
+    write_participants_to_mirror,
+)
+from download_tools.profiling import (
+    add_metrics,
+    add_participant_metrics,
+    in_current_context,
+    profiled,
+    stage,
+)
+from download_tools.watermarks import (
+    get_changed_uniqueids,
+    get_watermark_path,
+    load_watermark,
+    save_watermark,
+    update_watermark,
+)
+
+# number of rows fetched from the server-side cursor at a time when streaming
+DEFAULT_BATCH_SIZE = 1000
+# HIT lists longer than this are split across several queries
+DEFAULT_HIT_CHUNK_SIZE = 500
+# HIT lists longer than this are joined against a temporary table instead
+DEFAULT_TEMP_TABLE_THRESHOLD = 5000
+# maximum number of databases queried at the same time
+DEFAULT_MAX_WORKERS = 4
+
+# columns participants are ordered by, and whether they are in descending order
+PARTICIPANT_ORDER_COLUMNS = [("status", True), ("cond", False), ("beginexp", True)]
+PARTICIPANT_ORDER = "ORDER BY " + ", ".join(
+    f"{column} {'DESC' if descending else 'ASC'}"
+    for column, descending in PARTICIPANT_ORDER_COLUMNS
+)
+# columns of the psiTurk participants table
+PARTICIPANT_COLUMNS = [
+    "uniqueid",
+    "assignmentid",
+    "workerid",
+    "hitid",
+    "ipaddress",
+    "browser",
+    "platform",
+    "language",
+    "cond",
+    "counterbalance",
+    "codeversion",
+    "beginhit",
+    "beginexp",
+    "endhit",
+    "bonus",
+    "status",
+    "mode",
+    "datastring",
+]
+# every column but the (large) datastring, downloaded first in two-phase downloads
+METADATA_COLUMNS = [column for column in PARTICIPANT_COLUMNS if column != "datastring"]
+# lightweight columns used to decide which participants an incremental sync downloads
+SYNC_COLUMNS = ["uniqueid", "status"]
+# options of stream_participants_for_hits that also apply to queries by uniqueid
+UNIQUEID_QUERY_OPTIONS = ["batch_size", "hit_chunk_size"]
+
+# filters on the participants table that are compiled into sql, see get_sql_filters
+VALUE_FILTERS = ["status", "cond", "counterbalance"]
+TIME_FILTERS = {
+    "beginexp_after": ("beginexp", ">="),
+    "beginexp_before": ("beginexp", "<"),
+    "endhit_after": ("endhit", ">="),
+    "endhit_before": ("endhit", "<"),
+}
+OTHER_FILTERS = ["datastring_not_null", "min_datastring_length"]
+# participants without data are never returned, so they are never downloaded either
+DEFAULT_FILTERS = {"datastring_not_null": True}
+HIT_TABLE = "download_tools_hit_ids"
 
 
 def load_database_uris(path="."):
@@ -37,23 +121,458 @@ def get_hit_ids(hit_id_file_path):
     return list_of_hits, exp_name
 
 
-def get_sql_query_for_hits(hit_list):
+def get_dialect_name(database_uri):
+    """
+    Get name of the SQL dialect (e.g. "postgresql" or "sqlite") of a database.
+
+    :param database_uri: a database uri as a string
+    :return: dialect name, as a string
+    """
+    return make_url(database_uri).get_backend_name()
+
+
+def get_sql_select(columns=None):
+    """
+    Create the select part of a sql query on the participants table.
+
+    :param columns: list of participants columns to select, or None for all columns
+    :return: select clause, as a string
+    """
+    if columns is None:
+        return "SELECT participants.* FROM participants"
+
+    unknown_columns = set(columns) - set(PARTICIPANT_COLUMNS)
+    if unknown_columns:
+        raise ValueError(f"Unknown participants columns: {sorted(unknown_columns)}")
+    return "SELECT {} FROM participants".format(
+        ", ".join(f"participants.{column}" for column in columns)
+    )
+
+
+def get_sql_in_predicate(column_name, param_name, values, dialect=None):
+    """
+    Create a predicate checking whether a participants column is in a list of values.
+
+    Values are passed as a bound parameter, as an array on Postgres
+    (column = ANY(:values)) and as an expanding IN list otherwise.
+
+    :param column_name: participants column, e.g. "hitid"
+    :param param_name: name of bound parameter
+    :param values: list of values
+    :param dialect: dialect name of database the query will be run on (see get_dialect_name)
+    :return: (predicate, parameter), predicate as a string and its bound parameter
+    """  # noqa: E501
+    if column_name not in PARTICIPANT_COLUMNS:
+        raise ValueError(f"Unknown participants column: {column_name}")
+    values = list(dict.fromkeys(values))
+
+    if dialect == "postgresql":
+        return (
+            f"participants.{column_name} = ANY(:{param_name})",
+            bindparam(param_name, value=values),
+        )
+    return (
+        f"participants.{column_name} IN :{param_name}",
+        bindparam(param_name, value=values, expanding=True),
+    )
+
+
+def get_filters(filters=None):
+    """
+    Add default filters to filters given by the user.
+
+    :param filters: dictionary of filters (see get_sql_filters), or None
+    :return: dictionary of filters
+    """
+    return {**DEFAULT_FILTERS, **(filters or {})}
+
+
+def get_sql_filters(filters=None, dialect=None):
+    """
+    Compile filters on the participants table into sql predicates.
+
+    Possible filters are:
+    status, cond, counterbalance: list of values to keep (or a single value)
+    beginexp_after, beginexp_before, endhit_after, endhit_before: datetimes (or ISO format strings), after is inclusive
+    datastring_not_null: if True, drop participants without a datastring
+    min_datastring_length: minimum length of datastring (in characters, bytes on MySQL)
+
+    :param filters: dictionary of {filter name : value}, or None for no filters
+    :param dialect: dialect name of database the query will be run on (see get_dialect_name)
+    :return: (predicates, parameters), a list of predicates as strings and a list of their bound parameters
+    """  # noqa: E501
+    filters = filters or {}
+    known_filters = VALUE_FILTERS + list(TIME_FILTERS) + OTHER_FILTERS
+    unknown_filters = set(filters) - set(known_filters)
+    if unknown_filters:
+        raise ValueError(f"Unknown filters: {sorted(unknown_filters)}")
+
+    predicates = []
+    parameters = []
+    for filter_name in VALUE_FILTERS:
+        if filters.get(filter_name) is not None:
+            values = filters[filter_name]
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            predicate, parameter = get_sql_in_predicate(
+                filter_name, f"filter_{filter_name}", values, dialect=dialect
+            )
+            predicates.append(predicate)
+            parameters.append(parameter)
+
+    for filter_name, (column_name, operator) in TIME_FILTERS.items():
+        if filters.get(filter_name) is not None:
+            predicates.append(
+                f"participants.{column_name} {operator} :filter_{filter_name}"
+            )
+            value = filters[filter_name]
+            if isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            # typed, so sqlite compares against datetimes in its storage format
+            parameters.append(
+                bindparam(f"filter_{filter_name}", value=value, type_=DateTime())
+            )
+
+    if filters.get("datastring_not_null"):
+        predicates.append("participants.datastring IS NOT NULL")
+    if filters.get("min_datastring_length") is not None:
+        predicates.append(
+            "LENGTH(participants.datastring) >= :filter_min_datastring_length"
+        )
+        parameters.append(
+            bindparam(
+                "filter_min_datastring_length", value=filters["min_datastring_length"]
+            )
+        )
+    return predicates, parameters
+
+
+def get_sql_query_for_values(
+    column_name, values, dialect=None, columns=None, filters=None
+):
+    """
+    Create a sql query for participants whose column_name is in a list of values.
+
+    :param column_name: participants column to filter on, e.g. "hitid"
+    :param values: list of values as strings
+    :param dialect: dialect name of database the query will be run on (see get_dialect_name)
+    :param columns: list of participants columns to select, or None for all columns
+    :param filters: dictionary of filters (see get_sql_filters), or None
+    :return: query, an sql query with the values bound to it
+    """  # noqa: E501
+    predicate, parameter = get_sql_in_predicate(
+        column_name, f"{column_name}s", values, dialect=dialect
+    )
+    filter_predicates, filter_parameters = get_sql_filters(filters, dialect=dialect)
+
+    return text(
+        f"{get_sql_select(columns)} "
+        f"WHERE {' AND '.join([predicate] + filter_predicates)} "
+        f"{PARTICIPANT_ORDER}"
+    ).bindparams(parameter, *filter_parameters)
+
+
+def get_sql_queries_for_values(
+    column_name,
+    values,
+    chunk_size=DEFAULT_HIT_CHUNK_SIZE,
+    dialect=None,
+    columns=None,
+    filters=None,
+):
+    """
+    Create sql queries for a list of values, with at most chunk_size values per query.
+
+    Participants are ordered within each query, see stream_ordered_query_results to merge them.
+
+    :param column_name: participants column to filter on, e.g. "hitid"
+    :param values: list of values as strings
+    :param chunk_size: maximum number of values in one query, or None for a single query
+    :param dialect: dialect name of database the query will be run on (see get_dialect_name)
+    :param columns: list of participants columns to select, or None for all columns
+    :param filters: dictionary of filters (see get_sql_filters), or None
+    :return: list of sql queries
+    """  # noqa: E501
+    values = list(dict.fromkeys(values))
+    if chunk_size is None:
+        chunk_size = max(len(values), 1)
+
+    return [
+        get_sql_query_for_values(
+            column_name,
+            values[chunk_start : chunk_start + chunk_size],
+            dialect=dialect,
+            columns=columns,
+            filters=filters,
+        )
+        for chunk_start in range(0, len(values), chunk_size)
+    ]
+
+
+def get_sql_query_for_hits(hit_list, dialect=None, columns=None, filters=None):
     """
     Create a sql query for a list of hits.
 
     :param hit_list: list of hits as strings
-    :return: query_string, an sql query, as a string
+    :param dialect: dialect name of database the query will be run on (see get_dialect_name)
+    :param columns: list of participants columns to select, or None for all columns
+    :param filters: dictionary of filters (see get_sql_filters), or None
+    :return: query, an sql query with the hits bound to it
+    """  # noqa: E501
+    return get_sql_query_for_values(
+        "hitid", hit_list, dialect=dialect, columns=columns, filters=filters
+    )
+
+
+def get_sql_queries_for_hits(
+    hit_list,
+    hit_chunk_size=DEFAULT_HIT_CHUNK_SIZE,
+    dialect=None,
+    columns=None,
+    filters=None,
+):
     """
-    query_string = "SELECT * FROM participants WHERE ("
-    for hit_idx, hit in enumerate(hit_list):
-        query_string += "(participants.hitid = '{}')".format(hit)
-        if hit_idx < len(hit_list) - 1:
-            query_string += " or "
+    Create sql queries for a list of hits, with at most hit_chunk_size hits per query.
+
+    :param hit_list: list of hits as strings
+    :param hit_chunk_size: maximum number of hits in one query, or None for a single query
+    :param dialect: dialect name of database the query will be run on (see get_dialect_name)
+    :param columns: list of participants columns to select, or None for all columns
+    :param filters: dictionary of filters (see get_sql_filters), or None
+    :return: list of sql queries
+    """  # noqa: E501
+    return get_sql_queries_for_values(
+        "hitid",
+        hit_list,
+        chunk_size=hit_chunk_size,
+        dialect=dialect,
+        columns=columns,
+        filters=filters,
+    )
+
+
+def create_hit_table(connection, hit_list, columns=None, filters=None, dialect=None):
+    """
+    Create a temporary table containing a list of hits, to join participants against.
+
+    :param connection: open database connection (the table only exists for this connection)
+    :param hit_list: list of hits as strings
+    :param columns: list of participants columns to select, or None for all columns
+    :param filters: dictionary of filters (see get_sql_filters), or None
+    :param dialect: dialect name of database the query will be run on (see get_dialect_name)
+    :return: query, an sql query joining participants against the temporary table
+    """  # noqa: E501
+    connection.execute(
+        text(f"CREATE TEMPORARY TABLE {HIT_TABLE} (hitid VARCHAR(128) PRIMARY KEY)")
+    )
+    connection.execute(
+        text(f"INSERT INTO {HIT_TABLE} (hitid) VALUES (:hitid)"),
+        [{"hitid": hit} for hit in dict.fromkeys(hit_list)],
+    )
+
+    filter_predicates, filter_parameters = get_sql_filters(filters, dialect=dialect)
+    where_clause = (
+        f"WHERE {' AND '.join(filter_predicates)} " if filter_predicates else ""
+    )
+    return text(
+        f"{get_sql_select(columns)} "
+        f"JOIN {HIT_TABLE} ON participants.hitid = {HIT_TABLE}.hitid "
+        f"{where_clause}"
+        f"{PARTICIPANT_ORDER}"
+    ).bindparams(*filter_parameters)
+
+
+def drop_hit_table(connection):
+    """
+    Drop temporary table created by create_hit_table.
+
+    :param connection: connection the table was created on
+    :return: nothing
+    """
+    connection.execute(text(f"DROP TABLE IF EXISTS {HIT_TABLE}"))
+
+
+def stream_query_results(connection, sql_query, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Run a SQL query on an open connection, yielding the results in batches.
+
+    :param connection: open database connection
+    :param sql_query: a sql query, as a string or sqlalchemy text clause
+    :param batch_size: number of rows fetched from the database at a time
+    :return: generator of lists of at most batch_size rows, with a dictionary for each row
+    """  # noqa: E501
+    if isinstance(sql_query, str):
+        sql_query = text(sql_query)
+
+    results = connection.execution_options(
+        stream_results=True, max_row_buffer=batch_size
+    ).execute(sql_query)
+    for batch in results.partitions(batch_size):
+        yield [dict(entry._mapping) for entry in batch]
+
+
+def get_participant_order_key(dialect=None):
+    """
+    Get a sort key ordering participant dicts as PARTICIPANT_ORDER does on a database.
+
+    NULLs are larger than any value on postgresql, and smaller on other databases.
+
+    :param dialect: dialect name of database the participants were read from (see get_dialect_name)
+    :return: key function for sorted or heapq.merge
+    """  # noqa: E501
+    nulls_largest = dialect == "postgresql"
+
+    def compare(first, second):
+        for column, descending in PARTICIPANT_ORDER_COLUMNS:
+            first_value, second_value = first[column], second[column]
+            if first_value == second_value:
+                continue
+            if first_value is None:
+                result = 1 if nulls_largest else -1
+            elif second_value is None:
+                result = -1 if nulls_largest else 1
+            else:
+                result = -1 if first_value < second_value else 1
+            return -result if descending else result
+        return 0
+
+    return functools.cmp_to_key(compare)
+
+
+def get_missing_order_columns(columns=None):
+    """
+    Get columns of PARTICIPANT_ORDER missing from a column projection.
+
+    :param columns: list of participants columns to select, or None for all columns
+    :return: list of columns
+    """
+    if columns is None:
+        return []
+    return [column for column, _ in PARTICIPANT_ORDER_COLUMNS if column not in columns]
+
+
+def stream_ordered_query_results(
+    connection,
+    sql_queries,
+    batch_size=DEFAULT_BATCH_SIZE,
+    dialect=None,
+    drop_columns=(),
+):
+    """
+    Run sql queries returning participants in PARTICIPANT_ORDER, yielding their results merged in that order.
+
+    Participants are ordered as by a single query for all of them (e.g. all chunks of a list of hits),
+    so pids are given out in the same order. All queries are open at the same time, each holding up to batch_size rows.
+
+    :param connection: open database connection
+    :param sql_queries: list of sql queries, selecting at least the PARTICIPANT_ORDER_COLUMNS
+    :param batch_size: number of rows fetched from the database at a time (by each query)
+    :param dialect: dialect name of database the queries are run on (see get_dialect_name)
+    :param drop_columns: columns only selected to order participants, removed from the results
+    :return: generator of lists of at most batch_size rows, with a dictionary for each participant
+    """  # noqa: E501
+    if len(sql_queries) == 1 and not drop_columns:
+        yield from stream_query_results(
+            connection, sql_queries[0], batch_size=batch_size
+        )
+        return
+
+    merged_rows = heapq.merge(
+        *[
+            itertools.chain.from_iterable(
+                stream_query_results(connection, sql_query, batch_size=batch_size)
+            )
+            for sql_query in sql_queries
+        ],
+        key=get_participant_order_key(dialect),
+    )
+    batch = []
+    for row in merged_rows:
+        for column in drop_columns:
+            del row[column]
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_sql_query(sql_query, database_uri, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Run a SQL query on a given database, yielding the results in batches.
+
+    Rows are fetched through a server-side cursor (where the driver supports one),
+    so at most batch_size rows are held in memory at a time.
+
+    :param sql_query: a sql query, as a string or sqlalchemy text clause
+    :param database_uri: a database uri as a string
+    :param batch_size: number of rows fetched from the database at a time
+    :return: generator of lists of at most batch_size rows, with a dictionary for each participant
+    """  # noqa: E501
+    db = get_engine(database_uri)
+    with db.connect() as connection:
+        yield from stream_query_results(connection, sql_query, batch_size=batch_size)
+
+
+def stream_participants_for_hits(
+    hit_list,
+    database_uri,
+    batch_size=DEFAULT_BATCH_SIZE,
+    hit_chunk_size=DEFAULT_HIT_CHUNK_SIZE,
+    temp_table_threshold=DEFAULT_TEMP_TABLE_THRESHOLD,
+    columns=None,
+    filters=None,
+):
+    """
+    Stream all participants for a list of hits from a given database, in batches.
+
+    HIT lists up to hit_chunk_size long are fetched with one query, longer lists with one query per chunk,
+    and lists longer than temp_table_threshold are joined against a temporary table of HIT IDs.
+
+    :param hit_list: list of hits as strings
+    :param database_uri: a database uri as a string
+    :param batch_size: number of rows fetched from the database at a time
+    :param hit_chunk_size: maximum number of hits in one query, or None for a single query
+    :param temp_table_threshold: number of hits above which a temporary table is used, or None to never use one
+    :param columns: list of participants columns to select, or None for all columns
+    :param filters: dictionary of filters compiled into the query (see get_sql_filters), or None
+    :return: generator of lists of at most batch_size rows, with a dictionary for each participant
+    """  # noqa: E501
+    if not hit_list:
+        return
+
+    dialect = get_dialect_name(database_uri)
+    db = get_engine(database_uri)
+    with db.connect() as connection, connection.begin():
+        if temp_table_threshold is not None and len(hit_list) > temp_table_threshold:
+            sql_query = create_hit_table(
+                connection, hit_list, columns=columns, filters=filters, dialect=dialect
+            )
+            try:
+                yield from stream_query_results(
+                    connection, sql_query, batch_size=batch_size
+                )
+            finally:
+                drop_hit_table(connection)
         else:
-            query_string += ") ORDER BY Status DESC, Cond ASC, Beginexp DESC"
-    return query_string
+            drop_columns = get_missing_order_columns(columns)
+            yield from stream_ordered_query_results(
+                connection,
+                get_sql_queries_for_hits(
+                    hit_list,
+                    hit_chunk_size=hit_chunk_size,
+                    dialect=dialect,
+                    columns=None if columns is None else columns + drop_columns,
+                    filters=filters,
+                ),
+                batch_size=batch_size,
+                dialect=dialect,
+                drop_columns=drop_columns,
+            )
 
 
+@profiled("run_sql_query")
 def run_sql_query(sql_query, database_uri):
     """
     Run a SQL query on a given database database.
@@ -62,45 +581,533 @@ def run_sql_query(sql_query, database_uri):
     :param database_uri: a database uri as a string
     :return: all_data, a list of the raw data from the sql query,with a dictionary for each participant
     """  # noqa: E501
-    db = create_engine(database_uri)
-    results = db.execute(sql_query)
-    query_data = [entry for entry in results]
+    query_data = []
+    for batch in stream_sql_query(sql_query, database_uri):
+        query_data.extend(batch)
 
+    add_metrics(rows=len(query_data))
     return query_data
 
 
-def download_from_database(hit_id_file_path, database_uri_keys=None):
+def get_database_uris(database_uri_keys):
     """
-    Download experiment off of database.
+    Get database URIs from environment variables.
 
-    :param hit_id_file_path: path to text file containing a list of all HIT IDs
     :param database_uri_keys: uri key, or list of uri keys
-    :return: participant_dicts, a list containing a dictionary for each participant
+    :return: list of (uri key, database uri) pairs, in the same order as the keys
     """
-    # get database uri
     assert database_uri_keys is not None
     if not isinstance(database_uri_keys, list):
         database_uri_keys = [database_uri_keys]
 
+    return [
+        (database_uri_key, os.environ[database_uri_key])
+        for database_uri_key in database_uri_keys
+    ]
+
+
+def remove_participants_without_data(participant_dicts):
+    """
+    Remove participants without a datastring.
+
+    :param participant_dicts: list of participant dicts from database
+    :return: list of participant dicts that have a datastring
+    """
+    # data string is None is participant didn't do experiment
+    # (or for some reason data didn't get saved)
+    return [
+        participant_dict
+        for participant_dict in participant_dicts
+        if participant_dict["datastring"] is not None
+    ]
+
+
+def stream_from_database(
+    hit_id_file_path,
+    database_uri_keys=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+    yield_batches=False,
+    hit_chunk_size=DEFAULT_HIT_CHUNK_SIZE,
+    temp_table_threshold=DEFAULT_TEMP_TABLE_THRESHOLD,
+    filters=None,
+):
+    """
+    Stream experiment off of database, one participant (or batch of participants) at a time.
+
+    Peak memory is bounded by batch_size rather than by the size of the experiment.
+
+    :param hit_id_file_path: path to text file containing a list of all HIT IDs
+    :param database_uri_keys: uri key, or list of uri keys
+    :param batch_size: number of participants fetched from the database at a time
+    :param yield_batches: if True, yield lists of participant dicts instead of single participant dicts
+    :param hit_chunk_size: maximum number of hits in one query, or None for a single query
+    :param temp_table_threshold: number of hits above which a temporary table of HIT IDs is used, or None to never use one
+    :param filters: dictionary of filters compiled into the query (see get_sql_filters), added to DEFAULT_FILTERS
+    :return: generator of participant dicts (or lists of participant dicts)
+    """  # noqa: E501
+    database_uris = get_database_uris(database_uri_keys)
+
+    # get list of HITs and experiment name
+    hits, exp_name = get_hit_ids(hit_id_file_path)
+
+    for _, database_uri in database_uris:
+        for batch in stream_participants_for_hits(
+            hits,
+            database_uri,
+            batch_size=batch_size,
+            hit_chunk_size=hit_chunk_size,
+            temp_table_threshold=temp_table_threshold,
+            filters=get_filters(filters),
+        ):
+            participant_dicts = remove_participants_without_data(batch)
+            if yield_batches:
+                if participant_dicts:
+                    yield participant_dicts
+            else:
+                yield from participant_dicts
+
+
+def get_projected_columns(columns=None, required_columns=("uniqueid",)):
+    """
+    Get columns to download for a column projection, always including the required columns.
+
+    :param columns: list of participants columns to download, or None for all columns
+    :param required_columns: columns needed by the caller, added if missing from columns
+    :return: list of columns without datastring, in participants table order if columns is None
+    """  # noqa: E501
+    if columns is None:
+        return METADATA_COLUMNS
+    return list(
+        dict.fromkeys(
+            [column for column in columns if column != "datastring"]
+            + list(required_columns)
+        )
+    )
+
+
+def get_uniqueid_query_options(query_options):
+    """
+    Get the options of a download by HIT that also apply to downloads by uniqueid.
+
+    :param query_options: keyword arguments for stream_participants_for_hits
+    :return: dictionary with the UNIQUEID_QUERY_OPTIONS of query_options
+    """
+    return {
+        option: value
+        for option, value in query_options.items()
+        if option in UNIQUEID_QUERY_OPTIONS
+    }
+
+
+def add_datastrings(
+    participant_metadata,
+    database_uri,
+    batch_size=DEFAULT_BATCH_SIZE,
+    hit_chunk_size=DEFAULT_HIT_CHUNK_SIZE,
+):
+    """
+    Download datastrings for participants whose metadata was already downloaded.
+
+    :param participant_metadata: list of participant dicts without datastring, with uniqueid
+    :param database_uri: a database uri as a string
+    :param batch_size: number of rows fetched from the database at a time
+    :param hit_chunk_size: maximum number of uniqueids in one query, or None for a single query
+    :return: participant_dicts, participant_metadata with the datastring of each participant added
+    """  # noqa: E501
+    datastrings = {
+        participant_dict["uniqueid"]: participant_dict["datastring"]
+        for participant_dict in download_participants_for_uniqueids(
+            [participant["uniqueid"] for participant in participant_metadata],
+            database_uri,
+            batch_size=batch_size,
+            hit_chunk_size=hit_chunk_size,
+            columns=["uniqueid", "datastring"],
+        )
+    }
+    return [
+        {**participant, "datastring": datastrings.get(participant["uniqueid"])}
+        for participant in participant_metadata
+    ]
+
+
+@profiled("download_participants_for_hits")
+def download_participants_for_hits(
+    hit_list,
+    database_uri,
+    columns=None,
+    participant_filter=None,
+    filters=None,
+    **query_options,
+):
+    """
+    Download all participants with data for a list of hits from a given database.
+
+    If participant_filter is given, the download happens in two phases: first the metadata columns of
+    all participants are downloaded, then datastrings only for participants that pass the filter.
+
+    :param hit_list: list of hits as strings
+    :param database_uri: a database uri as a string
+    :param columns: list of participants columns to download (datastring is always downloaded), or None for all columns
+    :param participant_filter: function taking a participant dict without datastring, returning whether to keep the participant
+    :param filters: dictionary of filters compiled into the query (see get_sql_filters), added to DEFAULT_FILTERS
+    :param query_options: keyword arguments for stream_participants_for_hits
+    :return: participant_dicts, a list containing a dictionary for each participant
+    """  # noqa: E501
+    filters = get_filters(filters)
+    if participant_filter is None:
+        if columns is not None:
+            columns = get_projected_columns(columns) + ["datastring"]
+
+        participant_dicts = []
+        for batch in stream_participants_for_hits(
+            hit_list, database_uri, columns=columns, filters=filters, **query_options
+        ):
+            participant_dicts.extend(remove_participants_without_data(batch))
+        add_participant_metrics(participant_dicts, keep_largest=False)
+        return participant_dicts
+
+    participant_metadata = []
+    for batch in stream_participants_for_hits(
+        hit_list,
+        database_uri,
+        columns=get_projected_columns(columns),
+        filters=filters,
+        **query_options,
+    ):
+        participant_metadata.extend(
+            participant for participant in batch if participant_filter(participant)
+        )
+
+    participant_dicts = remove_participants_without_data(
+        add_datastrings(
+            participant_metadata,
+            database_uri,
+            **get_uniqueid_query_options(query_options),
+        )
+    )
+    add_participant_metrics(participant_dicts, keep_largest=False)
+    return participant_dicts
+
+
+def download_participants_for_uniqueids(
+    uniqueids,
+    database_uri,
+    batch_size=DEFAULT_BATCH_SIZE,
+    hit_chunk_size=DEFAULT_HIT_CHUNK_SIZE,
+    columns=None,
+):
+    """
+    Download participants with given uniqueids from a given database.
+
+    :param uniqueids: list of uniqueids as strings
+    :param database_uri: a database uri as a string
+    :param batch_size: number of rows fetched from the database at a time
+    :param hit_chunk_size: maximum number of uniqueids in one query, or None for a single query
+    :param columns: list of participants columns to select, or None for all columns
+    :return: participant_dicts, a list containing a dictionary for each participant (including those without data)
+    """  # noqa: E501
+    if not uniqueids:
+        return []
+
+    participant_dicts = []
+    dialect = get_dialect_name(database_uri)
+    drop_columns = get_missing_order_columns(columns)
+    db = get_engine(database_uri)
+    with db.connect() as connection, connection.begin():
+        for batch in stream_ordered_query_results(
+            connection,
+            get_sql_queries_for_values(
+                "uniqueid",
+                uniqueids,
+                chunk_size=hit_chunk_size,
+                dialect=dialect,
+                columns=None if columns is None else columns + drop_columns,
+            ),
+            batch_size=batch_size,
+            dialect=dialect,
+            drop_columns=drop_columns,
+        ):
+            participant_dicts.extend(batch)
+    return participant_dicts
+
+
+@profiled("download_changed_participants_for_hits")
+def download_changed_participants_for_hits(
+    hit_list,
+    database_uri,
+    watermark=None,
+    columns=None,
+    participant_filter=None,
+    filters=None,
+    **query_options,
+):
+    """
+    Download participants that are new or whose status changed since the watermark was recorded.
+
+    Only the lightweight SYNC_COLUMNS (or all metadata columns, if participant_filter is given) are fetched
+    for all participants, full rows are fetched for changed ones.
+
+    :param hit_list: list of hits as strings
+    :param database_uri: a database uri as a string
+    :param watermark: watermark of this database from the last sync, or None
+    :param columns: list of participants columns to download (datastring is always downloaded), or None for all columns
+    :param participant_filter: function taking a participant dict without datastring, returning whether to download the participant
+    :param filters: dictionary of filters compiled into the query (see get_sql_filters), added to DEFAULT_FILTERS
+    :param query_options: keyword arguments for stream_participants_for_hits
+    :return: (participant_dicts, watermark), changed participants with data and the updated watermark
+    """  # noqa: E501
+    # participants excluded by filters are not recorded in the watermark
+    participant_metadata = []
+    for batch in stream_participants_for_hits(
+        hit_list,
+        database_uri,
+        columns=SYNC_COLUMNS if participant_filter is None else METADATA_COLUMNS,
+        filters=get_filters(filters),
+        **query_options,
+    ):
+        participant_metadata.extend(
+            participant
+            for participant in batch
+            if participant_filter is None or participant_filter(participant)
+        )
+
+    if columns is not None:
+        columns = get_projected_columns(columns, SYNC_COLUMNS) + ["datastring"]
+    participant_dicts = download_participants_for_uniqueids(
+        get_changed_uniqueids(participant_metadata, watermark),
+        database_uri,
+        columns=columns,
+        **get_uniqueid_query_options(query_options),
+    )
+    watermark = update_watermark(watermark, participant_dicts)
+    participant_dicts = remove_participants_without_data(participant_dicts)
+    add_participant_metrics(participant_dicts, keep_largest=False)
+    return participant_dicts, watermark
+
+
+def map_databases(download, database_uris, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Run a download function for each database, concurrently on a bounded thread pool.
+
+    :param download: function taking (uri key, database uri)
+    :param database_uris: list of (uri key, database uri) pairs, see get_database_uris
+    :param max_workers: maximum number of databases queried at the same time
+    :return: list of results of download, in the order of database_uris
+    """  # noqa: E501
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(database_uris)))
+    ) as executor:
+        # map keeps results in the order of the databases, downloads are profiled
+        # as stages of the caller's stage
+        return list(executor.map(in_current_context(download), *zip(*database_uris)))
+
+
+def merge_participant_dicts(database_participant_dicts, drop_duplicates=False):
+    """
+    Merge participants downloaded from several databases.
+
+    :param database_participant_dicts: list of lists of participant dicts, one for each database
+    :param drop_duplicates: if True, only keep the first participant with each uniqueid
+    :return: participant_dicts, a list containing a dictionary for each participant
+    """  # noqa: E501
     all_participant_dicts = []
-    for database_uri_key in database_uri_keys:
-        database_uri = os.environ[database_uri_key]
+    seen_uniqueids = set()
+    for participant_dicts in database_participant_dicts:
+        for participant_dict in participant_dicts:
+            if drop_duplicates:
+                if participant_dict["uniqueid"] in seen_uniqueids:
+                    continue
+                seen_uniqueids.add(participant_dict["uniqueid"])
+            all_participant_dicts.append(participant_dict)
+    return all_participant_dicts
 
-        # get list of HITs and experiment name
-        hits, exp_name = get_hit_ids(hit_id_file_path)
 
-        # get sql query and run it
-        sql_query = get_sql_query_for_hits(hits)
-        curr_participant_dicts = run_sql_query(sql_query, database_uri)
-
-        # data string is None is participant didn't do experiment
-        # (or for some reason data didn't get saved)
-        all_participant_dicts.extend(
-            [
-                participant_dict
-                for participant_dict in curr_participant_dicts
-                if participant_dict["datastring"] is not None
-            ]
+@profiled("sync_mirror")
+def sync_mirror(
+    hit_id_file_path, database_uri_keys, mirror_path, max_workers=DEFAULT_MAX_WORKERS
+):
+    """
+    Sync participants of an experiment into a local SQLite mirror.
+
+    Only participants that are new or whose status changed since the last sync of this experiment are downloaded.
+
+    :param hit_id_file_path: path to text file containing a list of all HIT IDs
+    :param database_uri_keys: uri key, or list of uri keys
+    :param mirror_path: path to mirror file (created if it doesn't exist)
+    :param max_workers: maximum number of databases queried at the same time
+    :return: number of participants added to or updated in the mirror (see mirror.write_participants_to_mirror)
+    """  # noqa: E501
+    database_uris = get_database_uris(database_uri_keys)
+
+    # get list of HITs and experiment name
+    hits, exp_name = get_hit_ids(hit_id_file_path)
+
+    mirror_uri = create_mirror(mirror_path)
+    watermarks = load_mirror_watermarks(mirror_uri, exp_name)
+
+    database_results = map_databases(
+        lambda database_uri_key, database_uri: download_changed_participants_for_hits(
+            hits, database_uri, watermarks.get(database_uri_key)
+        ),
+        database_uris,
+        max_workers=max_workers,
+    )
+
+    database_participant_dicts = []
+    for (database_uri_key, _), (participant_dicts, watermark) in zip(
+        database_uris, database_results
+    ):
+        database_participant_dicts.append((database_uri_key, participant_dicts))
+        watermarks[database_uri_key] = watermark
+
+    # participants and watermarks are written together, so a failed sync leaves no trace
+    with stage("write_mirror"), get_engine(mirror_uri).begin() as connection:
+        synced_participant_dicts = write_participants_to_mirror(
+            connection, database_participant_dicts, exp_name, watermarks
         )
+        add_participant_metrics(synced_participant_dicts, keep_largest=False)
+    return len(synced_participant_dicts)
+
+
+@profiled("read_from_mirror")
+def read_from_mirror(hit_list, mirror_path, filters=None, **query_options):
+    """
+    Read all participants with data for a list of hits from a local mirror.
+
+    :param hit_list: list of hits as strings
+    :param mirror_path: path to mirror file, see sync_mirror
+    :param filters: dictionary of filters (see get_sql_filters), or None
+    :param query_options: keyword arguments for download_participants_for_hits
+    :return: participant_dicts, a list containing a dictionary for each participant
+    """  # noqa: E501
+    # datastrings are compressed in the mirror, so their length is checked in python
+    filters = dict(filters or {})
+    min_datastring_length = filters.pop("min_datastring_length", None)
+
+    participant_dicts = [
+        decompress_participant(participant_dict)
+        for participant_dict in download_participants_for_hits(
+            hit_list, get_mirror_uri(mirror_path), filters=filters, **query_options
+        )
+    ]
+    if min_datastring_length is None:
+        return participant_dicts
+    return [
+        participant_dict
+        for participant_dict in participant_dicts
+        if len(participant_dict["datastring"]) >= min_datastring_length
+    ]
+
+
+@profiled("download_from_database")
+def download_from_database(
+    hit_id_file_path,
+    database_uri_keys=None,
+    max_workers=DEFAULT_MAX_WORKERS,
+    drop_duplicates=False,
+    watermark_dir=None,
+    mirror_path=None,
+    columns=None,
+    participant_filter=None,
+    filters=None,
+):
+    """
+    Download experiment off of database.
+
+    When several databases are given, they are queried concurrently.
+
+    If watermark_dir is given, only participants that are new or whose status changed since the last
+    call with the same watermark_dir are downloaded, and the experiment's watermark file is updated.
+
+    If mirror_path is given, participants are read from a local mirror (see sync_mirror) instead,
+    after syncing the mirror with the databases if database_uri_keys are given. Mirrors keep one participant
+    per uniqueid, so reading an experiment synced from several databases needs drop_duplicates.
+
+    :param hit_id_file_path: path to text file containing a list of all HIT IDs
+    :param database_uri_keys: uri key, or list of uri keys (can be None when reading from a mirror)
+    :param max_workers: maximum number of databases queried at the same time
+    :param drop_duplicates: if True, only keep the first participant with each uniqueid (in order of database_uri_keys)
+    :param watermark_dir: directory to keep watermark files in, for incremental syncs (default None, download all participants)
+    :param mirror_path: path to local mirror file to read participants from (default None, read from databases)
+    :param columns: list of participants columns to download (datastring is always downloaded), or None for all columns
+    :param participant_filter: function taking a participant dict without datastring, returning whether to download the participant's datastring
+    :param filters: dictionary of filters compiled into the query, e.g. {"status": [3, 4, 5], "beginexp_after": "2022-04-28"} (see get_sql_filters)
+    :return: participant_dicts, a list containing a dictionary for each participant
+    """  # noqa: E501
+    if mirror_path is not None:
+        if watermark_dir is not None:
+            raise ValueError("Mirrors keep their own watermarks, use one or the other")
+        if database_uri_keys is not None:
+            sync_mirror(
+                hit_id_file_path,
+                database_uri_keys,
+                mirror_path,
+                max_workers=max_workers,
+            )
+        hits, exp_name = get_hit_ids(hit_id_file_path)
+        if (
+            not drop_duplicates
+            and len(load_mirror_watermarks(get_mirror_uri(mirror_path), exp_name)) > 1
+        ):
+            raise ValueError(
+                "Mirrors keep one participant per uniqueid (the first database's), "
+                "pass drop_duplicates=True to read experiments synced from several "
+                "databases"
+            )
+        participant_dicts = read_from_mirror(
+            hits,
+            mirror_path,
+            filters=filters,
+            columns=columns,
+            participant_filter=participant_filter,
+        )
+        add_participant_metrics(participant_dicts)
+        return participant_dicts
+
+    database_uris = get_database_uris(database_uri_keys)
+
+    # get list of HITs and experiment name
+    hits, exp_name = get_hit_ids(hit_id_file_path)
+
+    if watermark_dir is not None:
+        watermark_path = get_watermark_path(watermark_dir, exp_name)
+        watermarks = load_watermark(watermark_path)
+
+        def download(database_uri_key, database_uri):
+            return download_changed_participants_for_hits(
+                hits,
+                database_uri,
+                watermarks.get(database_uri_key),
+                columns=columns,
+                participant_filter=participant_filter,
+                filters=filters,
+            )
+
+    else:
+
+        def download(database_uri_key, database_uri):
+            participant_dicts = download_participants_for_hits(
+                hits,
+                database_uri,
+                columns=columns,
+                participant_filter=participant_filter,
+                filters=filters,
+            )
+            return participant_dicts, None
+
+    database_results = map_databases(download, database_uris, max_workers=max_workers)
+
+    all_participant_dicts = merge_participant_dicts(
+        [participant_dicts for participant_dicts, _ in database_results],
+        drop_duplicates=drop_duplicates,
+    )
+
+    if watermark_dir is not None:
+        for (database_uri_key, _), (_, watermark) in zip(
+            database_uris, database_results
+        ):
+            watermarks[database_uri_key] = watermark
+        save_watermark(watermarks, watermark_path)
 
+    add_participant_metrics(all_participant_dicts)
     return all_participant_dicts
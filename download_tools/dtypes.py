@@ -0,0 +1,206 @@
+"""Compacts dtypes of participant dataframes, and keeps their schema for later loads."""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from download_tools.file_formats import FILE_EXTENSIONS
+
+# string columns become categoricals if they have at most this many unique values a row
+CATEGORY_MAX_FRACTION = 0.5
+
+# id columns stored as nullable integers, even without missing values
+NULLABLE_INT_COLUMNS = ["pid", "event_num"]
+
+# name of schema file, in the directory of an experiment's participant files
+SCHEMA_FILE_NAME = "schema.json"
+
+# integer dtypes, from smallest to largest
+INT_DTYPES = ["int8", "int16", "int32", "int64"]
+
+
+def get_smallest_int_dtype(minimum, maximum, nullable=False):
+    """
+    Get the smallest integer dtype that holds a range of values.
+
+    :param minimum: smallest value
+    :param maximum: largest value
+    :param nullable: if True, get a pandas nullable integer dtype (e.g. Int8) rather than a numpy one
+    :return: dtype name, or None if no integer dtype holds the range
+    """  # noqa: E501
+    for dtype_name in INT_DTYPES:
+        int_info = np.iinfo(dtype_name)
+        if int_info.min <= minimum and maximum <= int_info.max:
+            return dtype_name.capitalize() if nullable else dtype_name
+    return None
+
+
+def infer_compact_dtype(column, nullable=False):
+    """
+    Infer a more compact dtype for a column, keeping its values.
+
+    Strings with few unique values become categoricals, and integers (including floats that only hold
+    integers) become the smallest integer dtype that holds them, nullable if values are missing.
+
+    :param column: pandas series
+    :param nullable: if True, integers always get a nullable dtype (e.g. for ids)
+    :return: dtype name, or None if the column's dtype is already compact
+    """  # noqa: E501
+    values = column.dropna()
+    if len(values) == 0:
+        return None
+
+    if column.dtype == object:
+        if not all(isinstance(value, str) for value in values):
+            return None
+        if values.nunique() > CATEGORY_MAX_FRACTION * len(column):
+            return None
+        # categories take more memory than strings in short columns
+        category_column = column.astype("category")
+        if category_column.memory_usage(deep=True) < column.memory_usage(deep=True):
+            return "category"
+        return None
+
+    if column.dtype.kind == "f":
+        if not (np.isfinite(values).all() and (values == np.floor(values)).all()):
+            return None
+        nullable = nullable or len(values) < len(column)
+    elif column.dtype.kind not in "iu":
+        return None
+
+    dtype_name = get_smallest_int_dtype(values.min(), values.max(), nullable=nullable)
+    if dtype_name is None or dtype_name == str(column.dtype):
+        return None
+    return dtype_name
+
+
+def infer_schema(dataframe):
+    """
+    Infer compact dtypes for a dataframe's columns.
+
+    :param dataframe: dataframe
+    :return: dictionary of {column : dtype name}, for columns that can be compacted
+    """
+    schema = {}
+    for column in dataframe.columns:
+        dtype_name = infer_compact_dtype(
+            dataframe[column], nullable=column in NULLABLE_INT_COLUMNS
+        )
+        if dtype_name is not None:
+            schema[column] = dtype_name
+    return schema
+
+
+def apply_schema(dataframe, schema):
+    """
+    Convert a dataframe's columns to the dtypes of a schema.
+
+    :param dataframe: dataframe
+    :param schema: dictionary of {column : dtype name}, columns the dataframe doesn't have are skipped
+    :return: converted dataframe
+    """  # noqa: E501
+    return dataframe.astype(
+        {column: dtype for column, dtype in schema.items() if column in dataframe}
+    )
+
+
+def get_memory_usage(dataframe):
+    """
+    Get the memory used by a dataframe, including the contents of object columns.
+
+    :param dataframe: dataframe
+    :return: number of bytes
+    """
+    return int(dataframe.memory_usage(deep=True).sum())
+
+
+def compact_dtypes(dataframe, schema=None):
+    """
+    Compact a dataframe's dtypes (see infer_compact_dtype).
+
+    :param dataframe: dataframe
+    :param schema: dictionary of {column : dtype name} to use, default None infers it from the dataframe
+    :return: (compacted dataframe, schema)
+    """  # noqa: E501
+    if schema is None:
+        schema = infer_schema(dataframe)
+    return apply_schema(dataframe, schema), schema
+
+
+def get_memory_report(dataframe, compact_dataframe):
+    """
+    Report memory saved by compacting a dataframe.
+
+    :param dataframe: dataframe before compacting
+    :param compact_dataframe: dataframe after compacting
+    :return: dictionary with bytes used before and after compacting, and bytes saved
+    """
+    memory_bytes = get_memory_usage(dataframe)
+    compact_memory_bytes = get_memory_usage(compact_dataframe)
+    return {
+        "memory_bytes": memory_bytes,
+        "compact_memory_bytes": compact_memory_bytes,
+        "saved_bytes": memory_bytes - compact_memory_bytes,
+    }
+
+
+def get_schema_path(data_path):
+    """
+    Get location of the schema of an experiment's participant files.
+
+    :param data_path: directory participant files are saved in
+    :return: path to schema file
+    """
+    return Path(data_path).joinpath(SCHEMA_FILE_NAME)
+
+
+def save_schema(schemas, data_path):
+    """
+    Save schemas of an experiment's participant files, replacing the old file only once fully written.
+
+    :param schemas: dictionary of {file name without extension : schema}
+    :param data_path: directory participant files are saved in
+    :return: nothing
+    """  # noqa: E501
+    schema_path = get_schema_path(data_path)
+    temporary_path = schema_path.with_suffix(".tmp")
+    with open(temporary_path, "w") as f:
+        json.dump(schemas, f, indent=1, sort_keys=True)
+    os.replace(temporary_path, schema_path)
+
+
+def load_schema(data_path):
+    """
+    Load schemas of an experiment's participant files.
+
+    :param data_path: directory participant files are saved in
+    :return: dictionary of {file name without extension : schema}, empty if no schema was saved
+    """  # noqa: E501
+    schema_path = get_schema_path(data_path)
+    if not schema_path.exists():
+        return {}
+    with open(schema_path, "r") as f:
+        return json.load(f)
+
+
+def load_participant_file(data_path, table_name, format="csv"):
+    """
+    Load a saved participant file, with the compact dtypes in the experiment's schema.
+
+    :param data_path: directory participant files are saved in
+    :param table_name: file name without extension, e.g. general_info or a trial type
+    :param format: "csv", "parquet" or "feather"
+    :return: dataframe
+    """
+    if format not in FILE_EXTENSIONS:
+        raise ValueError(
+            f"Unknown format: {format} (available: {list(FILE_EXTENSIONS)})"
+        )
+    schema = load_schema(data_path).get(table_name, {})
+    file_path = Path(data_path).joinpath(f"{table_name}.{FILE_EXTENSIONS[format]}")
+    if format == "csv":
+        return pd.read_csv(file_path, dtype=schema)
+    dataframe = getattr(pd, f"read_{format}")(file_path)
+    return apply_schema(dataframe, schema)
@@ -0,0 +1,90 @@
+"""Process-wide registry of database engines, so connection pools are reused."""
+import atexit
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+# connection pool settings used when an engine is first created
+engine_settings = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+}
+
+# settings sqlite's default pools (which don't keep a fixed pool) don't accept
+QUEUE_POOL_SETTINGS = ["pool_size", "max_overflow"]
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def configure_engines(**settings):
+    """
+    Change connection pool settings for engines created from now on.
+
+    :param settings: keyword arguments for sqlalchemy's create_engine, e.g. pool_size, pool_pre_ping or pool_recycle
+    :return: nothing, updates engine_settings
+    """  # noqa: E501
+    engine_settings.update(settings)
+
+
+def get_engine_kwargs(database_uri, settings=None):
+    """
+    Get keyword arguments to create an engine for a database with.
+
+    :param database_uri: a database uri as a string
+    :param settings: settings to use instead of engine_settings, if any
+    :return: dictionary of keyword arguments for create_engine
+    """
+    engine_kwargs = {**engine_settings, **(settings or {})}
+    if make_url(database_uri).get_backend_name() == "sqlite":
+        for setting in QUEUE_POOL_SETTINGS:
+            engine_kwargs.pop(setting, None)
+    return engine_kwargs
+
+
+def get_engine(database_uri, **settings):
+    """
+    Get engine for a database, creating it the first time the database is used.
+
+    Engines are cached by URI, so later calls reuse the engine's connection pool.
+    Settings only apply when the engine is created, call dispose_engine to change them.
+
+    :param database_uri: a database uri as a string
+    :param settings: keyword arguments overriding engine_settings for this engine
+    :return: sqlalchemy engine
+    """  # noqa: E501
+    with _engines_lock:
+        if database_uri not in _engines:
+            _engines[database_uri] = create_engine(
+                database_uri, **get_engine_kwargs(database_uri, settings)
+            )
+        return _engines[database_uri]
+
+
+def dispose_engine(database_uri):
+    """
+    Close all pooled connections of a database's engine and remove it from the registry.
+
+    :param database_uri: a database uri as a string
+    :return: nothing
+    """  # noqa: E501
+    with _engines_lock:
+        engine = _engines.pop(database_uri, None)
+    if engine is not None:
+        engine.dispose()
+
+
+def dispose_engines():
+    """
+    Close all pooled connections of all engines in the registry.
+
+    :return: nothing
+    """
+    for database_uri in list(_engines):
+        dispose_engine(database_uri)
+
+
+atexit.register(dispose_engines)
@@ -0,0 +1,170 @@
+"""Keeps track of which participants were already exported, for incremental exports."""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from download_tools.watermarks import hash_uniqueid
+
+# name of manifest file, in the directory of an experiment's participant files
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+def get_manifest_path(data_path):
+    """
+    Get location of the manifest of an experiment's participant files.
+
+    :param data_path: directory participant files are saved in
+    :return: path to manifest file
+    """
+    return Path(data_path).joinpath(MANIFEST_FILE_NAME)
+
+
+def load_manifest(data_path):
+    """
+    Load manifest of an experiment's participant files.
+
+    :param data_path: directory participant files are saved in
+    :return: manifest dictionary (see create_manifest), or None if files weren't exported incrementally yet
+    """  # noqa: E501
+    manifest_path = get_manifest_path(data_path)
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, data_path):
+    """
+    Save manifest of an experiment's participant files, replacing the old file only once fully written.
+
+    :param manifest: manifest dictionary (see create_manifest)
+    :param data_path: directory participant files are saved in
+    :return: nothing
+    """  # noqa: E501
+    manifest_path = get_manifest_path(data_path)
+    temporary_path = manifest_path.with_suffix(".tmp")
+    with open(temporary_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temporary_path, manifest_path)
+
+
+def get_participant_statuses(participant_dicts):
+    """
+    Get hashed uniqueid and status of participants, so worker IDs are not stored in the manifest.
+
+    :param participant_dicts: list of participant dicts, downloaded from database
+    :return: list of [hashed uniqueid, status], in the order of participant_dicts
+    """  # noqa: E501
+    return [
+        [hash_uniqueid(participant_dict["uniqueid"]), participant_dict["status"]]
+        for participant_dict in participant_dicts
+    ]
+
+
+def get_table_state(dataframe):
+    """
+    Get the columns of a saved table, and what their dtypes depend on.
+
+    :param dataframe: dataframe as saved
+    :return: dictionary with list of columns, list of dtype names and list of whether each column only has missing values
+    """  # noqa: E501
+    return {
+        "columns": list(dataframe.columns),
+        "dtypes": [str(dtype) for dtype in dataframe.dtypes],
+        "all_missing": [
+            bool(dataframe[column].isna().all()) for column in dataframe.columns
+        ],
+    }
+
+
+def create_manifest(participant_statuses, tables, trial_types):
+    """
+    Create manifest of exported participants and tables.
+
+    :param participant_statuses: list of [hashed uniqueid, status] of exported participants, in the order they were exported (see get_participant_statuses)
+    :param tables: dictionary of {table name : dataframe}, see save_participant_files.get_export_tables
+    :param trial_types: list of trial types files were saved for
+    :return: manifest dictionary
+    """  # noqa: E501
+    return {
+        "participants": participant_statuses,
+        "tables": {
+            table_name: get_table_state(dataframe)
+            for table_name, dataframe in tables.items()
+        },
+        "trial_types": list(trial_types),
+    }
+
+
+def get_dtype_sample(dtype_name, all_missing):
+    """
+    Get a one value series standing in for a saved column, when combining dtypes.
+
+    :param dtype_name: name of the column's dtype
+    :param all_missing: whether the column only has missing values
+    :return: pandas series, or None for dtypes that are not combined (which need a rebuild)
+    """  # noqa: E501
+    dtype = pd.api.types.pandas_dtype(dtype_name)
+    if all_missing:
+        return pd.Series([None if dtype == object else np.nan], dtype=dtype)
+    if dtype == object:
+        return pd.Series([""], dtype=dtype)
+    if dtype.kind in "iufb":
+        return pd.Series([1], dtype=dtype)
+    if dtype.kind == "M":
+        return pd.Series([pd.Timestamp(0, tz=getattr(dtype, "tz", None))], dtype=dtype)
+    return None
+
+
+def combine_table_state(table_state, dataframe):
+    """
+    Combine the state of a saved table with a dataframe of new rows, if the new rows can be appended.
+
+    Rows can be appended if no saved column changes dtype, as that would change how its saved rows are
+    formatted (e.g. 1 becoming 1.0). Columns only the new rows have are added to the end of the table.
+
+    :param table_state: state of saved table, see get_table_state
+    :param dataframe: dataframe of new rows
+    :return: (state of combined table, dictionary of {column : dtype} to convert new rows to), or None if the table has to be rebuilt
+    """  # noqa: E501
+    columns = list(table_state["columns"])
+    columns.extend(column for column in dataframe.columns if column not in columns)
+
+    saved_columns = {
+        column: (dtype_name, all_missing)
+        for column, dtype_name, all_missing in zip(
+            table_state["columns"], table_state["dtypes"], table_state["all_missing"]
+        )
+    }
+    combined_state = {"columns": columns, "dtypes": [], "all_missing": []}
+    dtypes = {}
+    for column in columns:
+        # rows without the column are missing values, as when concatenating dataframes
+        saved_frame = pd.DataFrame(index=[0])
+        all_missing = True
+        if column in saved_columns:
+            dtype_name, all_missing = saved_columns[column]
+            try:
+                saved_sample = get_dtype_sample(dtype_name, all_missing)
+            except TypeError:
+                return None
+            if saved_sample is None:
+                return None
+            saved_frame = pd.DataFrame({column: saved_sample})
+
+        new_frame = pd.DataFrame(index=[0])
+        if column in dataframe:
+            new_frame = dataframe[[column]]
+            all_missing = all_missing and bool(dataframe[column].isna().all())
+        dtype = pd.concat([saved_frame, new_frame])[column].dtype
+
+        if column in saved_columns and str(dtype) != saved_columns[column][0]:
+            return None
+        if column in dataframe and dataframe[column].dtype != dtype:
+            dtypes[column] = dtype
+        combined_state["dtypes"].append(str(dtype))
+        combined_state["all_missing"].append(all_missing)
+    return combined_state, dtypes
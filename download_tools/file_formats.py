@@ -0,0 +1,295 @@
+"""Writes participant dataframes as csv, Parquet or Feather files."""
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+from download_tools.profiling import add_metrics, in_current_context, profiled, stage
+
+# file extension of each output format
+FILE_EXTENSIONS = {"csv": "csv", "parquet": "parquet", "feather": "feather"}
+
+# compression codec for columnar formats
+DEFAULT_COMPRESSION = "zstd"
+
+# number of files written at the same time by save_tables
+DEFAULT_MAX_WORKERS = 8
+
+
+def encode_json(value):
+    """
+    Encode a value of a column arrow can't store natively as a JSON string.
+
+    :param value: value of dataframe cell
+    :return: JSON string, or None for missing values
+    """
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return json.dumps(value)
+
+
+def contains_dict(value):
+    """
+    Check whether a value of a column is or contains a dict.
+
+    :param value: value of dataframe cell
+    :return: True if value is a dict, or a list with a dict in it
+    """
+    if isinstance(value, dict):
+        return True
+    if isinstance(value, (list, tuple)):
+        return any(contains_dict(item) for item in value)
+    return False
+
+
+def to_arrow_column(column):
+    """
+    Convert a dataframe column to an arrow array, keeping nested lists natively.
+
+    Columns with dicts are stored as JSON strings, as arrow would type them as structs with the keys of all dicts, reading keys a dict doesn't have back as None.
+    Columns arrow can't type (e.g. lists mixing strings and numbers) are also stored as JSON strings.
+
+    :param column: pandas series
+    :return: pyarrow array
+    """  # noqa: E501
+    if column.dtype == object and column.map(contains_dict).any():
+        return pa.array(column.map(encode_json), type=pa.string())
+    try:
+        return pa.array(column, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return pa.array(column.map(encode_json), type=pa.string())
+
+
+def to_arrow_table(dataframe, dictionary_encode=False):
+    """
+    Convert a dataframe to an arrow table (without its index).
+
+    :param dataframe: dataframe
+    :param dictionary_encode: if True, dictionary encode string columns
+    :return: pyarrow table
+    """
+    arrays = []
+    for column_name in dataframe.columns:
+        array = to_arrow_column(dataframe[column_name])
+        if dictionary_encode and pa.types.is_string(array.type):
+            array = array.dictionary_encode()
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, names=[str(name) for name in dataframe.columns])
+
+
+def save_table(dataframe, data_path, table_name, format="csv"):
+    """
+    Save a dataframe in the given format, without its index.
+
+    Parquet and Feather files are compressed and dictionary encoded, and keep list columns natively (dict columns as JSON strings).
+
+    :param dataframe: dataframe to save
+    :param data_path: directory to save the file in, as a pathlib Path
+    :param table_name: file name without extension, e.g. general_info or a trial type
+    :param format: "csv", "parquet" or "feather"
+    :return: path of saved file
+    """  # noqa: E501
+    if format not in FILE_EXTENSIONS:
+        raise ValueError(
+            f"Unknown format: {format} (available: {list(FILE_EXTENSIONS)})"
+        )
+    if format != "csv" and pa is None:
+        raise ImportError(
+            f"Saving {format} files requires pyarrow, install it with "
+            "pip install -e .[columnar]"
+        )
+
+    file_path = data_path.joinpath(f"{table_name}.{FILE_EXTENSIONS[format]}")
+    if format == "csv":
+        dataframe.to_csv(file_path, index=False)
+    elif format == "parquet":
+        # parquet dictionary encodes columns itself
+        pq.write_table(
+            to_arrow_table(dataframe),
+            file_path,
+            compression=DEFAULT_COMPRESSION,
+            use_dictionary=True,
+        )
+    else:
+        feather.write_feather(
+            to_arrow_table(dataframe, dictionary_encode=True),
+            file_path,
+            compression=DEFAULT_COMPRESSION,
+        )
+    return file_path
+
+
+def timed_save_table(dataframe, data_path, table_name, format="csv"):
+    """
+    Save a dataframe with save_table, timing the write.
+
+    :param dataframe: dataframe to save
+    :param data_path: directory to save the file in, as a pathlib Path
+    :param table_name: file name without extension
+    :param format: "csv", "parquet" or "feather"
+    :return: dictionary with path of saved file, number of rows and seconds taken
+    """
+    start_time = time.perf_counter()
+    with stage("save_table"):
+        file_path = save_table(dataframe, data_path, table_name, format=format)
+        add_metrics(rows=len(dataframe), bytes=os.path.getsize(file_path))
+    return {
+        "path": file_path,
+        "rows": len(dataframe),
+        "seconds": time.perf_counter() - start_time,
+    }
+
+
+@profiled("save_tables")
+def save_tables(
+    tables, data_path, format="csv", max_workers=DEFAULT_MAX_WORKERS, progress=None
+):
+    """
+    Save dataframes concurrently on a pool of threads, so slow storage (e.g. NFS) is written to in parallel.
+
+    The largest tables are started first, so the total time is close to that of the largest file.
+
+    :param tables: dictionary of {file name without extension : dataframe}
+    :param data_path: directory to save the files in, as a pathlib Path
+    :param format: "csv", "parquet" or "feather" (see save_table)
+    :param max_workers: maximum number of files written at the same time, 1 writes them one after another
+    :param progress: function called with each table name and its report (see timed_save_table) once it is saved, default None
+    :return: dictionary of {file name without extension : report}, in the order of tables
+    """  # noqa: E501
+    if format not in FILE_EXTENSIONS:
+        raise ValueError(
+            f"Unknown format: {format} (available: {list(FILE_EXTENSIONS)})"
+        )
+
+    reports = {}
+    # writes are profiled as stages of this stage
+    save_table_in_context = in_current_context(timed_save_table)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                save_table_in_context, tables[table_name], data_path, table_name, format
+            ): table_name
+            for table_name in sorted(
+                tables, key=lambda table_name: len(tables[table_name]), reverse=True
+            )
+        }
+        for future in as_completed(futures):
+            table_name = futures[future]
+            reports[table_name] = future.result()
+            if progress is not None:
+                progress(table_name, reports[table_name])
+    return {table_name: reports[table_name] for table_name in tables}
+
+
+class CsvAppender(object):
+    """
+    Append dataframes to csv files batch by batch, without holding earlier batches in memory.
+
+    Columns that first appear in a later batch are added to the end of the file's header,
+    and rows already written get an empty value for them. Files are overwritten when
+    a table is first written to by an appender, unless they are given in columns.
+
+    :param data_path: directory to save files in, as a pathlib Path
+    :param columns: dictionary of {file name without extension : list of columns} of existing files to append to, default None
+    """  # noqa: E501
+
+    def __init__(self, data_path, columns=None):  # noqa D107
+        self.data_path = data_path
+        # columns of each file written so far, in file order
+        self.columns = {
+            table_name: list(table_columns)
+            for table_name, table_columns in (columns or {}).items()
+        }
+
+    def get_path(self, table_name):
+        """
+        Get path of a table's csv file.
+
+        :param table_name: file name without extension
+        :return: path of csv file
+        """
+        return self.data_path.joinpath(f"{table_name}.csv")
+
+    def add_columns(self, table_name, columns):
+        """
+        Add columns a csv file doesn't have yet to its end, rewriting it row by row.
+
+        :param table_name: file name without extension
+        :param columns: list of columns the file should have
+        :return: nothing
+        """
+        known_columns = set(self.columns[table_name])
+        new_columns = [column for column in columns if column not in known_columns]
+        if not new_columns:
+            return
+
+        file_path = self.get_path(table_name)
+        tmp_path = file_path.with_suffix(".csv.tmp")
+        with open(file_path, "r", newline="") as source, open(
+            tmp_path, "w", newline=""
+        ) as target:
+            reader = csv.reader(source)
+            # same line terminator as pandas' to_csv
+            writer = csv.writer(target, lineterminator=os.linesep)
+            writer.writerow(next(reader) + [str(column) for column in new_columns])
+            empty_values = [""] * len(new_columns)
+            for row in reader:
+                writer.writerow(row + empty_values)
+        os.replace(tmp_path, file_path)
+        self.columns[table_name].extend(new_columns)
+
+    def write(self, table_name, dataframe, columns=None):
+        """
+        Append a dataframe to a table's csv file (without its index).
+
+        :param table_name: file name without extension
+        :param dataframe: dataframe to append
+        :param columns: list of columns the file should have (missing ones are empty), default the dataframe's columns
+        :return: nothing
+        """  # noqa: E501
+        if columns is None:
+            columns = list(dataframe.columns)
+
+        if table_name not in self.columns:
+            self.columns[table_name] = list(columns)
+            dataframe.reindex(columns=columns).to_csv(
+                self.get_path(table_name), index=False
+            )
+            return
+
+        self.add_columns(table_name, columns)
+        dataframe.reindex(columns=self.columns[table_name]).to_csv(
+            self.get_path(table_name), mode="a", header=False, index=False
+        )
+
+    def sort_rows(self, table_name, key_columns):
+        """
+        Sort the rows of a csv file by some of its columns (as strings), rewriting it.
+
+        :param table_name: file name without extension
+        :param key_columns: list of columns to sort by
+        :return: nothing
+        """
+        file_path = self.get_path(table_name)
+        with open(file_path, "r", newline="") as source:
+            reader = csv.reader(source)
+            header = next(reader)
+            rows = list(reader)
+
+        key_indices = [header.index(str(column)) for column in key_columns]
+        rows.sort(key=lambda row: [row[key_index] for key_index in key_indices])
+
+        tmp_path = file_path.with_suffix(".csv.tmp")
+        with open(tmp_path, "w", newline="") as target:
+            writer = csv.writer(target, lineterminator=os.linesep)
+            writer.writerow(header)
+            writer.writerows(rows)
+        os.replace(tmp_path, file_path)
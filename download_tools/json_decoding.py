@@ -0,0 +1,130 @@
+"""Pluggable JSON decoding of datastrings, using orjson when it is installed."""
+import gc
+import json
+import re
+import threading
+from contextlib import contextmanager
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+# orjson turns integers below -2 ** 63 or above 2 ** 64 - 1 into floats, which it
+# encodes with an exponent of at least 18 (e.g. 1.8446744073709552e19)
+LARGE_FLOAT_EXPONENT = re.compile(rb"e(?:1[89]|[2-9][0-9]|[1-3][0-9]{2})")
+
+# number of paused_gc contexts running (e.g. on several threads), and whether the
+# garbage collector was enabled when the first of them started
+_gc_pauses = {"count": 0, "was_enabled": False}
+_gc_lock = threading.Lock()
+
+
+def has_large_float(decoded):
+    """
+    Check whether a document decoded by orjson (may) contain integers it couldn't decode exactly.
+
+    The document is encoded again, which is much faster than walking it or searching the JSON it was
+    decoded from for long integers. Floats of at least 1e18 and strings like "e18" are also counted,
+    so a few documents are reported that didn't have large integers.
+
+    :param decoded: JSON document decoded by orjson
+    :return: True if decoded (may) contain an integer below -2 ** 63 or above 2 ** 64 - 1, as a float
+    """  # noqa: E501
+    return LARGE_FLOAT_EXPONENT.search(orjson.dumps(decoded)) is not None
+
+
+def stdlib_loads(data):
+    """
+    Decode JSON with the standard library.
+
+    :param data: JSON document as str, bytes, bytearray or memoryview
+    :return: decoded JSON document
+    """
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def orjson_loads(data):
+    """
+    Decode JSON with orjson, falling back to the standard library for documents orjson rejects.
+
+    orjson reads bytes and memoryviews without copying them into a str first. It doesn't accept
+    NaN or Infinity and turns integers over 64 bits into floats, so documents it rejects or that
+    (may) contain large integers are decoded again by the standard library, giving the same result.
+
+    :param data: JSON document as str, bytes, bytearray or memoryview
+    :return: decoded JSON document
+    """  # noqa: E501
+    try:
+        decoded = orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return stdlib_loads(data)
+    if has_large_float(decoded):
+        return stdlib_loads(data)
+    return decoded
+
+
+# available backends, by name
+JSON_BACKENDS = {"json": stdlib_loads}
+if orjson is not None:
+    JSON_BACKENDS["orjson"] = orjson_loads
+
+DEFAULT_JSON_BACKEND = "orjson" if orjson is not None else "json"
+_backend = {"loads": JSON_BACKENDS[DEFAULT_JSON_BACKEND]}
+
+
+def set_json_backend(backend=None):
+    """
+    Set the backend used to decode datastrings.
+
+    :param backend: name of a backend in JSON_BACKENDS, a function taking a JSON document and returning the decoded document, or None for DEFAULT_JSON_BACKEND
+    :return: nothing
+    """  # noqa: E501
+    if backend is None:
+        backend = DEFAULT_JSON_BACKEND
+    if isinstance(backend, str):
+        if backend not in JSON_BACKENDS:
+            raise ValueError(
+                f"Unknown JSON backend: {backend} (available: {list(JSON_BACKENDS)})"
+            )
+        backend = JSON_BACKENDS[backend]
+    _backend["loads"] = backend
+
+
+@contextmanager
+def paused_gc():
+    """
+    Pause the garbage collector while decoding many documents.
+
+    Decoded documents are acyclic, but the many containers they create trigger repeated
+    garbage collections over everything already decoded, which can take longer than decoding.
+    The collector is paused for the whole process, so contexts running at the same time on
+    several threads are counted, and it is only enabled again once the last of them exits.
+
+    :return: context manager
+    """  # noqa: E501
+    with _gc_lock:
+        if _gc_pauses["count"] == 0:
+            _gc_pauses["was_enabled"] = gc.isenabled()
+            gc.disable()
+        _gc_pauses["count"] += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_pauses["count"] -= 1
+            if _gc_pauses["count"] == 0 and _gc_pauses["was_enabled"]:
+                gc.enable()
+
+
+def loads(data):
+    """
+    Decode JSON with the current backend (see set_json_backend).
+
+    :param data: JSON document as str, bytes, bytearray or memoryview
+    :return: decoded JSON document
+    """
+    return _backend["loads"](data)
@@ -1,4 +1,55 @@
 """Provides a way to anonymize data."""
+import sqlite3
+import threading
+from pathlib import Path
+
+import dill as pickle
+import numpy as np
+import pandas as pd
+
+# labeler files with these suffixes are SQLite labeler stores, others are pickled labels
+LABELER_STORE_SUFFIXES = [".db", ".sqlite", ".sqlite3"]
+
+# labels are unique, so looking up keys by label (and the next label) is indexed too
+LABELS_SCHEMA = """CREATE TABLE IF NOT EXISTS labels (
+    key TEXT NOT NULL,
+    label INTEGER NOT NULL UNIQUE,
+    PRIMARY KEY (key)
+)"""
+
+# seconds to wait for another process's write to a labeler store to finish
+LABELER_STORE_TIMEOUT = 60
+# maximum number of keys looked up in a labeler store in one query
+LABELER_STORE_BATCH_SIZE = 500
+
+
+def factorize_keys(keys):
+    """
+    Split keys into codes and unique keys, in order of first appearance.
+
+    :param keys: pandas series, numpy array or list of keys
+    :return: (numpy array of codes, list of unique keys), so keys are unique_keys[codes]
+    """  # noqa: E501
+    if isinstance(keys, list):
+        keys = np.asarray(keys, dtype=object)
+    codes, unique_keys = pd.factorize(keys)
+    if (codes == -1).any():
+        raise ValueError("Missing values can't be labeled")
+    return codes, unique_keys.tolist()
+
+
+def get_keys_array(unique_keys, codes):
+    """
+    Get keys for codes, as an object array.
+
+    :param unique_keys: list of unique keys
+    :param codes: numpy array of codes
+    :return: numpy array of keys
+    """
+    # filled in, so e.g. tuple keys don't become a 2d array
+    keys = np.empty(len(unique_keys), dtype=object)
+    keys[:] = unique_keys
+    return keys[codes]
 
 
 class Labeler(object):
@@ -28,4 +79,369 @@ class Labeler(object):
     def unlabel(self, label):  # noqa D107
         return self.keys[label]
 
+    def label_many(self, keys):
+        """
+        Label keys all at once, new keys getting labels in order of first appearance.
+
+        :param keys: pandas series, numpy array or list of keys
+        :return: numpy array of integer labels, in the order of keys
+        """
+        codes, unique_keys = factorize_keys(keys)
+        new_keys = [key for key in unique_keys if key not in self.labels]
+        if new_keys:
+            num_labels = len(self.labels)
+            self.labels.update(
+                zip(new_keys, range(num_labels, num_labels + len(new_keys)))
+            )
+            self.keys.extend(new_keys)
+        unique_labels = np.array(
+            [self.labels[key] for key in unique_keys], dtype=np.int64
+        )
+        return unique_labels[codes]
+
+    def unlabel_many(self, labels):
+        """
+        Get the keys of labels all at once.
+
+        :param labels: pandas series, numpy array or list of integer labels
+        :return: numpy array of keys, in the order of labels
+        """
+        codes, unique_labels = factorize_keys(labels)
+        return get_keys_array([self.keys[label] for label in unique_labels], codes)
+
     __call__ = label
+
+
+class LockedLabeler(Labeler):
+    """
+    Labeler that can be shared by threads, e.g. exports of several experiments at once.
+
+    Labels are still unique and consecutive, but with several threads labeling new keys
+    at the same time, which thread's keys come first depends on timing.
+    """
+
+    def __init__(self, init=(), already_labeled=None):  # noqa D107
+        self.lock = threading.Lock()
+        super().__init__(init=init, already_labeled=already_labeled)
+
+    def label(self, x):  # noqa D107
+        # labeled keys don't need the lock, as labels are only ever added
+        label = self.labels.get(x)
+        if label is not None:
+            return label
+        with self.lock:
+            return super().label(x)
+
+    def label_many(self, keys):  # noqa D102
+        with self.lock:
+            return super().label_many(keys)
+
+    __call__ = label
+
+
+class IdentityLabeler(object):
+    """Keep keys as they are, e.g. in worker processes whose keys are labeled by the parent process."""  # noqa: E501
+
+    def label(self, x):  # noqa D107
+        return x
+
+    def label_many(self, keys):
+        """
+        Keep keys as they are.
+
+        :param keys: pandas series, numpy array or list of keys
+        :return: numpy array of keys
+        """
+        codes, unique_keys = factorize_keys(keys)
+        return get_keys_array(unique_keys, codes)
+
+    __call__ = label
+
+
+class SqliteLabeler(object):
+    """
+    Assign unique integer labels, kept in an indexed SQLite file rather than a pickled dictionary.
+
+    Keys are looked up one at a time, without loading all labels, and new labels are inserted
+    (never changed) as soon as they are given out, each in a transaction that locks the file for writing.
+    So several threads or processes can share a store, without handing out duplicate labels or losing any.
+    Keys are stored as strings.
+
+    :param store_path: path to labeler store file (created if it doesn't exist)
+    """  # noqa: E501
+
+    def __init__(self, store_path):  # noqa D107
+        self.store_path = Path(store_path)
+        self.store_path.parent.mkdir(exist_ok=True, parents=True)
+        # autocommit, transactions are started explicitly
+        self.connection = sqlite3.connect(
+            self.store_path,
+            timeout=LABELER_STORE_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        # the connection is shared by threads, one statement at a time
+        self.lock = threading.Lock()
+        # labels never change, so labels looked up once are kept
+        self.cache = {}
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(LABELS_SCHEMA)
+
+    def lookup(self, x):
+        """
+        Get the label of a key, without labeling it.
+
+        :param x: key
+        :return: label, or None if the key isn't labeled
+        """
+        label = self.cache.get(x)
+        if label is None:
+            with self.lock:
+                row = self.connection.execute(
+                    "SELECT label FROM labels WHERE key = ?", (x,)
+                ).fetchone()
+            if row is None:
+                return None
+            label = self.cache[x] = row[0]
+        return label
+
+    def label(self, x):  # noqa D107
+        label = self.lookup(x)
+        if label is not None:
+            return label
+        with self.lock:
+            # BEGIN IMMEDIATE locks the file for writing, so the next label is ours
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO labels (key, label) "
+                    "SELECT ?, COALESCE(MAX(label) + 1, 0) FROM labels",
+                    (x,),
+                )
+                (label,) = self.connection.execute(
+                    "SELECT label FROM labels WHERE key = ?", (x,)
+                ).fetchone()
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        self.cache[x] = label
+        return label
+
+    def unlabel(self, label):  # noqa D107
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT key FROM labels WHERE label = ?", (label,)
+            ).fetchone()
+        if row is None:
+            raise IndexError(f"No key with label {label}")
+        return row[0]
+
+    def select_many(self, column, values, other_column):
+        """
+        Look up rows of the store by one column, a batch of values per query.
+
+        Needs the lock to be held.
+
+        :param column: "key" or "label"
+        :param values: list of values of column
+        :param other_column: column to get for each value
+        :return: dictionary of {value : other column's value}, for values the store has
+        """
+        rows = {}
+        for batch_start in range(0, len(values), LABELER_STORE_BATCH_SIZE):
+            batch = values[batch_start : batch_start + LABELER_STORE_BATCH_SIZE]
+            rows.update(
+                self.connection.execute(
+                    f"SELECT {column}, {other_column} FROM labels "
+                    f"WHERE {column} IN ({', '.join('?' * len(batch))})",
+                    batch,
+                )
+            )
+        return rows
+
+    def label_many(self, keys):
+        """
+        Label keys all at once, new keys getting labels in order of first appearance.
+
+        Labels are looked up a batch of keys per query, and all new keys are inserted in one transaction.
+
+        :param keys: pandas series, numpy array or list of keys
+        :return: numpy array of integer labels, in the order of keys
+        """  # noqa: E501
+        codes, unique_keys = factorize_keys(keys)
+        uncached_keys = [str(key) for key in unique_keys if key not in self.cache]
+        if uncached_keys:
+            with self.lock:
+                labels = self.select_many("key", uncached_keys, "label")
+                new_keys = [key for key in uncached_keys if key not in labels]
+                if new_keys:
+                    # locks the file for writing, so the next labels are ours
+                    self.connection.execute("BEGIN IMMEDIATE")
+                    try:
+                        # other processes may have labeled some keys since
+                        labels.update(self.select_many("key", new_keys, "label"))
+                        new_keys = [key for key in new_keys if key not in labels]
+                        (num_labels,) = self.connection.execute(
+                            "SELECT COALESCE(MAX(label) + 1, 0) FROM labels"
+                        ).fetchone()
+                        new_labels = dict(
+                            zip(
+                                new_keys,
+                                range(num_labels, num_labels + len(new_keys)),
+                            )
+                        )
+                        self.connection.executemany(
+                            "INSERT INTO labels (key, label) VALUES (?, ?)",
+                            new_labels.items(),
+                        )
+                        self.connection.execute("COMMIT")
+                    except BaseException:
+                        self.connection.execute("ROLLBACK")
+                        raise
+                    labels.update(new_labels)
+            for key in unique_keys:
+                if key not in self.cache:
+                    self.cache[key] = labels[str(key)]
+
+        unique_labels = np.array(
+            [self.cache[key] for key in unique_keys], dtype=np.int64
+        )
+        return unique_labels[codes]
+
+    def unlabel_many(self, labels):
+        """
+        Get the keys of labels all at once.
+
+        :param labels: pandas series, numpy array or list of integer labels
+        :return: numpy array of keys, in the order of labels
+        """
+        codes, unique_labels = factorize_keys(labels)
+        unique_labels = [int(label) for label in unique_labels]
+        with self.lock:
+            keys = self.select_many("label", unique_labels, "key")
+        missing_labels = [label for label in unique_labels if label not in keys]
+        if missing_labels:
+            raise IndexError(f"No key with label {missing_labels[0]}")
+        return get_keys_array([keys[label] for label in unique_labels], codes)
+
+    def get_labels(self):
+        """
+        Get all labels, e.g. to save them in the pickled format.
+
+        :return: dictionary of {key : label}
+        """
+        with self.lock:
+            return dict(self.connection.execute("SELECT key, label FROM labels"))
+
+    def close(self):
+        """
+        Close the connection to the store.
+
+        :return: nothing
+        """
+        with self.lock:
+            self.connection.close()
+
+    __call__ = label
+
+
+def migrate_pickle_labeler(pickle_path, store_path):
+    """
+    Copy pickled labels (e.g. mturk_id_mapping.pickle) into a SQLite labeler store, keeping every label.
+
+    Labels the store already has are skipped, so a migration can be run again, but a key or label the
+    store has with a different label or key raises an error, and nothing is copied.
+
+    :param pickle_path: path to pickled dictionary of {key : label}
+    :param store_path: path to labeler store file (created if it doesn't exist)
+    :return: number of labels copied
+    """  # noqa: E501
+    with open(pickle_path, "rb") as f:
+        pid_labels = pickle.load(f)
+
+    labeler = SqliteLabeler(store_path)
+    try:
+        with labeler.lock:
+            connection = labeler.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                num_labels = connection.execute(
+                    "SELECT COUNT(*) FROM labels"
+                ).fetchone()[0]
+                connection.executemany(
+                    "INSERT OR IGNORE INTO labels (key, label) VALUES (?, ?)",
+                    [(str(key), label) for key, label in pid_labels.items()],
+                )
+                conflicts = [
+                    key
+                    for key, label in pid_labels.items()
+                    if connection.execute(
+                        "SELECT label FROM labels WHERE key = ?", (str(key),)
+                    ).fetchone()
+                    != (label,)
+                ]
+                if conflicts:
+                    raise ValueError(
+                        f"Labeler store has other labels for {len(conflicts)} keys "
+                        f"or their labels, e.g. {conflicts[0]}"
+                    )
+                num_copied = (
+                    connection.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+                    - num_labels
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+    finally:
+        labeler.close()
+    return num_copied
+
+
+def is_labeler_store(labeler):
+    """
+    Check whether a labeler location is a SQLite labeler store.
+
+    :param labeler: location of existing labeler dictionary or store
+    :return: True if the location has a labeler store suffix, see LABELER_STORE_SUFFIXES
+    """
+    return Path(labeler).suffix in LABELER_STORE_SUFFIXES
+
+
+def load_labeler(labeler, labeler_class=Labeler):
+    """
+    Load a Labeler from the location of a labeler dictionary, or use a given Labeler as is.
+
+    :param labeler: location of existing labeler dictionary or store (see is_labeler_store), or a Labeler (e.g. one shared by several exports)
+    :param labeler_class: class of Labeler to load a labeler dictionary into
+    :return: Labeler, or SqliteLabeler for labeler stores
+    """  # noqa: E501
+    if isinstance(labeler, (Labeler, SqliteLabeler)):
+        return labeler
+    if is_labeler_store(labeler):
+        return SqliteLabeler(labeler)
+    with open(labeler, "rb") as f:
+        pid_labels = pickle.load(f)
+    return labeler_class(already_labeled=pid_labels)
+
+
+def save_labeler(labeler, pid_labeler):
+    """
+    Save a Labeler's labels to the location they were loaded from (see load_labeler).
+
+    Labelers that were given as is are left to be saved by their owner, and labeler
+    stores already have every label, so are only closed.
+
+    :param labeler: location of existing labeler dictionary or store, or a Labeler
+    :param pid_labeler: Labeler returned by load_labeler
+    :return: nothing
+    """
+    if isinstance(labeler, (Labeler, SqliteLabeler)):
+        return
+    if isinstance(pid_labeler, SqliteLabeler):
+        pid_labeler.close()
+        return
+    with open(labeler, "wb") as f:
+        pickle.dump(pid_labeler.labels, f)
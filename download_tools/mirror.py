@@ -0,0 +1,250 @@
+"""Local SQLite mirror of the psiTurk participants table, for offline processing."""
+import json
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import bindparam, text
+
+from download_tools.engines import get_engine
+
+# same participants schema as psiTurk (and the databases in tests/data/databases)
+PARTICIPANTS_SCHEMA = """CREATE TABLE IF NOT EXISTS participants (
+    uniqueid VARCHAR(128) NOT NULL,
+    assignmentid VARCHAR(128) NOT NULL,
+    workerid VARCHAR(128) NOT NULL,
+    hitid VARCHAR(128) NOT NULL,
+    ipaddress VARCHAR(128),
+    browser VARCHAR(128),
+    platform VARCHAR(128),
+    language VARCHAR(128),
+    cond INTEGER,
+    counterbalance INTEGER,
+    codeversion VARCHAR(128),
+    beginhit DATETIME,
+    beginexp DATETIME,
+    endhit DATETIME,
+    bonus FLOAT,
+    status INTEGER,
+    mode VARCHAR(128),
+    datastring TEXT(4294967295),
+    PRIMARY KEY (uniqueid)
+)"""
+HITID_INDEX = (
+    "CREATE INDEX IF NOT EXISTS ix_participants_hitid ON participants (hitid)"
+)
+WATERMARKS_SCHEMA = """CREATE TABLE IF NOT EXISTS mirror_watermarks (
+    experiment VARCHAR(128) NOT NULL,
+    database_key VARCHAR(128) NOT NULL,
+    watermark TEXT NOT NULL,
+    PRIMARY KEY (experiment, database_key)
+)"""
+# database each participant in the mirror was synced from
+SOURCES_SCHEMA = """CREATE TABLE IF NOT EXISTS mirror_sources (
+    uniqueid VARCHAR(128) NOT NULL,
+    database_key VARCHAR(128) NOT NULL,
+    PRIMARY KEY (uniqueid)
+)"""
+
+# maximum number of uniqueids looked up in mirror_sources with one query
+SOURCES_CHUNK_SIZE = 500
+
+DATETIME_COLUMNS = ["beginhit", "beginexp", "endhit"]
+
+
+def get_mirror_uri(mirror_path):
+    """
+    Get database URI of a mirror file.
+
+    :param mirror_path: path to mirror file
+    :return: database uri as a string
+    """
+    return f"sqlite:///{Path(mirror_path).resolve()}"
+
+
+def create_mirror(mirror_path):
+    """
+    Create mirror file with indexed participants table, if it doesn't exist yet.
+
+    :param mirror_path: path to mirror file
+    :return: database uri of mirror, as a string
+    """
+    Path(mirror_path).parent.mkdir(exist_ok=True, parents=True)
+    mirror_uri = get_mirror_uri(mirror_path)
+    with get_engine(mirror_uri).begin() as connection:
+        for statement in [
+            PARTICIPANTS_SCHEMA,
+            HITID_INDEX,
+            WATERMARKS_SCHEMA,
+            SOURCES_SCHEMA,
+        ]:
+            connection.execute(text(statement))
+    return mirror_uri
+
+
+def compress_datastring(datastring):
+    """
+    Compress a participant's datastring for storage in the mirror.
+
+    :param datastring: datastring field from the participants table
+    :return: compressed datastring, as bytes (None stays None)
+    """
+    if datastring is None:
+        return None
+    return zlib.compress(datastring.encode())
+
+
+def decompress_participant(participant_dict):
+    """
+    Decompress datastring of a participant read from the mirror.
+
+    :param participant_dict: participant dict read from the mirror
+    :return: participant dict with datastring as a string
+    """
+    if isinstance(participant_dict["datastring"], bytes):
+        participant_dict["datastring"] = zlib.decompress(
+            participant_dict["datastring"]
+        ).decode()
+    return participant_dict
+
+
+def prepare_participant_for_mirror(participant_dict):
+    """
+    Convert a participant downloaded from a database to a row of the mirror.
+
+    :param participant_dict: participant dict from database
+    :return: dictionary with a value for each participants column
+    """
+    row = dict(participant_dict)
+    row["datastring"] = compress_datastring(row["datastring"])
+    # postgres returns datetimes, store them as sqlalchemy stores them in sqlite (always
+    # with microseconds, so they compare correctly with bound filter values)
+    for column in DATETIME_COLUMNS:
+        if isinstance(row.get(column), datetime):
+            row[column] = row[column].isoformat(sep=" ", timespec="microseconds")
+    return row
+
+
+def get_mirror_sources(connection, uniqueids):
+    """
+    Get the database participants in the mirror were synced from.
+
+    :param connection: connection to the mirror
+    :param uniqueids: list of uniqueids as strings
+    :return: dictionary of {uniqueid : database_uri_key}, for uniqueids in the mirror
+    """
+    sources = {}
+    sql_query = text(
+        "SELECT uniqueid, database_key FROM mirror_sources WHERE uniqueid IN :uniqueids"
+    ).bindparams(bindparam("uniqueids", expanding=True))
+    for chunk_start in range(0, len(uniqueids), SOURCES_CHUNK_SIZE):
+        chunk = uniqueids[chunk_start : chunk_start + SOURCES_CHUNK_SIZE]
+        sources.update(connection.execute(sql_query, {"uniqueids": chunk}).fetchall())
+    return sources
+
+
+def write_participants_to_mirror(
+    connection, database_participant_dicts, exp_name, watermarks
+):
+    """
+    Insert or replace participants in the mirror, and record the sync's watermarks.
+
+    The mirror keeps one participant per uniqueid: that of the first database (in the order of database_participant_dicts)
+    that has it, as download_from_database does with drop_duplicates. Participants in the mirror from databases not in
+    this sync are kept.
+
+    :param connection: connection to the mirror, inside a transaction
+    :param database_participant_dicts: list of (database_uri_key, participant dicts downloaded from the database), in order of the databases
+    :param exp_name: name of experiment
+    :param watermarks: dictionary of {database_uri_key : watermark} after this sync
+    :return: list of participant dicts written to the mirror
+    """  # noqa: E501
+    database_ranks = {
+        database_uri_key: rank
+        for rank, (database_uri_key, _) in enumerate(database_participant_dicts)
+    }
+    sources = get_mirror_sources(
+        connection,
+        [
+            participant_dict["uniqueid"]
+            for _, participant_dicts in database_participant_dicts
+            for participant_dict in participant_dicts
+        ],
+    )
+
+    written_participant_dicts = []
+    for database_uri_key, participant_dicts in database_participant_dicts:
+        for participant_dict in participant_dicts:
+            source = sources.get(participant_dict["uniqueid"], database_uri_key)
+            # rows of earlier databases (or of databases not in this sync) are kept
+            if database_ranks.get(source, -1) < database_ranks[database_uri_key]:
+                continue
+            sources[participant_dict["uniqueid"]] = database_uri_key
+            written_participant_dicts.append(participant_dict)
+
+    rows = [
+        prepare_participant_for_mirror(participant_dict)
+        for participant_dict in written_participant_dicts
+    ]
+    if rows:
+        columns = list(rows[0].keys())
+        connection.execute(
+            text(
+                "INSERT OR REPLACE INTO participants ({}) VALUES ({})".format(
+                    ", ".join(columns), ", ".join(f":{column}" for column in columns)
+                )
+            ),
+            rows,
+        )
+        connection.execute(
+            text(
+                "INSERT OR REPLACE INTO mirror_sources (uniqueid, database_key) "
+                "VALUES (:uniqueid, :database_key)"
+            ),
+            [
+                {
+                    "uniqueid": participant_dict["uniqueid"],
+                    "database_key": sources[participant_dict["uniqueid"]],
+                }
+                for participant_dict in written_participant_dicts
+            ],
+        )
+
+    if watermarks:
+        connection.execute(
+            text(
+                "INSERT OR REPLACE INTO mirror_watermarks "
+                "(experiment, database_key, watermark) "
+                "VALUES (:experiment, :database_key, :watermark)"
+            ),
+            [
+                {
+                    "experiment": exp_name,
+                    "database_key": database_uri_key,
+                    "watermark": json.dumps(watermark),
+                }
+                for database_uri_key, watermark in watermarks.items()
+            ],
+        )
+    return written_participant_dicts
+
+
+def load_mirror_watermarks(mirror_uri, exp_name):
+    """
+    Load watermarks recorded by earlier syncs of an experiment into the mirror.
+
+    :param mirror_uri: database uri of mirror, as a string
+    :param exp_name: name of experiment
+    :return: dictionary of {database_uri_key : watermark}
+    """
+    with get_engine(mirror_uri).connect() as connection:
+        results = connection.execute(
+            text(
+                "SELECT database_key, watermark FROM mirror_watermarks "
+                "WHERE experiment = :experiment"
+            ),
+            {"experiment": exp_name},
+        )
+        return {
+            database_key: json.loads(watermark) for database_key, watermark in results
+        }
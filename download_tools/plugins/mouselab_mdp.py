@@ -1,6 +1,10 @@
 """Processes data from mouselab-mdp plugin."""
 import numpy as np
 
+from download_tools.dtypes import compact_dtypes
+from download_tools.plugins.utils import decode_nested_column
+from download_tools.profiling import add_metrics, profiled
+
 
 def get_subjects_with_complete_data(mouselab_data, number_of_trials_per_block):
     """
@@ -55,18 +59,22 @@ def fix_trial_id(mouselab_data, reward_json, states_rewards="state_rewards"):
     return mouselab_data
 
 
-def preprocess_mouselab_data(raw_mouselab, number_of_trials_per_block, ground_truths):
+@profiled("preprocess_mouselab_data")
+def preprocess_mouselab_data(
+    raw_mouselab, number_of_trials_per_block, ground_truths, optimize_dtypes=False
+):
     """
     Preprocess mouselab data.
 
     :param raw_mouselab: raw mouselab df
     :param number_of_trials_per_block: dictionary of {block_name : number of trials} or {run :  {block_name : number of trials} ...}
     :param ground_truths: json output of original file
+    :param optimize_dtypes: if True, compact dtypes of the processed dataframe (see dtypes.compact_dtypes)
     :return: dataframe for only those with complete data
     """  # noqa: E501
-    raw_mouselab["state_rewards"] = raw_mouselab["state_rewards"].apply(eval)
-    raw_mouselab["queries"] = raw_mouselab["queries"].apply(eval)
-    raw_mouselab["rewards"] = raw_mouselab["rewards"].apply(eval)
+    add_metrics(rows=len(raw_mouselab))
+    for nested_column in ["state_rewards", "queries", "rewards"]:
+        raw_mouselab[nested_column] = decode_nested_column(raw_mouselab[nested_column])
 
     mouselab_data = fix_trial_id(raw_mouselab, ground_truths)
 
@@ -99,6 +107,9 @@ def preprocess_mouselab_data(raw_mouselab, number_of_trials_per_block, ground_tr
         )
         == 1
     )
+
+    if optimize_dtypes:
+        mouselab_data, _ = compact_dtypes(mouselab_data)
     return mouselab_data
 
 
@@ -3,9 +3,11 @@ import numpy as np
 import pandas as pd
 
 from download_tools.plugins.survey_multi_choice import explode_questionnaire_df
-from download_tools.plugins.utils import get_demo_string
+from download_tools.plugins.utils import decode_nested_column, get_demo_string
+from download_tools.profiling import add_metrics, profiled
 
 
+@profiled("process_html_demographics")
 def process_html_demographics(raw_demographics):
     """
     Process demographics so that there's a row for each participant with columns for each demographic question.
@@ -13,8 +15,9 @@ def process_html_demographics(raw_demographics):
     :param raw_demographics: raw demographics file
     :return: processed demographics
     """  # noqa: E501
-    # eval field we need
-    raw_demographics["responses"] = raw_demographics["responses"].apply(eval)
+    add_metrics(rows=len(raw_demographics))
+    # decode field we need
+    raw_demographics["responses"] = decode_nested_column(raw_demographics["responses"])
     # explode dataframe
     exploded_demo = explode_questionnaire_df(raw_demographics)
 
@@ -4,6 +4,9 @@ import fnmatch
 import numpy as np
 import pandas as pd
 
+from download_tools.plugins.utils import decode_nested_column
+from download_tools.profiling import add_metrics, profiled
+
 
 def get_mouselab_quiz_name(row, node_id_to_name_mapping):
     """
@@ -249,6 +252,7 @@ def get_quiz_passer_ids(
     return passed_ids
 
 
+@profiled("score_mouselab_questionnaires")
 def score_mouselab_questionnaires(
     mouselab_questionnaires, solutions_dict, group_identifier="name", accuracy_string="correct"
 ):
@@ -261,13 +265,12 @@ def score_mouselab_questionnaires(
     :param accuracy_string:
     :return: exploded (one question per row), scored dataframe
     """  # noqa: E501
-    # eval fields we need
-    mouselab_questionnaires["responses"] = mouselab_questionnaires["responses"].apply(
-        lambda entry: eval(entry) if (isinstance(entry, str) and not pd.isnull(entry)) else entry
-    )
-    mouselab_questionnaires[accuracy_string] = mouselab_questionnaires[accuracy_string].apply(
-        lambda entry: eval(entry) if (isinstance(entry, str) and not pd.isnull(entry)) else entry
-    )
+    add_metrics(rows=len(mouselab_questionnaires))
+    # decode fields we need
+    for nested_column in ["responses", accuracy_string]:
+        mouselab_questionnaires[nested_column] = decode_nested_column(
+            mouselab_questionnaires[nested_column]
+        )
 
     # reshape dataframe so each answer has its own row
     mouselab_questionnaires = explode_questionnaire_df(
@@ -287,6 +290,7 @@ def score_mouselab_questionnaires(
 
     return mouselab_questionnaires
 
+@profiled("score_generic_questionnaires")
 def score_generic_questionnaires(questionnaires, solutions_dict, group_identifier, accuracy_string="correct", open_ended=None, reverse_coded=None, default_open_ended=None):
     """
     Score generic questionnaire dataframe, returning exploded, scored dataframe.
@@ -299,20 +303,19 @@ def score_generic_questionnaires(questionnaires, solutions_dict, group_identifie
     :param default_open_ended: TODO
     :return: exploded (one question per row), scored dataframe
     """  # noqa: E501
-    # eval fields we need -- mandatory fields
-    questionnaires["responses"] = questionnaires["responses"].apply(
-        lambda entry: eval(entry) if (isinstance(entry, str) and not pd.isnull(entry)) else entry
-    )
-    questionnaires["question_id"] = questionnaires["question_id"].apply(
-        lambda entry: eval(entry) if (isinstance(entry, str) and not pd.isnull(entry)) else entry
-    )
+    add_metrics(rows=len(questionnaires))
+    # decode fields we need -- mandatory fields
+    for nested_column in ["responses", "question_id"]:
+        questionnaires[nested_column] = decode_nested_column(
+            questionnaires[nested_column]
+        )
 
-    # eval possible additional fields
+    # decode possible additional fields
     additional_columns = {}
     for questionnaire_col in [accuracy_string, "questions"] +  ["reverse_coded", "open_ended"]:
         if questionnaire_col in questionnaires:
-            questionnaires[questionnaire_col] = questionnaires[questionnaire_col].apply(
-                lambda entry: eval(entry) if (isinstance(entry, str) and not pd.isnull(entry)) else entry
+            questionnaires[questionnaire_col] = decode_nested_column(
+                questionnaires[questionnaire_col]
             )
         else:
             questionnaires[questionnaire_col] = np.nan
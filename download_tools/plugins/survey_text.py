@@ -1,19 +1,29 @@
 """Processes data from survey-text plugin."""
 import numpy as np
 
+from download_tools.dtypes import compact_dtypes, infer_schema
 from download_tools.plugins.survey_multi_choice import explode_questionnaire_df
-from download_tools.plugins.utils import get_demo_string
+from download_tools.plugins.utils import decode_nested_column, get_demo_string
+from download_tools.profiling import add_metrics, profiled
 
 
-def preprocess_survey_text(survey_text):
+@profiled("preprocess_survey_text")
+def preprocess_survey_text(survey_text, optimize_dtypes=False):
     """
     Process dataframe such that each question has its own row.
 
     :param survey_text: raw survey text dataframe
+    :param optimize_dtypes: if True, compact dtypes of the processed dataframe (see dtypes.compact_dtypes), except for responses, which get_old_demographics recodes
     :return: processed dataframe
     """  # noqa: E501
-    survey_text["responses"] = survey_text["responses"].apply(eval)
+    add_metrics(rows=len(survey_text))
+    survey_text["responses"] = decode_nested_column(survey_text["responses"])
     survey_text = explode_questionnaire_df(survey_text)
+
+    if optimize_dtypes:
+        schema = infer_schema(survey_text)
+        schema.pop("responses", None)
+        survey_text, _ = compact_dtypes(survey_text, schema=schema)
     return survey_text
 
 
@@ -85,9 +95,9 @@ def get_old_demographics(
     ] = relevant_demographics_df.loc[
         relevant_demographics_df["question_id"] == "Q1", "responses"
     ].apply(
-        lambda entry: manual_age_mapping[entry]
-        if entry in manual_age_mapping
-        else entry
+        lambda entry: (
+            manual_age_mapping[entry] if entry in manual_age_mapping else entry
+        )
     )
     ages = relevant_demographics_df.loc[
         relevant_demographics_df["question_id"] == "Q1", "responses"
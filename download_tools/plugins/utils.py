@@ -1,6 +1,95 @@
 """Utilities for plugins."""
+import ast
+
 import numpy as np
 
+from download_tools import json_decoding
+
+# names in the string representation of floats, which ast.literal_eval doesn't know
+FLOAT_NAMES = {"nan": float("nan"), "inf": float("inf")}
+
+
+class FloatNameTransformer(ast.NodeTransformer):
+    """Replace nan and inf in a parsed literal by their float values."""
+
+    def visit_Name(self, node):  # noqa: N802, D102
+        if node.id in FLOAT_NAMES:
+            return ast.copy_location(ast.Constant(FLOAT_NAMES[node.id]), node)
+        return node
+
+
+def literal_eval(text):
+    """
+    Safely evaluate the string representation of a Python literal, including nan and inf.
+
+    :param text: string representation, e.g. "{'Q0': 'yes', 'Q1': nan}"
+    :return: evaluated literal
+    """  # noqa: E501
+    tree = FloatNameTransformer().visit(ast.parse(text.strip(), mode="eval"))
+    return ast.literal_eval(tree)
+
+
+def decode_nested_value(value):
+    """
+    Decode a nested field (e.g. a list or dict) saved in a participant file.
+
+    csv files hold the string representation of nested values, which is parsed as JSON when
+    possible (the fast path) and as a Python literal otherwise. Values that are not strings,
+    e.g. read natively from Parquet or Feather files, are already decoded and only converted to
+    lists and dicts (see to_python_value), so strings within them are kept as they are.
+
+    :param value: string representation of nested value, or already decoded value
+    :return: decoded value
+    """  # noqa: E501
+    if isinstance(value, str):
+        try:
+            return json_decoding.loads(value)
+        except ValueError:
+            pass
+        try:
+            return literal_eval(value)
+        except (SyntaxError, ValueError) as error:
+            raise ValueError(f"Can't decode nested value: {value!r}") from error
+    return to_python_value(value)
+
+
+def to_python_value(value):
+    """
+    Convert a nested value read from a columnar file to Python lists and dicts, without decoding it.
+
+    :param value: value of dataframe cell, e.g. a numpy array of arrays
+    :return: value with numpy arrays (also within it) converted to lists
+    """  # noqa: E501
+    if isinstance(value, np.ndarray):
+        # lists read from columnar files are numpy arrays
+        return [to_python_value(item) for item in value.tolist()]
+    if isinstance(value, list):
+        return [to_python_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_python_value(item) for key, item in value.items()}
+    return value
+
+
+def decode_nested_column(column):
+    """
+    Decode a column of nested fields (see decode_nested_value), decoding each distinct string once.
+
+    Rows with the same string get the same decoded object, so decoded values shouldn't be changed in place.
+
+    :param column: pandas series
+    :return: pandas series of decoded values
+    """  # noqa: E501
+    decoded_strings = {}
+
+    def decode(value):
+        if not isinstance(value, str):
+            return decode_nested_value(value)
+        if value not in decoded_strings:
+            decoded_strings[value] = decode_nested_value(value)
+        return decoded_strings[value]
+
+    return column.map(decode, na_action="ignore")
+
 
 def add_keys_to_df(df, column_of_interest, missing_key_value=np.nan):
     """
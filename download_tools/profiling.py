@@ -0,0 +1,280 @@
+"""Records time, memory, rows and bytes of each stage of downloads and exports.
+
+Wall time, rows and bytes are those of a stage itself. CPU time and peak memory are
+measured for the whole process, as stages can run on several threads at the same time
+(e.g. one per database): a stage's CPU time includes other threads running alongside
+it, and its peak memory is the peak of the process up to the end of the stage.
+"""
+import contextvars
+import functools
+import heapq
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+from download_tools.watermarks import hash_uniqueid
+
+# number of participants with the largest datastrings kept in reports
+DEFAULT_MAX_PARTICIPANTS = 10
+
+# profiler of the current context, None when not profiling
+_profiler = contextvars.ContextVar("profiler", default=None)
+# names of the stages the current context is in, and metrics of the innermost stage
+_stage_path = contextvars.ContextVar("stage_path", default=())
+_stage_metrics = contextvars.ContextVar("stage_metrics", default=None)
+
+
+def get_peak_memory():
+    """
+    Get peak resident memory of this process so far.
+
+    :return: number of bytes, or None where the resource module isn't available
+    """
+    if resource is None:
+        return None
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak_memory if sys.platform == "darwin" else peak_memory * 1024
+
+
+class Profiler(object):
+    """
+    Collect metrics of stages, summed over all calls of a stage.
+
+    :param max_participants: number of participants with the largest datastrings to keep
+    """
+
+    def __init__(self, max_participants=DEFAULT_MAX_PARTICIPANTS):  # noqa D107
+        self.max_participants = max_participants
+        # metrics of each stage, by stage path, in order of first call
+        self.stages = {}
+        # (datastring size, hashed uniqueid) of largest datastrings
+        self.participants = []
+        # stages can run on several threads, e.g. one per database
+        self.lock = threading.Lock()
+        self.start_wall_time = time.perf_counter()
+        self.start_cpu_time = time.process_time()
+
+    def record_stage(self, stage_path, wall_seconds, cpu_seconds, metrics):
+        """
+        Add a call of a stage.
+
+        :param stage_path: tuple of names of the stage and the stages it ran in
+        :param wall_seconds: wall time of the call
+        :param cpu_seconds: CPU time of the process (all threads) during the call
+        :param metrics: dictionary with rows and bytes processed in the call
+        :return: nothing
+        """
+        peak_memory = get_peak_memory()
+        with self.lock:
+            stage = self.stages.setdefault(
+                stage_path,
+                {
+                    "stage": "/".join(stage_path),
+                    "calls": 0,
+                    "wall_seconds": 0.0,
+                    "process_cpu_seconds": 0.0,
+                    "process_peak_memory_bytes": None,
+                    "rows": 0,
+                    "bytes": 0,
+                },
+            )
+            stage["calls"] += 1
+            stage["wall_seconds"] += wall_seconds
+            stage["process_cpu_seconds"] += cpu_seconds
+            stage["process_peak_memory_bytes"] = peak_memory
+            stage["rows"] += metrics["rows"]
+            stage["bytes"] += metrics["bytes"]
+
+    def record_participants(self, participant_dicts):
+        """
+        Keep the participants with the largest datastrings.
+
+        :param participant_dicts: list of participant dicts from database
+        :return: nothing
+        """
+        participant_sizes = heapq.nlargest(
+            self.max_participants,
+            (
+                (len(participant_dict["datastring"]), participant_dict["uniqueid"])
+                for participant_dict in participant_dicts
+                if participant_dict.get("datastring") and "uniqueid" in participant_dict
+            ),
+        )
+        participant_sizes = [
+            (size, hash_uniqueid(uniqueid)) for size, uniqueid in participant_sizes
+        ]
+        with self.lock:
+            self.participants = heapq.nlargest(
+                self.max_participants, set(self.participants + participant_sizes)
+            )
+
+    def get_report(self):
+        """
+        Get report of all stages recorded so far.
+
+        :return: dictionary with total wall time, process CPU time and peak memory, list of stages and largest participants
+        """  # noqa: E501
+        with self.lock:
+            return {
+                "wall_seconds": time.perf_counter() - self.start_wall_time,
+                "process_cpu_seconds": time.process_time() - self.start_cpu_time,
+                "process_peak_memory_bytes": get_peak_memory(),
+                "stages": [dict(stage) for stage in self.stages.values()],
+                "largest_participants": [
+                    {"participant": hashed_uniqueid, "datastring_bytes": size}
+                    for size, hashed_uniqueid in self.participants
+                ],
+            }
+
+
+@contextmanager
+def profile(output_path=None, callback=None, max_participants=DEFAULT_MAX_PARTICIPANTS):
+    """
+    Profile downloads and exports run in this context.
+
+    The report (see Profiler.get_report) is emitted when the context exits, also if it raised.
+
+    :param output_path: path of JSON file to save report to, default None
+    :param callback: function called with the report, default None
+    :param max_participants: number of participants with the largest datastrings to report
+    :return: context manager, yielding the Profiler
+    """  # noqa: E501
+    profiler = Profiler(max_participants=max_participants)
+    profiler_token = _profiler.set(profiler)
+    stage_path_token = _stage_path.set(())
+    try:
+        yield profiler
+    finally:
+        _stage_path.reset(stage_path_token)
+        _profiler.reset(profiler_token)
+        report = profiler.get_report()
+        if output_path is not None:
+            with open(Path(output_path), "w") as f:
+                json.dump(report, f, indent=1)
+        if callback is not None:
+            callback(report)
+
+
+@contextmanager
+def stage(name):
+    """
+    Record a stage, if profiling (see profile); stages within it are recorded under its name.
+
+    :param name: name of stage
+    :return: context manager
+    """  # noqa: E501
+    profiler = _profiler.get()
+    if profiler is None:
+        yield
+        return
+
+    stage_path = _stage_path.get() + (name,)
+    metrics = {"rows": 0, "bytes": 0}
+    stage_path_token = _stage_path.set(stage_path)
+    stage_metrics_token = _stage_metrics.set(metrics)
+    start_wall_time, start_cpu_time = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        profiler.record_stage(
+            stage_path,
+            time.perf_counter() - start_wall_time,
+            time.process_time() - start_cpu_time,
+            metrics,
+        )
+        _stage_metrics.reset(stage_metrics_token)
+        _stage_path.reset(stage_path_token)
+
+
+def profiled(name):
+    """
+    Record every call of a function as a stage (see stage).
+
+    :param name: name of stage
+    :return: decorator
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler.get() is None:
+                return function(*args, **kwargs)
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def add_metrics(rows=0, bytes=0):
+    """
+    Add rows and bytes processed to the current stage, if profiling.
+
+    :param rows: number of rows (e.g. participants or trials)
+    :param bytes: number of bytes (e.g. of datastrings or files)
+    :return: nothing
+    """
+    metrics = _stage_metrics.get()
+    if metrics is not None:
+        metrics["rows"] += rows
+        metrics["bytes"] += bytes
+
+
+def add_participant_metrics(participant_dicts, keep_largest=True):
+    """
+    Add participants and their datastrings' size to the current stage, if profiling.
+
+    :param participant_dicts: list of participant dicts from database
+    :param keep_largest: if True, also keep the participants with the largest datastrings in the report
+    :return: nothing
+    """  # noqa: E501
+    profiler = _profiler.get()
+    if profiler is not None:
+        add_metrics(
+            rows=len(participant_dicts),
+            bytes=get_datastring_bytes(participant_dicts),
+        )
+        if keep_largest:
+            profiler.record_participants(participant_dicts)
+
+
+def get_datastring_bytes(participant_dicts):
+    """
+    Get total size of participants' datastrings.
+
+    :param participant_dicts: list of participant dicts from database
+    :return: number of bytes (characters for str datastrings)
+    """
+    return sum(
+        len(participant_dict["datastring"])
+        for participant_dict in participant_dicts
+        if participant_dict.get("datastring")
+    )
+
+
+def in_current_context(function):
+    """
+    Run a function in (a copy of) the current context when called, e.g. on another thread.
+
+    Threads don't inherit the context they are started from, so without this their stages aren't recorded.
+
+    :param function: function
+    :return: function running in a copy of the current context at each call
+    """  # noqa: E501
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+
+    return wrapper
@@ -1,14 +1,36 @@
 """This code contains functions used to save the participant_dicts \
 downloaded from the database as pandas data frames / csvs."""
-import json
+import math
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-import dill as pickle
-import numpy as np
 import pandas as pd
 
-from download_tools.labeler import Labeler
+from download_tools import json_decoding
+from download_tools.column_builder import ColumnBuilder
+from download_tools.dtypes import (
+    apply_schema,
+    get_memory_report,
+    infer_schema,
+    save_schema,
+)
+from download_tools.export_manifest import (
+    combine_table_state,
+    create_manifest,
+    get_participant_statuses,
+    load_manifest,
+    save_manifest,
+)
+from download_tools.file_formats import DEFAULT_MAX_WORKERS, CsvAppender, save_tables
+from download_tools.labeler import IdentityLabeler, load_labeler, save_labeler
+from download_tools.profiling import (
+    add_metrics,
+    add_participant_metrics,
+    profiled,
+    stage,
+)
 
 
 def to_snake_case(name):
@@ -22,6 +44,50 @@ def to_snake_case(name):
     return re.sub("([a-z0-9])([A-Z])", r"\1_\2", name).lower()
 
 
+def decode_datastring(participant_dict):
+    """
+    Decode a participant's datastring, with the backend set in json_decoding.
+
+    :param participant_dict: participant dict from database (datastring as str, bytes or memoryview)
+    :return: dictionary of decoded datastring, or None if the participant has no datastring
+    """  # noqa: E501
+    if not participant_dict["datastring"]:
+        return None
+    return json_decoding.loads(participant_dict["datastring"])
+
+
+@profiled("decode_datastrings")
+def decode_datastrings(participant_dicts):
+    """
+    Decode the datastring of each participant, so it can be shared by all extractors.
+
+    Extractors don't modify the decoded datastrings.
+
+    :param participant_dicts: list of participant dicts from database
+    :return: list of decoded datastrings (None for participants without a datastring), in order of participant_dicts
+    """  # noqa: E501
+    add_participant_metrics(participant_dicts)
+    with json_decoding.paused_gc():
+        return [
+            decode_datastring(participant_dict)
+            for participant_dict in participant_dicts
+        ]
+
+
+def get_pids(participant_dicts, labeler):
+    """
+    Label participants' worker IDs all at once.
+
+    :param participant_dicts: list of participant dicts from database
+    :param labeler: our participant Labeler
+    :return: list of pids, in order of participant_dicts
+    """
+    workerids = [participant_dict["workerid"] for participant_dict in participant_dicts]
+    # python values, as ColumnBuilder types columns by their values' types
+    return labeler.label_many(workerids).tolist()
+
+
+@profiled("general_info")
 def get_general_participant_data(participant_dicts, labeler):
     """
     Save general participant data as a dataframe.
@@ -35,9 +101,7 @@ def get_general_participant_data(participant_dicts, labeler):
     )
 
     # relabel pid to remove PII
-    general_info["pid"] = general_info["workerid"].apply(
-        lambda workerid: labeler(workerid)
-    )
+    general_info["pid"] = labeler.label_many(general_info["workerid"])
 
     # delete potential PII
     del general_info["uniqueid"]
@@ -47,122 +111,300 @@ def get_general_participant_data(participant_dicts, labeler):
     del general_info["ipaddress"]
     del general_info["datastring"]
 
+    add_metrics(rows=len(general_info))
     return general_info
 
 
-def get_question_data(participant_dicts, labeler):
+@profiled("question_data")
+def get_question_data(participant_dicts, labeler, decoded_datastrings=None):
     """
     Save participant question data as a dataframe.
 
     :param participant_dicts: list of participant dicts from database
     :param labeler: our participant Labeler
+    :param decoded_datastrings: list of decoded datastrings (see decode_datastrings), or None to decode them here
     :return: dataframe of data in "questiondata" field of database
-    """
-    question_data_dicts = []
-    for participant_dict in participant_dicts:
-        # get question data for participant
-        question_data_dict = json.loads(participant_dict["datastring"])["questiondata"]
+    """  # noqa: E501
+    if decoded_datastrings is None:
+        decoded_datastrings = decode_datastrings(participant_dicts)
+
+    pids = get_pids(participant_dicts, labeler)
+    question_data_builder = ColumnBuilder()
+    for pid, datastring in zip(pids, decoded_datastrings):
+        # copied, as the decoded datastring is shared with other extractors
+        question_data_dict = dict(datastring["questiondata"])
         # add pid
-        question_data_dict["pid"] = labeler(participant_dict["workerid"])
+        question_data_dict["pid"] = pid
         # params, if it exists is a dictionary itself
         # with mouselab data is itself a dict
         if "params" in question_data_dict:
             question_data_dict.update(question_data_dict["params"])
             del question_data_dict["params"]
-        question_data_dicts.append(question_data_dict)
-    question_data = pd.DataFrame(question_data_dicts)
+        question_data_builder.append(question_data_dict)
+    question_data = question_data_builder.build()
+    add_metrics(rows=len(question_data))
     return question_data
 
 
-def get_event_data(participant_dicts, labeler):
+@profiled("event_data")
+def get_event_data(participant_dicts, labeler, decoded_datastrings=None):
     """
     Save participant event data as a dataframe.
 
     :param participant_dicts: list of participant dicts from database
     :param labeler: our participant Labeler
+    :param decoded_datastrings: list of decoded datastrings (see decode_datastrings), or None to decode them here
     :return: dataframe of data in "eventdata" field of database
-    """
-    event_data_dicts = []
-    for participant_dict in participant_dicts:
-        user_event_datas = json.loads(participant_dict["datastring"])["eventdata"]
-
-        # add pid to each user event data
-        pid = labeler(participant_dict["workerid"])
-
-        for event_idx, user_event_data in enumerate(user_event_datas):
-            user_event_data.update({"pid": pid, "event_num": event_idx})
-
-        # extend event dicts list
-        event_data_dicts.extend(user_event_datas)
+    """  # noqa: E501
+    if decoded_datastrings is None:
+        decoded_datastrings = decode_datastrings(participant_dicts)
+
+    # add pid to each user event data
+    pids = get_pids(participant_dicts, labeler)
+    event_data_builder = ColumnBuilder()
+    for pid, datastring in zip(pids, decoded_datastrings):
+        # add participant's events as rows
+        event_data_builder.extend(
+            {**user_event_data, "pid": pid, "event_num": event_idx}
+            for event_idx, user_event_data in enumerate(datastring["eventdata"])
+        )
 
-    event_data = pd.DataFrame(event_data_dicts)
+    event_data = event_data_builder.build()
+    add_metrics(rows=len(event_data))
     return event_data
 
 
-def get_trial_data(participant_dicts, labeler):
+@profiled("trial_data")
+def get_trial_data(participant_dicts, labeler, decoded_datastrings=None):
     """
     Save participant trial data as a dataframe.
 
     :param participant_dicts: list of participant dicts from database
     :param labeler: our participant Labeler
+    :param decoded_datastrings: list of decoded datastrings (see decode_datastrings), or None to decode them here
     :return: dataframe of data in "trialdata" field of database
+    """  # noqa: E501
+    if decoded_datastrings is None:
+        decoded_datastrings = decode_datastrings(participant_dicts)
+
+    # only participants with data are labeled
+    participants_with_data = [
+        (participant_dict, datastring)
+        for participant_dict, datastring in zip(participant_dicts, decoded_datastrings)
+        if datastring is not None
+    ]
+    pids = get_pids(
+        [participant_dict for participant_dict, _ in participants_with_data], labeler
+    )
+
+    # each participant's trials are a group of rows, indexed from 0
+    trial_data_builder = ColumnBuilder()
+    for pid, (participant_dict, datastring) in zip(pids, participants_with_data):
+        trial_data_builder.start_group()
+        trial_data_builder.extend(trial["trialdata"] for trial in datastring["data"])
+        trial_data_builder.fill_group("pid", pid)  # participant_idx
+
+        # for bonusing
+        trial_data_builder.fill_group("workerid", participant_dict["workerid"])
+        trial_data_builder.fill_group("assignmentid", participant_dict["assignmentid"])
+        trial_data_builder.end_group()
+    if not (trial_data_builder.groups or trial_data_builder.empty_groups):
+        raise ValueError("No participants with data")
+    trial_data = trial_data_builder.build()
+    add_metrics(rows=len(trial_data))
+    return trial_data
+
+
+def to_columns(dataframe):
     """
-    participant_dfs = []
-    for participant_dict in participant_dicts:
-        if participant_dict["datastring"]:
-            participant_df = pd.DataFrame(
+    Convert a dataframe to a columnar chunk, which is cheaper to send between processes.
+
+    :param dataframe: dataframe
+    :return: dictionary with list of columns, list of a numpy array for each column and index as a numpy array
+    """  # noqa: E501
+    return {
+        "columns": list(dataframe.columns),
+        "values": [dataframe[column].to_numpy() for column in dataframe.columns],
+        "index": dataframe.index.to_numpy(),
+    }
+
+
+def from_columns(chunk):
+    """
+    Convert a columnar chunk back to a dataframe.
+
+    :param chunk: columnar chunk, see to_columns
+    :return: dataframe
+    """
+    return pd.DataFrame(
+        dict(zip(chunk["columns"], chunk["values"])),
+        index=chunk["index"],
+        columns=chunk["columns"],
+    )
+
+
+def parse_participant_chunk(participant_dicts):
+    """
+    Get question, event and trial data for a chunk of participants, in a worker process.
+
+    The pid column holds worker IDs, pids are given out by the parent process.
+
+    :param participant_dicts: list of participant dicts from database
+    :return: dictionary of columnar chunks (see to_columns), with keys question_data, event_data and trial_data
+    """  # noqa: E501
+    decoded_datastrings = decode_datastrings(participant_dicts)
+    workerid_labeler = IdentityLabeler()
+
+    tables = {
+        "question_data": get_question_data(
+            participant_dicts, workerid_labeler, decoded_datastrings=decoded_datastrings
+        ),
+        "event_data": get_event_data(
+            participant_dicts, workerid_labeler, decoded_datastrings=decoded_datastrings
+        ),
+    }
+    # like get_trial_data, but a chunk can have no participants with data
+    if any(datastring is not None for datastring in decoded_datastrings):
+        tables["trial_data"] = get_trial_data(
+            participant_dicts, workerid_labeler, decoded_datastrings=decoded_datastrings
+        )
+    return {table_name: to_columns(table) for table_name, table in tables.items()}
+
+
+@profiled("get_participant_data_parallel")
+def get_participant_data_parallel(
+    participant_dicts, labeler, n_jobs=-1, chunk_size=None
+):
+    """
+    Get general info, question, event and trial data, parsing chunks of participants in a process pool.
+
+    pids are given out in this process, in order of participant_dicts, so the labeler ends up
+    the same as after get_participant_data.
+
+    :param participant_dicts: list of participant dicts from database
+    :param labeler: our participant Labeler
+    :param n_jobs: number of worker processes, -1 for one per CPU
+    :param chunk_size: number of participants parsed by a worker at a time, default splits participants into 4 chunks per worker
+    :return: dictionary of dataframes, with keys general_info, question_data, event_data and trial_data
+    """  # noqa: E501
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if chunk_size is None:
+        chunk_size = max(1, math.ceil(len(participant_dicts) / (n_jobs * 4)))
+
+    # general info first, so pids are given out in order of participant_dicts
+    general_info = get_general_participant_data(participant_dicts, labeler)
+    pids = dict(
+        zip(
+            (participant_dict["workerid"] for participant_dict in participant_dicts),
+            get_pids(participant_dicts, labeler),
+        )
+    )
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        # map keeps chunks in the order of participant_dicts
+        chunks = list(
+            executor.map(
+                parse_participant_chunk,
                 [
-                    trial["trialdata"]
-                    for trial in json.loads(participant_dict["datastring"])["data"]
-                ]
+                    participant_dicts[chunk_start : chunk_start + chunk_size]
+                    for chunk_start in range(0, len(participant_dicts), chunk_size)
+                ],
             )
-            participant_df["pid"] = labeler(
-                participant_dict["workerid"]
-            )  # participant_idx
-
-            # for bonusing
-            participant_df["workerid"] = participant_dict["workerid"]
-            participant_df["assignmentid"] = participant_dict["assignmentid"]
-            participant_dfs.append(participant_df)
-    trial_data = pd.concat(participant_dfs)
-    return trial_data
+        )
 
+    participant_data = {"general_info": general_info}
+    for table_name in ["question_data", "event_data", "trial_data"]:
+        # question and event data have a range index, trial data one per participant
+        table = pd.concat(
+            [
+                from_columns(chunk[table_name])
+                for chunk in chunks
+                if table_name in chunk
+            ],
+            ignore_index=table_name != "trial_data",
+        )
+        if "pid" in table:
+            table["pid"] = table["pid"].map(pids)
+        participant_data[table_name] = table
+    return participant_data
 
-def get_participant_bonus(
-    trial_data, question_data, general_info, labeler, bonus_function=None
+
+@profiled("get_participant_data")
+def get_participant_data(
+    participant_dicts, labeler, decoded_datastrings=None, n_jobs=1, chunk_size=None
 ):
     """
-    Pull out all bonus fields from trial, questoin and general data.
+    Get general info, question, event and trial data, decoding each datastring only once.
 
-    :param trial_data: dataframe outputted by get_trial_data
-    :param question_data: dataframe outputted by get_question_data
-    :param general_info: dataframe outputted by get_general_participant_data
+    :param participant_dicts: list of participant dicts from database
     :param labeler: our participant Labeler
-    :param bonus_function: anonymous function that converts a score to a bonus (what we told the participants, in the experiment code)
-    :return: a dataframe with workerid, assignmentid and all bonuses (fields are 0 if nan)
-    """  # noqa: #501
-    if bonus_function is None:
-        bonus_function = lambda row: row["score"]  # noqa: E731
+    :param decoded_datastrings: list of decoded datastrings (see decode_datastrings), or None to decode them here
+    :param n_jobs: number of worker processes to parse participants in (see get_participant_data_parallel), 1 to parse them in this process, -1 for one per CPU
+    :param chunk_size: number of participants parsed by a worker at a time, see get_participant_data_parallel
+    :return: dictionary of dataframes, with keys general_info, question_data, event_data and trial_data
+    """  # noqa: E501
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if n_jobs > 1 and decoded_datastrings is None:
+        return get_participant_data_parallel(
+            participant_dicts, labeler, n_jobs=n_jobs, chunk_size=chunk_size
+        )
 
-    bonus_df = (
-        trial_data[trial_data["trial_type"] == "mouselab-mdp"]
-        .groupby(["workerid", "assignmentid"])
-        .sum()["score"]
-        .reset_index(drop=False)
-    )
-    # add pid label so we can join two dataframes
-    bonus_df["pid"] = bonus_df["workerid"].apply(lambda workerid: labeler(workerid))
+    if decoded_datastrings is None:
+        decoded_datastrings = decode_datastrings(participant_dicts)
+
+    # general info first, so pids are given out in order of participant_dicts
+    return {
+        "general_info": get_general_participant_data(participant_dicts, labeler),
+        "question_data": get_question_data(
+            participant_dicts, labeler, decoded_datastrings=decoded_datastrings
+        ),
+        "event_data": get_event_data(
+            participant_dicts, labeler, decoded_datastrings=decoded_datastrings
+        ),
+        "trial_data": get_trial_data(
+            participant_dicts, labeler, decoded_datastrings=decoded_datastrings
+        ),
+    }
+
+
+def columnwise(bonus_function):
+    """
+    Mark a bonus function as column-wise, so it is called once with all participants' bonus fields rather than once per participant.
 
+    :param bonus_function: function taking the bonus dataframe (see get_participant_bonus) and returning a series of bonuses, e.g. lambda bonus_df: bonus_df["score"].clip(lower=0) / 100
+    :return: bonus_function, marked as column-wise
+    """  # noqa: E501
+    bonus_function.columnwise = True
+    return bonus_function
+
+
+def add_bonus_fields(score_df, question_data, general_info, bonus_function=None):
+    """
+    Add bonus fields of question and general data to participants' scores, and calculate their bonus.
+
+    :param score_df: dataframe with workerid, assignmentid, score and pid columns
+    :param question_data: dataframe outputted by get_question_data
+    :param general_info: dataframe outputted by get_general_participant_data
+    :param bonus_function: function that converts a score to a bonus, see get_participant_bonus
+    :return: a dataframe with workerid, assignmentid and all bonuses (fields are 0 if nan)
+    """  # noqa: E501
     question_cols = [col for col in question_data.columns if "_bonus" in col] + ["pid"]
 
-    bonus_df = bonus_df.merge(question_data[question_cols], how="left", on="pid")
+    bonus_df = score_df.merge(question_data[question_cols], how="left", on="pid")
     bonus_df = bonus_df.merge(
         general_info[["pid", "bonus", "cond"]], how="left", on="pid"
     )
 
-    bonus_df["calculated_bonus"] = bonus_df.apply(
-        lambda row: bonus_function(row), axis=1
-    )
+    if bonus_function is None:
+        bonus_df["calculated_bonus"] = bonus_df["score"].copy()
+    elif getattr(bonus_function, "columnwise", False):
+        bonus_df["calculated_bonus"] = bonus_function(bonus_df)
+    else:
+        bonus_df["calculated_bonus"] = bonus_df.apply(
+            lambda row: bonus_function(row), axis=1
+        )
 
     del bonus_df["pid"]  # delete pid to make sure this doesn't expose a mapping
     # set display to 0 when missing
@@ -170,84 +412,482 @@ def get_participant_bonus(
     return bonus_df
 
 
+@profiled("get_participant_bonus")
+def get_participant_bonus(
+    trial_data,
+    question_data,
+    general_info,
+    labeler,
+    bonus_function=None,
+    return_totals=False,
+):
+    """
+    Pull out all bonus fields from trial, questoin and general data.
+
+    Scores are summed in one grouped pass over the mouselab-mdp trials, per run if trial data has a run column,
+    and joined to question and general data on the pids trial data already has.
+
+    :param trial_data: dataframe outputted by get_trial_data
+    :param question_data: dataframe outputted by get_question_data
+    :param general_info: dataframe outputted by get_general_participant_data
+    :param labeler: our participant Labeler, for trial data without a pid column
+    :param bonus_function: anonymous function that converts a score to a bonus (what we told the participants, in the experiment code), called with each participant's row, or with the whole dataframe if marked with columnwise
+    :param return_totals: if True, also return total scores and bonuses per condition (and run)
+    :return: a dataframe with workerid, assignmentid and all bonuses (fields are 0 if nan), and a dataframe of totals if return_totals
+    """  # noqa: E501
+    mouselab_data = trial_data[trial_data["trial_type"] == "mouselab-mdp"]
+    if "pid" not in mouselab_data:
+        mouselab_data = mouselab_data.assign(
+            pid=labeler.label_many(mouselab_data["workerid"])
+        )
+
+    worker_keys = ["workerid", "assignmentid"]
+    run_keys = worker_keys + (["run"] if "run" in mouselab_data else [])
+    score_aggregations = {"score": ("score", "sum"), "pid": ("pid", "first")}
+    # trials without a run value still count towards their worker's score
+    run_score_df = (
+        mouselab_data.groupby(run_keys, dropna=False)
+        .agg(**score_aggregations)
+        .reset_index(drop=False)
+    )
+    if run_keys != worker_keys:
+        score_df = (
+            run_score_df.groupby(worker_keys)
+            .agg(**score_aggregations)
+            .reset_index(drop=False)
+        )
+    else:
+        score_df = run_score_df
+
+    bonus_df = add_bonus_fields(
+        score_df, question_data, general_info, bonus_function=bonus_function
+    )
+    if not return_totals:
+        return bonus_df
+
+    # totals per condition (and run), with bonuses calculated on each run's scores
+    if run_keys != worker_keys:
+        total_df = add_bonus_fields(
+            run_score_df, question_data, general_info, bonus_function=bonus_function
+        )
+    else:
+        total_df = bonus_df
+    total_keys = ["cond"] + run_keys[len(worker_keys) :]
+    bonus_totals = (
+        total_df.groupby(total_keys, dropna=False)
+        .agg(
+            participants=("workerid", "size"),
+            score=("score", "sum"),
+            calculated_bonus=("calculated_bonus", "sum"),
+        )
+        .reset_index(drop=False)
+    )
+    return bonus_df, bonus_totals
+
+
+def prepare_trial_data_for_saving(trial_data):
+    """
+    Remove PII and redundant columns from trial data, and make its columns snake case.
+
+    :param trial_data: dataframe outputted by get_trial_data
+    :return: nothing, trial_data is changed in place
+    """
+    # delete  PII
+    del trial_data["workerid"]
+    del trial_data["assignmentid"]
+
+    # delete confusing redundant columns
+    # (a batch of participants can be missing it, see save_participant_files_streaming)
+    if "trial_index" in trial_data:
+        del trial_data[
+            "trial_index"
+        ]  # remove experiment trial index in favor of mouselab one
+
+    # columns to snake case for compatibility with other code in the lab
+    trial_data.columns = [to_snake_case(col) for col in trial_data.columns]
+
+
+def get_data_path(exp_name, save_path=None):
+    """
+    Get directory participant files of an experiment are saved in, creating it if needed.
+
+    :param exp_name: name of experiment (to save data under)
+    :param save_path: location to save data, default data/human
+    :return: directory as a pathlib Path
+    """  # noqa: E501
+    if save_path is None:
+        data_path = Path(f"data/human/{exp_name}")
+    else:
+        data_path = Path(f"{save_path}/{exp_name}")
+
+    data_path.mkdir(exist_ok=True, parents=True)
+    return data_path
+
+
+def get_export_tables(participant_dicts, labeler, bonus_function=None, n_jobs=1):
+    """
+    Get the tables saved by save_participant_files.
+
+    :param participant_dicts: list of participant dicts, downloaded from database
+    :param labeler: our participant Labeler
+    :param bonus_function: anonymous function that converts a score to a bonus, see save_participant_files
+    :param n_jobs: number of worker processes to parse participants in, see get_participant_data
+    :return: dictionary of {table name : dataframe} with general_info, question_data, event_data, bonuses (if trial data has scores) and trial_data, prepared for saving (see prepare_trial_data_for_saving)
+    """  # noqa: E501
+    # get general pid info, question, event and trial data (decoding datastrings once)
+    participant_data = get_participant_data(participant_dicts, labeler, n_jobs=n_jobs)
+    tables = {
+        table_name: participant_data[table_name]
+        for table_name in ["general_info", "question_data", "event_data"]
+    }
+
+    # get participant bonus, if "score" in dataframe
+    trial_data = participant_data["trial_data"]
+    if "score" in trial_data:
+        bonus_df = get_participant_bonus(
+            trial_data,
+            tables["question_data"],
+            tables["general_info"],
+            labeler,
+            bonus_function=bonus_function,
+        )
+        tables["bonuses"] = bonus_df.drop_duplicates()
+
+    # prepare trial data to be saved
+    prepare_trial_data_for_saving(trial_data)
+    tables["trial_data"] = trial_data
+    return tables
+
+
+def split_trial_data(trial_data):
+    """
+    Split trial data into a table for each jsPsych plugin type, in one pass.
+
+    :param trial_data: dataframe outputted by get_trial_data
+    :return: dictionary of {trial type : dataframe}, sorted by trial type
+    """
+    return {
+        trial_type: trial_type_data
+        for trial_type, trial_type_data in trial_data.groupby("trial_type", sort=True)
+    }
+
+
+@profiled("save_participant_files")
 def save_participant_files(
     participant_dicts,
     exp_name,
     labeler="mturk_id_mapping.pickle",
     save_path=None,
     bonus_function=None,
+    n_jobs=1,
+    format="csv",
+    max_workers=DEFAULT_MAX_WORKERS,
+    progress=None,
+    optimize_dtypes=False,
 ):
     """
     Save all participant files from an experiment.
 
     :param participant_dicts: list of participant dicts, downloaded from database (with download_from_database.download_from_database)
     :param exp_name: name of experiment (to save data under)
-    :param labeler: location of existing labeler dictionary
+    :param labeler: location of existing labeler dictionary, or a Labeler (whose labels are then left for the caller to save)
     :param save_path: location to save data
     :param bonus_function: anonymous function that converts a score to a bonus (what we told the participants, in the experiment code)default None e.g. for questionnaire study with same bonus for every participant not needed)
-    :return: Nothing, but saves data in save_path under exp_name
+    :param n_jobs: number of worker processes to parse participants in, default 1 parses them in this process, -1 uses one per CPU
+    :param format: file format, "csv" (default), "parquet" or "feather" (see file_formats.save_table)
+    :param max_workers: maximum number of files written at the same time (see file_formats.save_tables)
+    :param progress: function called with each file's name and report once it is saved (see file_formats.save_tables), default None
+    :param optimize_dtypes: if True, compact dtypes of tables (see dtypes.compact_dtypes) and save their schema, so dtypes.load_participant_file gets the same dtypes
+    :return: dictionary of {file name : report with path, number of rows and seconds taken to write, and memory saved if optimize_dtypes}, and saves data in save_path under exp_name
     """  # noqa: E501
     # make directory
-    if save_path is None:
-        data_path = Path(f"data/human/{exp_name}")
-    else:
-        data_path = Path(f"{save_path}/{exp_name}")
+    data_path = get_data_path(exp_name, save_path=save_path)
 
-    data_path.mkdir(exist_ok=True, parents=True)
+    with stage("labeler"):
+        pid_labeler = load_labeler(labeler)
 
-    with open(labeler, "rb") as f:
-        pid_labels = pickle.load(f)
-    pid_labeler = Labeler(already_labeled=pid_labels)
+    tables = get_export_tables(
+        participant_dicts, pid_labeler, bonus_function=bonus_function, n_jobs=n_jobs
+    )
 
-    # get general pid info
-    general_info = get_general_participant_data(participant_dicts, pid_labeler)
-    question_data = get_question_data(participant_dicts, pid_labeler)
-    event_data = get_event_data(participant_dicts, pid_labeler)
+    # we can close labeler now
+    with stage("labeler"):
+        save_labeler(labeler, pid_labeler)
 
-    # save general info dataframes
-    general_info.to_csv(
-        data_path.joinpath("{}.csv".format("general_info")), index=False
-    )
-    question_data.to_csv(
-        data_path.joinpath("{}.csv".format("question_data")), index=False
+    # save trialdata, saving a file for each jsPsych plugin type
+    trial_data = tables.pop("trial_data")
+    trial_type_tables = split_trial_data(trial_data)
+    tables.update(trial_type_tables)
+
+    memory_reports = {}
+    if optimize_dtypes:
+        with stage("optimize_dtypes"):
+            # trial type files share the schema of all trial data
+            schemas = {
+                **{
+                    table_name: infer_schema(tables[table_name])
+                    for table_name in tables
+                    if table_name not in trial_type_tables
+                },
+                **dict.fromkeys(trial_type_tables, infer_schema(trial_data)),
+            }
+            for table_name, schema in schemas.items():
+                compact_table = apply_schema(tables[table_name], schema)
+                memory_reports[table_name] = get_memory_report(
+                    tables[table_name], compact_table
+                )
+                tables[table_name] = compact_table
+            save_schema(schemas, data_path)
+
+    reports = save_tables(
+        tables, data_path, format=format, max_workers=max_workers, progress=progress
     )
-    event_data.to_csv(data_path.joinpath("{}.csv".format("event_data")), index=False)
+    for table_name, memory_report in memory_reports.items():
+        reports[table_name].update(memory_report)
+    return reports
 
-    trial_data = get_trial_data(participant_dicts, pid_labeler)
 
-    # we can close labeler now
-    with open(labeler, "wb") as f:
-        pickle.dump(pid_labeler.labels, f)
+@profiled("save_participant_files_streaming")
+def save_participant_files_streaming(
+    participant_batches,
+    exp_name,
+    labeler="mturk_id_mapping.pickle",
+    save_path=None,
+    bonus_function=None,
+):
+    """
+    Save all participant files from an experiment, one batch of participants at a time.
 
-    # get participant bonus, if "score" in dataframe
-    if "score" in trial_data:
-        bonus_df = get_participant_bonus(
-            trial_data,
-            question_data,
-            general_info,
-            pid_labeler,
-            bonus_function=bonus_function,
+    Each batch's tables are appended to the csv files, so only one batch of trial data is in memory at a time.
+    Files have the same rows and columns as those saved by save_participant_files, but a column's number format
+    can differ (e.g. 1 instead of 1.0 for batches in which the column has no missing values), and bonuses are
+    sorted by worker within each batch rather than overall.
+
+    :param participant_batches: iterable of lists of participant dicts, e.g. download_from_database.stream_from_database(..., yield_batches=True)
+    :param exp_name: name of experiment (to save data under)
+    :param labeler: location of existing labeler dictionary, or a Labeler (whose labels are then left for the caller to save)
+    :param save_path: location to save data
+    :param bonus_function: anonymous function that converts a score to a bonus, see save_participant_files
+    :return: number of participants saved
+    """  # noqa: E501
+    data_path = get_data_path(exp_name, save_path=save_path)
+
+    pid_labeler = load_labeler(labeler)
+
+    writer = CsvAppender(data_path)
+    # like save_participant_files, every trial type file has the columns of all trials
+    trial_columns = []
+    trial_types = []
+    num_participants = 0
+    for participant_dicts in participant_batches:
+        if not participant_dicts:
+            continue
+        num_participants += len(participant_dicts)
+
+        participant_data = get_participant_data(participant_dicts, pid_labeler)
+        for table_name in ["general_info", "question_data", "event_data"]:
+            writer.write(table_name, participant_data[table_name])
+
+        trial_data = participant_data["trial_data"]
+        if "score" in trial_data:
+            bonus_df = get_participant_bonus(
+                trial_data,
+                participant_data["question_data"],
+                participant_data["general_info"],
+                pid_labeler,
+                bonus_function=bonus_function,
+            )
+            writer.write("bonuses", bonus_df.drop_duplicates())
+
+        prepare_trial_data_for_saving(trial_data)
+        trial_columns.extend(
+            column for column in trial_data.columns if column not in trial_columns
         )
+        if "trial_type" in trial_data:
+            for trial_type, trial_type_data in trial_data.groupby(
+                "trial_type", sort=False
+            ):
+                writer.write(trial_type, trial_type_data, columns=trial_columns)
+                if trial_type not in trial_types:
+                    trial_types.append(trial_type)
 
-        # save participant bonus
-        bonus_df.drop_duplicates().to_csv(data_path.joinpath("{}.csv".format("bonuses")), index=False)
+        # free this batch's tables before the next batch is parsed
+        del participant_data, trial_data
 
-    # prepare trial data to be saved
+    # add columns of later batches to trial type files that weren't written to since
+    for trial_type in trial_types:
+        writer.add_columns(trial_type, trial_columns)
 
-    # delete  PII
-    del trial_data["workerid"]
-    del trial_data["assignmentid"]
+    # labels are saved once all batches are labeled
+    save_labeler(labeler, pid_labeler)
+    return num_participants
 
-    # delete confusing redundant columns
-    del trial_data[
-        "trial_index"
-    ]  # remove experiment trial index in favor of mouselab one
 
-    # columns to snake case for compatibility with other code in the lab
-    trial_data.columns = [to_snake_case(col) for col in trial_data.columns]
+def append_export_tables(tables, manifest, data_path):
+    """
+    Append tables of new participants to files saved by save_participant_files_incremental.
 
-    # save trialdata, saving a file for each jsPsych plugin type
-    for trial_type in np.unique(trial_data["trial_type"]):
-        trial_data[trial_data["trial_type"] == trial_type].to_csv(
-            data_path.joinpath("{}.csv".format(trial_type)), index=False
+    Nothing is written if any file would have to be rebuilt (see export_manifest.combine_table_state).
+
+    :param tables: dictionary of {table name : dataframe} of new participants, see get_export_tables
+    :param manifest: manifest of saved files, see export_manifest.create_manifest
+    :param data_path: directory participant files are saved in, as a pathlib Path
+    :return: (dictionary of {table name : state of combined table}, list of trial types), or None if files have to be rebuilt
+    """  # noqa: E501
+    if set(tables) != set(manifest["tables"]):
+        # e.g. bonuses need the trial data of all participants
+        return None
+    table_names = [name for name in tables if name != "trial_data"]
+    if not all(
+        data_path.joinpath(f"{table_name}.csv").exists()
+        for table_name in table_names + manifest["trial_types"]
+    ):
+        return None
+
+    table_states = {}
+    for table_name, dataframe in tables.items():
+        combined = combine_table_state(manifest["tables"][table_name], dataframe)
+        if combined is None:
+            return None
+        table_states[table_name], dtypes = combined
+        if dtypes:
+            tables[table_name] = dataframe.astype(dtypes)
+    if "bonuses" in tables and (
+        table_states["bonuses"]["columns"] != manifest["tables"]["bonuses"]["columns"]
+    ):
+        # new bonus columns go before the last columns, rather than at the end
+        return None
+
+    trial_columns = table_states["trial_data"]["columns"]
+    writer = CsvAppender(
+        data_path,
+        columns={
+            **{
+                table_name: manifest["tables"][table_name]["columns"]
+                for table_name in table_names
+            },
+            **{
+                trial_type: manifest["tables"]["trial_data"]["columns"]
+                for trial_type in manifest["trial_types"]
+            },
+        },
+    )
+    for table_name in table_names:
+        writer.write(
+            table_name, tables[table_name], table_states[table_name]["columns"]
+        )
+    if "bonuses" in tables:
+        # bonuses are sorted by worker, see get_participant_bonus
+        writer.sort_rows("bonuses", ["workerid", "assignmentid"])
+
+    trial_types = list(manifest["trial_types"])
+    for trial_type, trial_type_data in split_trial_data(tables["trial_data"]).items():
+        writer.write(trial_type, trial_type_data, columns=trial_columns)
+        if trial_type not in trial_types:
+            trial_types.append(trial_type)
+    # add columns of new participants to trial type files they have no trials in
+    for trial_type in trial_types:
+        writer.add_columns(trial_type, trial_columns)
+    return table_states, trial_types
+
+
+@profiled("save_participant_files_incremental")
+def save_participant_files_incremental(
+    participant_dicts,
+    exp_name,
+    labeler="mturk_id_mapping.pickle",
+    save_path=None,
+    bonus_function=None,
+    n_jobs=1,
+):
+    """
+    Save participant files of an experiment, only parsing participants that weren't saved by the last call.
+
+    A manifest of saved participants (by hashed uniqueid, with their status) is kept in the experiment's
+    directory. New participants' rows are appended to the csv files, which are then the same as those
+    saved by save_participant_files with the participants in the order they were first saved. Files are
+    rebuilt from all participant_dicts instead if a saved participant's status changed or it is missing
+    from participant_dicts, or if appending would change the format of saved rows (e.g. a column of
+    integers getting missing values, so 1 becomes 1.0).
+
+    :param participant_dicts: list of participant dicts, downloaded from database (with download_from_database.download_from_database)
+    :param exp_name: name of experiment (to save data under)
+    :param labeler: location of existing labeler dictionary, or a Labeler (whose labels are then left for the caller to save)
+    :param save_path: location to save data
+    :param bonus_function: anonymous function that converts a score to a bonus, see save_participant_files
+    :param n_jobs: number of worker processes to parse participants in, see save_participant_files
+    :return: dictionary with whether files were rebuilt and the number of new participants
+    """  # noqa: E501
+    data_path = get_data_path(exp_name, save_path=save_path)
+    manifest = load_manifest(data_path)
+    participant_statuses = get_participant_statuses(participant_dicts)
+
+    pid_labeler = load_labeler(labeler)
+
+    saved_statuses = {} if manifest is None else dict(manifest["participants"])
+    rebuild = manifest is None
+    if not rebuild:
+        statuses = dict(participant_statuses)
+        rebuild = any(
+            statuses.get(hashed_uniqueid, status) != status
+            or hashed_uniqueid not in statuses
+            for hashed_uniqueid, status in saved_statuses.items()
+        )
+
+    if not rebuild:
+        new_participants = [
+            (participant_dict, participant_status)
+            for participant_dict, participant_status in zip(
+                participant_dicts, participant_statuses
+            )
+            if participant_status[0] not in saved_statuses
+        ]
+        if not new_participants:
+            return {"rebuilt": False, "new_participants": 0}
+
+        new_participant_dicts, new_participant_statuses = zip(*new_participants)
+        tables = get_export_tables(
+            list(new_participant_dicts),
+            pid_labeler,
+            bonus_function=bonus_function,
+            n_jobs=n_jobs,
         )
+        appended = append_export_tables(tables, manifest, data_path)
+        if appended is not None:
+            table_states, trial_types = appended
+            save_labeler(labeler, pid_labeler)
+            manifest["participants"].extend(new_participant_statuses)
+            manifest["tables"] = table_states
+            manifest["trial_types"] = trial_types
+            save_manifest(manifest, data_path)
+            return {"rebuilt": False, "new_participants": len(new_participants)}
+
+    # save all files from scratch
+    tables = get_export_tables(
+        participant_dicts, pid_labeler, bonus_function=bonus_function, n_jobs=n_jobs
+    )
+    save_labeler(labeler, pid_labeler)
+
+    trial_type_tables = split_trial_data(tables["trial_data"])
+    save_tables(
+        {
+            **{
+                table_name: dataframe
+                for table_name, dataframe in tables.items()
+                if table_name != "trial_data"
+            },
+            **trial_type_tables,
+        },
+        data_path,
+    )
+    save_manifest(
+        create_manifest(participant_statuses, tables, list(trial_type_tables)),
+        data_path,
+    )
+    return {
+        "rebuilt": True,
+        "new_participants": sum(
+            hashed_uniqueid not in saved_statuses
+            for hashed_uniqueid, _ in participant_statuses
+        ),
+    }
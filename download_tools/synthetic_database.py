@@ -0,0 +1,314 @@
+"""Generates psiTurk-shaped participants databases, for testing and benchmarking."""
+import json
+import random
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from download_tools.mirror import HITID_INDEX, PARTICIPANTS_SCHEMA
+
+# jsPsych plugins trials can be generated for, with default weights
+DEFAULT_PLUGIN_MIX = {
+    "mouselab-mdp": 0.7,
+    "survey-multi-choice": 0.1,
+    "survey-text": 0.1,
+    "survey-html-form": 0.1,
+}
+
+# number of participants inserted into the database at a time
+INSERT_BATCH_SIZE = 1000
+
+START_TIME = datetime(2022, 4, 28, 12, 0, 0)
+
+
+def make_random_id(rng, length=10):
+    """
+    Make a random ID, similar to the ones given out by MTurk.
+
+    :param rng: random.Random instance
+    :param length: number of characters
+    :return: ID, as a string
+    """
+    return "".join(rng.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789", k=length))
+
+
+def make_mouselab_trial(rng, trial_index, num_nodes=13):
+    """
+    Make trialdata of a mouselab-mdp trial.
+
+    :param rng: random.Random instance
+    :param trial_index: index of mouselab trial within the experiment
+    :param num_nodes: number of nodes in the environment
+    :return: dictionary of trialdata
+    """
+    clicks = [str(node) for node in rng.sample(range(1, num_nodes), rng.randint(0, 4))]
+    rewards = [rng.choice([-48, -24, -8, -4, -2, 2, 4, 8, 24, 48]) for _ in range(3)]
+    return {
+        "revealed_states": [],
+        "num_clicks_accrued": [0] * num_nodes,
+        "stateRewards": [""]
+        + [
+            rng.choice([-48, -24, -8, -4, -2, 2, 4, 8, 24, 48])
+            for _ in range(1, num_nodes)
+        ],
+        "trial_id": rng.randint(-(2 ** 62), 2 ** 62),
+        "block": "training" if trial_index < 4 else "test",
+        "trialIndex": trial_index,
+        "score": sum(rewards) - len(clicks),
+        "simulationMode": [None, None, None],
+        "rewards": rewards,
+        "path": ["0", "0", "1", "2", "3"],
+        "rt": [rng.randint(100, 1000) for _ in range(3)],
+        "actions": [rng.choice(["up", "down", "left", "right"]) for _ in range(3)],
+        "actionTimes": sorted(rng.randint(1000, 30000) for _ in range(3)),
+        "queries": {
+            "click": {
+                "state": {
+                    "target": clicks,
+                    "time": sorted(rng.randint(100, 5000) for _ in clicks),
+                },
+                "edge": {"target": [], "time": []},
+            },
+            "mouseover": {
+                "state": {
+                    "target": clicks,
+                    "time": [rng.randint(100, 5000)] * len(clicks),
+                },
+                "edge": {"target": [], "time": []},
+            },
+        },
+        "trial_type": "mouselab-mdp",
+    }
+
+
+def make_survey_trial(rng, plugin):
+    """
+    Make trialdata of a survey-multi-choice, survey-text or survey-html-form trial.
+
+    :param rng: random.Random instance
+    :param plugin: jsPsych plugin name
+    :return: dictionary of trialdata
+    """
+    if plugin == "survey-multi-choice":
+        responses = {
+            f"Q{qidx}": rng.choice(["Yes", "No", "Maybe"]) for qidx in range(5)
+        }
+        return {
+            "rt": rng.randint(1000, 20000),
+            "responses": json.dumps(responses),
+            "correct": {f"Q{qidx}": "Yes" for qidx in range(5)},
+            "trial_type": plugin,
+        }
+    elif plugin == "survey-text":
+        responses = {
+            f"Q{qidx}": " ".join(
+                make_random_id(rng, 5) for _ in range(rng.randint(1, 8))
+            )
+            for qidx in range(3)
+        }
+    elif plugin == "survey-html-form":
+        responses = {
+            "gender": rng.choice(["female", "male", "other"]),
+            "age": str(rng.randint(18, 80)),
+            "colorblind": str(rng.randint(0, 2)),
+            "effort": str(rng.randint(0, 10)),
+        }
+    else:
+        raise ValueError(f"Unknown plugin: {plugin}")
+    return {
+        "rt": rng.randint(1000, 20000),
+        "responses": json.dumps(responses),
+        "trial_type": plugin,
+    }
+
+
+def make_datastring(
+    rng,
+    participant,
+    trials_per_participant=20,
+    events_per_participant=10,
+    plugin_mix=None,
+    datastring_size=None,
+):
+    """
+    Make a psiTurk datastring for a participant.
+
+    :param rng: random.Random instance
+    :param participant: dictionary with uniqueid, workerid, assignmentid, hitid and cond fields
+    :param trials_per_participant: number of jsPsych trials
+    :param events_per_participant: number of psiTurk events (e.g. focus changes)
+    :param plugin_mix: dictionary of {plugin name : relative frequency}, default DEFAULT_PLUGIN_MIX
+    :param datastring_size: minimum size of datastring in characters, reached by padding (default None, no padding)
+    :return: datastring, as a string
+    """  # noqa: E501
+    if plugin_mix is None:
+        plugin_mix = DEFAULT_PLUGIN_MIX
+
+    plugins = rng.choices(
+        list(plugin_mix.keys()),
+        weights=list(plugin_mix.values()),
+        k=trials_per_participant,
+    )
+    data = []
+    time_elapsed = 0
+    mouselab_index = 0
+    for trial_index, plugin in enumerate(plugins):
+        if plugin == "mouselab-mdp":
+            trialdata = make_mouselab_trial(rng, mouselab_index)
+            mouselab_index += 1
+        else:
+            trialdata = make_survey_trial(rng, plugin)
+        time_elapsed += rng.randint(1000, 30000)
+        trialdata.update(
+            {
+                "trial_index": trial_index,
+                "time_elapsed": time_elapsed,
+                "internal_node_id": f"0.0-{trial_index}.0",
+            }
+        )
+        data.append(
+            {
+                "uniqueid": participant["uniqueid"],
+                "current_trial": trial_index,
+                "dateTime": 1651154339323 + time_elapsed,
+                "trialdata": trialdata,
+            }
+        )
+
+    timestamp = 1651154334730
+    eventdata = []
+    for _ in range(events_per_participant):
+        interval = rng.randint(0, 5000)
+        timestamp += interval
+        eventdata.append(
+            {
+                "eventtype": rng.choice(["focus", "window_resize"]),
+                "value": "on",
+                "timestamp": timestamp,
+                "interval": interval,
+            }
+        )
+
+    datastring_dict = {
+        "id": participant["uniqueid"],
+        "condition": participant["cond"],
+        "counterbalance": 0,
+        "assignmentId": participant["assignmentid"],
+        "workerId": participant["workerid"],
+        "hitId": participant["hitid"],
+        "currenttrial": trials_per_participant,
+        "bonus": 0,
+        "data": data,
+        "questiondata": {
+            "params": {"COST": 1, "DEPTH": 0, "bonusRate": 0.002},
+            "final_bonus": rng.random(),
+        },
+        "eventdata": eventdata,
+        "useragent": "Mozilla/5.0 (X11; Linux x86_64; rv:99.0) Firefox/99.0",
+        "mode": "live",
+        "status": "user data saved",
+    }
+    datastring = json.dumps(datastring_dict)
+    if datastring_size is not None and len(datastring) < datastring_size:
+        # top level field, ignored when saving participant files
+        datastring_dict["padding"] = "x" * (datastring_size - len(datastring))
+        datastring = json.dumps(datastring_dict)
+    return datastring
+
+
+def create_synthetic_database(
+    database_path,
+    num_participants=1000,
+    num_hits=10,
+    trials_per_participant=20,
+    events_per_participant=10,
+    plugin_mix=None,
+    datastring_size=None,
+    seed=0,
+):
+    """
+    Create a sqlite database with a psiTurk participants table filled with synthetic participants.
+
+    :param database_path: path to (new) database file
+    :param num_participants: number of participants
+    :param num_hits: number of HITs participants are spread over
+    :param trials_per_participant: number of jsPsych trials per participant
+    :param events_per_participant: number of psiTurk events per participant
+    :param plugin_mix: dictionary of {plugin name : relative frequency}, default DEFAULT_PLUGIN_MIX
+    :param datastring_size: minimum size of datastrings in characters (default None, no padding)
+    :param seed: random seed, the same seed gives the same database
+    :return: hit_list, list of hits as strings
+    """  # noqa: E501
+    rng = random.Random(seed)
+    hit_list = [make_random_id(rng) for _ in range(num_hits)]
+
+    Path(database_path).parent.mkdir(exist_ok=True, parents=True)
+    connection = sqlite3.connect(database_path)
+    try:
+        connection.execute(PARTICIPANTS_SCHEMA)
+        connection.execute(HITID_INDEX)
+
+        rows = []
+        for participant_idx in range(num_participants):
+            workerid = make_random_id(rng, 14)
+            assignmentid = make_random_id(rng, 14)
+            begin_time = START_TIME + timedelta(minutes=participant_idx)
+            participant = {
+                "uniqueid": f"{workerid}:{assignmentid}",
+                "assignmentid": assignmentid,
+                "workerid": workerid,
+                "hitid": hit_list[participant_idx % num_hits],
+                "ipaddress": None,
+                "browser": "firefox",
+                "platform": "linux",
+                "language": "en-US",
+                "cond": rng.randint(0, 3),
+                "counterbalance": 0,
+                "codeversion": "synthetic",
+                "beginhit": str(begin_time),
+                "beginexp": str(begin_time + timedelta(seconds=30)),
+                "endhit": str(begin_time + timedelta(minutes=20)),
+                "bonus": 0.0,
+                "status": rng.choice([3, 4, 5, 7]),
+                "mode": "live",
+            }
+            participant["datastring"] = make_datastring(
+                rng,
+                participant,
+                trials_per_participant=trials_per_participant,
+                events_per_participant=events_per_participant,
+                plugin_mix=plugin_mix,
+                datastring_size=datastring_size,
+            )
+            rows.append(participant)
+
+            if (
+                len(rows) == INSERT_BATCH_SIZE
+                or participant_idx == num_participants - 1
+            ):
+                columns = list(rows[0].keys())
+                connection.executemany(
+                    "INSERT INTO participants ({}) VALUES ({})".format(
+                        ", ".join(columns),
+                        ", ".join(f":{column}" for column in columns),
+                    ),
+                    rows,
+                )
+                connection.commit()
+                rows = []
+    finally:
+        connection.close()
+    return hit_list
+
+
+def write_hit_id_file(hit_list, hit_id_file_path):
+    """
+    Write a list of hits to a HIT ID file, as read by download_from_database.get_hit_ids.
+
+    :param hit_list: list of hits as strings
+    :param hit_id_file_path: path to text file, named <EXPERIMENT_NAME>.txt
+    :return: nothing
+    """  # noqa: E501
+    Path(hit_id_file_path).parent.mkdir(exist_ok=True, parents=True)
+    with open(hit_id_file_path, "w") as f:
+        f.write("\n".join(hit_list))
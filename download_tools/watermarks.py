@@ -0,0 +1,100 @@
+"""Keeps track of which participants were already downloaded, for incremental syncs."""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+# psiTurk statuses after which a participant's data no longer changes
+# (COMPLETED, SUBMITTED, CREDITED, QUITEARLY, BONUSED)
+FINAL_STATUSES = [3, 4, 5, 6, 7]
+
+
+def hash_uniqueid(uniqueid):
+    """
+    Hash a participant's uniqueid, so worker IDs are not stored in sync files.
+
+    :param uniqueid: uniqueid field from the participants table
+    :return: hex digest, as a string
+    """
+    return hashlib.sha256(uniqueid.encode()).hexdigest()
+
+
+def get_watermark_path(watermark_dir, exp_name):
+    """
+    Get location of watermark file for an experiment.
+
+    :param watermark_dir: directory watermark files are kept in
+    :param exp_name: name of experiment
+    :return: path to watermark file
+    """
+    return Path(watermark_dir).joinpath(f"{exp_name}.watermark.json")
+
+
+def load_watermark(watermark_path):
+    """
+    Load watermark file of an experiment.
+
+    :param watermark_path: path to watermark file
+    :return: dictionary of {database_uri_key : watermark}, empty if nothing was synced yet
+    """  # noqa: E501
+    watermark_path = Path(watermark_path)
+    if not watermark_path.exists():
+        return {}
+    with open(watermark_path, "r") as f:
+        return json.load(f)
+
+
+def save_watermark(watermarks, watermark_path):
+    """
+    Save watermark file of an experiment, replacing the old file only once fully written.
+
+    :param watermarks: dictionary of {database_uri_key : watermark}
+    :param watermark_path: path to watermark file
+    :return: nothing
+    """  # noqa: E501
+    watermark_path = Path(watermark_path)
+    watermark_path.parent.mkdir(exist_ok=True, parents=True)
+
+    temporary_path = watermark_path.with_suffix(".tmp")
+    with open(temporary_path, "w") as f:
+        json.dump(watermarks, f, indent=1, sort_keys=True)
+    os.replace(temporary_path, watermark_path)
+
+
+def get_changed_uniqueids(participant_metadata, watermark):
+    """
+    Get uniqueids of participants that are new or whose status changed since the last sync.
+
+    :param participant_metadata: list of dicts with at least uniqueid and status fields
+    :param watermark: watermark of a database, as saved by update_watermark (or None)
+    :return: list of uniqueids, in the order of participant_metadata
+    """  # noqa: E501
+    synced_statuses = (watermark or {}).get("statuses", {})
+    return [
+        participant["uniqueid"]
+        for participant in participant_metadata
+        if synced_statuses.get(hash_uniqueid(participant["uniqueid"]))
+        != participant["status"]
+    ]
+
+
+def update_watermark(watermark, participant_dicts):
+    """
+    Add downloaded participants to a database's watermark.
+
+    Only participants with a final status are recorded, so the others are downloaded again next time.
+    Syncs compare the status of every participant with the watermark (see get_changed_uniqueids)
+    rather than only querying participants that began or ended after the last sync, as a status can
+    change (e.g. from COMPLETED to CREDITED) without beginexp or endhit changing.
+
+    :param watermark: watermark of a database (or None, for the first sync)
+    :param participant_dicts: participants downloaded in this sync
+    :return: updated watermark, a dictionary with a statuses field of {hashed uniqueid : status}
+    """  # noqa: E501
+    # fields of watermarks saved by older versions are dropped
+    statuses = dict((watermark or {}).get("statuses", {}))
+    for participant_dict in participant_dicts:
+        if participant_dict["status"] in FINAL_STATUSES:
+            hashed_uniqueid = hash_uniqueid(participant_dict["uniqueid"])
+            statuses[hashed_uniqueid] = participant_dict["status"]
+    return {"statuses": statuses}
@@ -9,12 +9,24 @@ setup(
     author="Rationality Enhancement Group",
     author_email="",
     description="",
+    python_requires=">=3.7",
     install_requires=[
         "numpy",
         "pandas",
-        "sqlalchemy",
+        "sqlalchemy>=1.4",
         "python-dotenv",
         "psycopg2",
         "dill",
     ],
+    extras_require={
+        "async": ["asyncpg", "aiosqlite"],
+        "fast": ["orjson"],
+        "columnar": ["pyarrow"],
+        "yaml": ["pyyaml"],
+    },
+    entry_points={
+        "console_scripts": [
+            "download-tools-export = download_tools.batch_export:main",
+        ],
+    },
 )
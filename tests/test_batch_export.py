@@ -0,0 +1,93 @@
+"""Test exporting several experiments in one process."""
+from pathlib import Path
+
+import dill as pickle
+import pandas as pd
+import pytest
+
+from download_tools.batch_export import get_hit_id_files, main
+from download_tools.download_from_database import download_from_database
+from download_tools.labeler import Labeler
+from download_tools.save_participant_files import save_participant_files
+
+DATA_PATH = Path(__file__).parents[0].joinpath("data")
+
+
+def test_get_hit_id_files():
+    """Experiments should be found in directories and YAML sessions."""
+    hit_id_dir = DATA_PATH.joinpath("hit_ids")
+    assert get_hit_id_files([hit_id_dir]) == sorted(hit_id_dir.glob("*.txt"))
+    assert get_hit_id_files(
+        [
+            DATA_PATH.joinpath("yamls/experiments/TEST1.yaml"),
+            hit_id_dir.joinpath("TEST1_A.txt"),
+        ],
+        hit_id_dir=hit_id_dir,
+    ) == [hit_id_dir.joinpath("TEST1_A.txt")]
+    with pytest.raises(ValueError):
+        get_hit_id_files(
+            [DATA_PATH.joinpath("yamls/experiments/TEST2.yaml")], hit_id_dir=hit_id_dir
+        )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_main(monkeypatch, tmp_path, capsys, workers):
+    """Exporting in one process should save the same files as exporting one by one."""
+    monkeypatch.setenv(
+        "BATCH", f"sqlite:///{DATA_PATH.joinpath('databases/first_test.db')}"
+    )
+    hit_id_file_paths = [
+        DATA_PATH.joinpath(f"hit_ids/{exp_name}.txt")
+        for exp_name in ["TEST1_A", "TEST1_B"]
+    ]
+    for labeler_name in ["batch", "serial"]:
+        with open(tmp_path.joinpath(f"{labeler_name}.pickle"), "wb") as f:
+            pickle.dump(Labeler().labels, f)
+
+    for hit_id_file_path in hit_id_file_paths:
+        save_participant_files(
+            download_from_database(hit_id_file_path, "BATCH"),
+            hit_id_file_path.stem,
+            labeler=tmp_path.joinpath("serial.pickle"),
+            save_path=tmp_path.joinpath("serial"),
+        )
+
+    exit_code = main(
+        [str(path) for path in hit_id_file_paths]
+        + [
+            "--databases",
+            "BATCH",
+            "--labeler",
+            str(tmp_path.joinpath("batch.pickle")),
+            "--save-path",
+            str(tmp_path.joinpath("batch")),
+            "--workers",
+            str(workers),
+            "--profile-dir",
+            str(tmp_path.joinpath("profiles")),
+        ]
+    )
+    assert exit_code == 0
+    assert "2 of 2 experiments exported" in capsys.readouterr().out
+
+    with open(tmp_path.joinpath("batch.pickle"), "rb") as f:
+        batch_labels = pickle.load(f)
+    with open(tmp_path.joinpath("serial.pickle"), "rb") as f:
+        serial_labels = pickle.load(f)
+    # with several workers, which experiment's participants are labeled first varies
+    assert set(batch_labels) == set(serial_labels)
+    assert sorted(batch_labels.values()) == sorted(serial_labels.values())
+
+    for hit_id_file_path in hit_id_file_paths:
+        exp_name = hit_id_file_path.stem
+        assert tmp_path.joinpath(f"profiles/{exp_name}.json").exists()
+        serial_files = sorted(tmp_path.joinpath(f"serial/{exp_name}").iterdir())
+        batch_files = sorted(tmp_path.joinpath(f"batch/{exp_name}").iterdir())
+        assert [path.name for path in batch_files] == [
+            path.name for path in serial_files
+        ]
+        for serial_file, batch_file in zip(serial_files, batch_files):
+            if workers == 1:
+                assert batch_file.read_text() == serial_file.read_text()
+            else:
+                assert len(pd.read_csv(batch_file)) == len(pd.read_csv(serial_file))
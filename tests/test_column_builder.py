@@ -0,0 +1,46 @@
+"""Test building dataframes column by column."""
+import pandas as pd
+import pytest
+
+from download_tools.column_builder import ColumnBuilder
+
+RECORDS = [
+    {"rt": 100, "response": "a"},
+    {"rt": 250, "stimulus": [1, 2]},
+    {"response": None, "correct": True},
+]
+
+
+def test_build_records():
+    """Building from records should give the same dataframe as pandas."""
+    builder = ColumnBuilder()
+    builder.extend(RECORDS)
+    pd.testing.assert_frame_equal(builder.build(), pd.DataFrame(RECORDS))
+
+
+@pytest.mark.parametrize(
+    "groups",
+    [
+        [RECORDS[:2], RECORDS[2:]],
+        [RECORDS, [], [{"rt": 1.5}]],
+        [[{"rt": 1}], [{"rt": None}, {"rt": 2}]],
+        [[{"correct": True}], [{"correct": False}, {}]],
+        [[], [{"rt": 1}]],
+        [[], []],
+    ],
+)
+def test_build_groups(groups):
+    """Building from groups should give the same dataframe as concatenating a dataframe per group."""  # noqa: E501
+    builder = ColumnBuilder()
+    group_dataframes = []
+    for group_idx, group in enumerate(groups):
+        builder.start_group()
+        builder.extend(group)
+        builder.fill_group("pid", group_idx)
+        builder.end_group()
+
+        group_dataframe = pd.DataFrame(group)
+        group_dataframe["pid"] = group_idx
+        group_dataframes.append(group_dataframe)
+
+    pd.testing.assert_frame_equal(builder.build(), pd.concat(group_dataframes))
@@ -0,0 +1,294 @@
+"""Test functions for downloading from the database."""
+import json
+import shutil
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from download_tools.download_from_database import (
+    download_changed_participants_for_hits,
+    download_from_database,
+    download_participants_for_hits,
+    get_hit_ids,
+    get_participant_order_key,
+    get_sql_filters,
+    get_sql_queries_for_hits,
+    get_sql_query_for_hits,
+    run_sql_query,
+    stream_participants_for_hits,
+    stream_sql_query,
+)
+
+DATA_PATH = Path(__file__).parents[0].joinpath("data")
+
+
+@pytest.fixture(params=[["first_test", "TEST1_A"], ["second_test", "TEST2_B"]])
+def database_case(request):
+    """Database URI and HIT list for each test database."""
+    database_name, experiment_name = request.param
+    database_uri = f"sqlite:///{DATA_PATH.joinpath(f'databases/{database_name}.db')}"
+    hits, _ = get_hit_ids(DATA_PATH.joinpath(f"hit_ids/{experiment_name}.txt"))
+    return database_uri, hits
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_stream_sql_query(database_case, batch_size):
+    """Streamed batches should be bounded and match the list-returning API."""
+    database_uri, hits = database_case
+    sql_query = get_sql_query_for_hits(hits)
+
+    batches = list(stream_sql_query(sql_query, database_uri, batch_size=batch_size))
+    assert all(0 < len(batch) <= batch_size for batch in batches)
+
+    streamed = [row for batch in batches for row in batch]
+    assert streamed == run_sql_query(sql_query, database_uri)
+    assert all(row["hitid"] in hits for row in streamed)
+
+
+@pytest.mark.parametrize(
+    "hit_chunk_size,temp_table_threshold", [(None, None), (1, None), (2, None), (10, 1)]
+)
+def test_stream_participants_for_hits(
+    database_case, hit_chunk_size, temp_table_threshold
+):
+    """Chunked and temporary table queries should return participants in the same order."""  # noqa: E501
+    database_uri, hits = database_case
+    expected = run_sql_query(get_sql_query_for_hits(hits), database_uri)
+
+    streamed = [
+        row
+        for batch in stream_participants_for_hits(
+            hits,
+            database_uri,
+            hit_chunk_size=hit_chunk_size,
+            temp_table_threshold=temp_table_threshold,
+        )
+        for row in batch
+    ]
+    assert [row["uniqueid"] for row in streamed] == [
+        row["uniqueid"] for row in expected
+    ]
+
+
+def test_stream_participants_for_hits_projected(database_case):
+    """Chunked queries should be merged in order without the columns they sort by."""
+    database_uri, hits = database_case
+    expected = [
+        {"workerid": row["workerid"]}
+        for row in run_sql_query(get_sql_query_for_hits(hits), database_uri)
+    ]
+
+    streamed = [
+        row
+        for batch in stream_participants_for_hits(
+            hits, database_uri, hit_chunk_size=1, columns=["workerid"], batch_size=2
+        )
+        for row in batch
+    ]
+    assert streamed == expected
+
+
+@pytest.mark.parametrize(
+    "dialect,expected", [("postgresql", [None, 2, 1]), ("sqlite", [2, 1, None])]
+)
+def test_get_participant_order_key(dialect, expected):
+    """The sort key should match PARTICIPANT_ORDER, with each dialect's NULL order."""
+    participants = [
+        {"status": status, "cond": 0, "beginexp": None} for status in [1, None, 2]
+    ]
+    ordered = sorted(participants, key=get_participant_order_key(dialect))
+    assert [participant["status"] for participant in ordered] == expected
+
+
+def test_get_sql_query_for_hits_is_parameterized():
+    """HIT IDs should be bound parameters, not part of the query text."""
+    malicious_hit = "'); DROP TABLE participants; --"
+    sql_query = get_sql_query_for_hits(["HIT1", malicious_hit])
+    assert malicious_hit not in str(sql_query)
+
+    assert len(get_sql_queries_for_hits(["HIT1", "HIT2", "HIT3"], 2)) == 2
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_download_from_database_multiple_databases(monkeypatch, max_workers):
+    """Participants from several databases should be merged in order of the keys."""
+    monkeypatch.setenv(
+        "FIRST", f"sqlite:///{DATA_PATH.joinpath('databases/first_test.db')}"
+    )
+    monkeypatch.setenv(
+        "SECOND", f"sqlite:///{DATA_PATH.joinpath('databases/second_test.db')}"
+    )
+    hit_id_file_path = DATA_PATH.joinpath("hit_ids/TEST1_A.txt")
+
+    first = download_from_database(hit_id_file_path, "FIRST")
+    assert len(first) > 0
+
+    merged = download_from_database(
+        hit_id_file_path, ["FIRST", "SECOND", "FIRST"], max_workers=max_workers
+    )
+    assert merged == first + first
+
+    deduplicated = download_from_database(
+        hit_id_file_path,
+        ["FIRST", "SECOND", "FIRST"],
+        max_workers=max_workers,
+        drop_duplicates=True,
+    )
+    assert deduplicated == first
+
+
+def test_download_from_database_incremental(monkeypatch, tmp_path):
+    """Incremental syncs should only download new participants or changed statuses."""
+    database_path = tmp_path.joinpath("first_test.db")
+    shutil.copy(DATA_PATH.joinpath("databases/first_test.db"), database_path)
+    with sqlite3.connect(database_path) as connection:
+        connection.execute("UPDATE participants SET status = 3")
+    monkeypatch.setenv("INCREMENTAL", f"sqlite:///{database_path}")
+
+    hit_id_file_path = DATA_PATH.joinpath("hit_ids/TEST1_A.txt")
+    watermark_dir = tmp_path.joinpath("watermarks")
+
+    everyone = download_from_database(hit_id_file_path, "INCREMENTAL")
+    first_sync = download_from_database(
+        hit_id_file_path, "INCREMENTAL", watermark_dir=watermark_dir
+    )
+    assert first_sync == everyone
+    with open(watermark_dir.joinpath("TEST1_A.watermark.json"), "r") as f:
+        assert list(json.load(f)["INCREMENTAL"]) == ["statuses"]
+    assert (
+        download_from_database(
+            hit_id_file_path, "INCREMENTAL", watermark_dir=watermark_dir
+        )
+        == []
+    )
+
+    changed_uniqueid = everyone[0]["uniqueid"]
+    with sqlite3.connect(database_path) as connection:
+        connection.execute(
+            "UPDATE participants SET status = 5 WHERE uniqueid = ?",
+            (changed_uniqueid,),
+        )
+    assert [
+        participant_dict["uniqueid"]
+        for participant_dict in download_from_database(
+            hit_id_file_path, "INCREMENTAL", watermark_dir=watermark_dir
+        )
+    ] == [changed_uniqueid]
+
+
+def test_download_from_database_two_phase(monkeypatch):
+    """Filtered and projected downloads should match filtering after the download."""
+    monkeypatch.setenv(
+        "TWO_PHASE", f"sqlite:///{DATA_PATH.joinpath('databases/first_test.db')}"
+    )
+    hit_id_file_path = DATA_PATH.joinpath("hit_ids/TEST1_A.txt")
+    everyone = download_from_database(hit_id_file_path, "TWO_PHASE")
+
+    filtered = download_from_database(
+        hit_id_file_path,
+        "TWO_PHASE",
+        participant_filter=lambda participant: participant["cond"] < 10,
+    )
+    assert filtered == [
+        participant_dict
+        for participant_dict in everyone
+        if participant_dict["cond"] < 10
+    ]
+    assert 0 < len(filtered) < len(everyone)
+
+    projected = download_from_database(
+        hit_id_file_path, "TWO_PHASE", columns=["workerid", "cond"]
+    )
+    assert [list(participant_dict) for participant_dict in projected] == [
+        ["workerid", "cond", "uniqueid", "datastring"]
+    ] * len(everyone)
+
+
+def test_download_participants_query_options(database_case):
+    """Options of HIT queries should be passed on to the queries by uniqueid."""
+    database_uri, hits = database_case
+    everyone = download_participants_for_hits(hits, database_uri)
+    query_options = {"batch_size": 1, "hit_chunk_size": 1, "temp_table_threshold": 0}
+
+    assert (
+        download_participants_for_hits(
+            hits,
+            database_uri,
+            participant_filter=lambda participant: True,
+            **query_options,
+        )
+        == everyone
+    )
+    participant_dicts, _ = download_changed_participants_for_hits(
+        hits, database_uri, **query_options
+    )
+    assert participant_dicts == everyone
+
+
+@pytest.mark.parametrize(
+    "filters,keep",
+    [
+        ({"cond": [0, 7, 12]}, lambda participant: participant["cond"] in [0, 7, 12]),
+        ({"status": 1}, lambda participant: participant["status"] == 1),
+        (
+            {"beginexp_after": "2022-04-28 14:04:18.689484"},
+            lambda participant: (participant["beginexp"] or "")
+            >= "2022-04-28 14:04:18.689484",
+        ),
+        (
+            {"beginexp_before": datetime(2022, 4, 28, 14, 6)},
+            lambda participant: participant["beginexp"] is not None
+            and participant["beginexp"] < "2022-04-28 14:06:00",
+        ),
+        (
+            {"min_datastring_length": 5000, "counterbalance": [0]},
+            lambda participant: len(participant["datastring"]) >= 5000,
+        ),
+    ],
+)
+@pytest.mark.parametrize("temp_table_threshold", [0, None])
+def test_stream_participants_for_hits_filters(
+    database_case, filters, keep, temp_table_threshold
+):
+    """Filters compiled into sql should match filtering after the download."""
+    database_uri, hits = database_case
+    everyone = [
+        participant
+        for batch in stream_participants_for_hits(hits, database_uri)
+        for participant in batch
+    ]
+    filtered = [
+        participant
+        for batch in stream_participants_for_hits(
+            hits,
+            database_uri,
+            filters=filters,
+            temp_table_threshold=temp_table_threshold,
+        )
+        for participant in batch
+    ]
+    assert filtered == [participant for participant in everyone if keep(participant)]
+
+
+def test_download_from_database_filters(monkeypatch):
+    """download_from_database should apply filters, and reject unknown ones."""
+    monkeypatch.setenv(
+        "FILTERS", f"sqlite:///{DATA_PATH.joinpath('databases/first_test.db')}"
+    )
+    hit_id_file_path = DATA_PATH.joinpath("hit_ids/TEST1_A.txt")
+    everyone = download_from_database(hit_id_file_path, "FILTERS")
+
+    filtered = download_from_database(
+        hit_id_file_path, "FILTERS", filters={"cond": [0, 7]}
+    )
+    assert filtered == [
+        participant_dict
+        for participant_dict in everyone
+        if participant_dict["cond"] in [0, 7]
+    ]
+    assert 0 < len(filtered) < len(everyone)
+
+    with pytest.raises(ValueError):
+        get_sql_filters({"condition": [0]})
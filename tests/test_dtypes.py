@@ -0,0 +1,60 @@
+"""Test compacting dtypes of participant dataframes."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from download_tools.dtypes import (
+    compact_dtypes,
+    get_memory_report,
+    load_participant_file,
+    load_schema,
+)
+from download_tools.save_participant_files import save_participant_files
+
+
+def test_compact_dtypes():
+    """Columns should get compact dtypes, keeping their values."""
+    dataframe = pd.DataFrame(
+        {
+            "trial_type": ["mouselab-mdp", "survey-text"] * 50,
+            "pid": np.arange(100.0),
+            "block": [1.0, np.nan] * 50,
+            "rt": np.linspace(0, 1, 100),
+            "stimulus": [[1, 2]] * 100,
+            "trial_id": np.arange(1000, 1100),
+        }
+    )
+    compact_dataframe, schema = compact_dtypes(dataframe)
+    assert schema == {
+        "trial_type": "category",
+        "pid": "Int8",
+        "block": "Int8",
+        "trial_id": "int16",
+    }
+    assert compact_dataframe.astype(dataframe.dtypes).equals(dataframe)
+    assert get_memory_report(dataframe, compact_dataframe)["saved_bytes"] > 0
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet"])
+def test_save_participant_files_optimize_dtypes(test_case, tmp_path, file_format):
+    """Saved files should be loaded with the compact dtypes they were saved with."""
+    if file_format != "csv":
+        pytest.importorskip("pyarrow")
+    example_participant_dicts, experiment_name, labeller_path = test_case
+    reports = save_participant_files(
+        example_participant_dicts,
+        experiment_name,
+        labeler=labeller_path,
+        save_path=tmp_path,
+        format=file_format,
+        optimize_dtypes=True,
+    )
+
+    data_path = tmp_path.joinpath(experiment_name)
+    schemas = load_schema(data_path)
+    assert set(schemas) == set(reports)
+    for table_name, report in reports.items():
+        assert "saved_bytes" in report
+        table = load_participant_file(data_path, table_name, format=file_format)
+        for column, dtype in schemas[table_name].items():
+            assert str(table[column].dtype) == dtype
@@ -0,0 +1,26 @@
+"""Test engine registry."""
+from pathlib import Path
+
+from download_tools.engines import dispose_engine, get_engine, get_engine_kwargs
+
+DATABASE_URI = (
+    f"sqlite:///{Path(__file__).parents[0].joinpath('data/databases/first_test.db')}"
+)
+
+
+def test_get_engine_is_cached():
+    """The same engine should be returned for the same URI until it is disposed."""
+    engine = get_engine(DATABASE_URI)
+    assert get_engine(DATABASE_URI) is engine
+
+    dispose_engine(DATABASE_URI)
+    assert get_engine(DATABASE_URI) is not engine
+    dispose_engine(DATABASE_URI)
+
+
+def test_get_engine_kwargs():
+    """Pool size settings should only be passed to engines that use them."""
+    assert "pool_size" not in get_engine_kwargs(DATABASE_URI)
+    assert get_engine_kwargs("postgresql://user@localhost/db", {"pool_size": 2})[
+        "pool_size"
+    ] == 2
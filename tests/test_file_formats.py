@@ -0,0 +1,34 @@
+"""Test saving dataframes as csv, Parquet and Feather files."""
+import json
+
+import pandas as pd
+import pytest
+
+from download_tools.file_formats import save_table
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "feather"])
+def test_save_table_ragged_dicts(tmp_path, file_format):
+    """Dicts with different keys should be read back with only their own keys."""
+    pytest.importorskip("pyarrow")
+    dataframe = pd.DataFrame(
+        {
+            "correct": [{"Q0": "Yes"}, {"Q1": 2, "Q2": ["a"]}, None],
+            "responses": [[{"Q0": 1}], [{"Q1": "No"}, {}], []],
+            "rewards": [[1, 2], [3], []],
+        }
+    )
+    file_path = save_table(dataframe, tmp_path, "survey", format=file_format)
+    saved_dataframe = getattr(pd, f"read_{file_format}")(file_path)
+
+    for column_name in ["correct", "responses"]:
+        assert [
+            None if pd.isna(value) else json.loads(value)
+            for value in saved_dataframe[column_name]
+        ] == dataframe[column_name].tolist()
+    # columns without dicts are still stored natively
+    assert [value.tolist() for value in saved_dataframe["rewards"]] == [
+        [1, 2],
+        [3],
+        [],
+    ]
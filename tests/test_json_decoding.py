@@ -0,0 +1,118 @@
+"""Test JSON decoding backends."""
+import gc
+import json
+import threading
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from download_tools import json_decoding
+from download_tools.save_participant_files import decode_datastring
+
+DATA_PATH = Path(__file__).parents[0].joinpath("data")
+
+
+def assert_identical(decoded, expected):
+    """Check decoded JSON matches expected JSON, including key order and types."""
+    assert type(decoded) is type(expected)
+    if isinstance(expected, dict):
+        assert list(decoded) == list(expected)
+        for key in expected:
+            assert_identical(decoded[key], expected[key])
+    elif isinstance(expected, list):
+        assert len(decoded) == len(expected)
+        for decoded_item, expected_item in zip(decoded, expected):
+            assert_identical(decoded_item, expected_item)
+    else:
+        assert repr(decoded) == repr(expected)
+
+
+@pytest.mark.parametrize("backend", list(json_decoding.JSON_BACKENDS))
+@pytest.mark.parametrize("input_type", [str, bytes, memoryview])
+@pytest.mark.parametrize("database_name", ["first_test", "second_test"])
+def test_backends_match_stdlib(backend, input_type, database_name):
+    """Every backend should decode datastrings exactly as the standard library does."""
+    connection = sqlite3.connect(DATA_PATH.joinpath(f"databases/{database_name}.db"))
+    datastrings = [
+        datastring
+        for (datastring,) in connection.execute(
+            "SELECT datastring FROM participants WHERE datastring IS NOT NULL"
+        )
+    ]
+    connection.close()
+
+    for datastring in datastrings:
+        data = datastring if input_type is str else input_type(datastring.encode())
+        assert_identical(
+            json_decoding.JSON_BACKENDS[backend](data), json.loads(datastring)
+        )
+
+
+@pytest.mark.parametrize("backend", list(json_decoding.JSON_BACKENDS))
+@pytest.mark.parametrize(
+    "document",
+    [
+        '{"trial_id": -9223372036854775809, "score": NaN}',
+        '{"trial_id": 18446744073709551616, "rt": Infinity}',
+        '{"trial_id": -9223372036854775808, "other_id": 18446744073709551615}',
+        '{"time": 0.12345678901234567890123, "a": 1, "a": 2}',
+    ],
+)
+def test_backends_edge_cases(backend, document):
+    """Large integers and NaN should be decoded as the standard library does."""
+    assert_identical(
+        json_decoding.JSON_BACKENDS[backend](document), json.loads(document)
+    )
+
+
+def test_set_json_backend():
+    """Backends can be set by name or as a function, and decode_datastring uses them."""
+    participant_dict = {"datastring": b'{"data": []}'}
+    try:
+        json_decoding.set_json_backend(lambda data: "decoded")
+        assert decode_datastring(participant_dict) == "decoded"
+
+        json_decoding.set_json_backend("json")
+        assert decode_datastring(participant_dict) == {"data": []}
+
+        with pytest.raises(ValueError):
+            json_decoding.set_json_backend("simdjson")
+    finally:
+        json_decoding.set_json_backend()
+
+
+def test_has_large_float():
+    """Only integers orjson can't decode exactly should be reported."""
+    pytest.importorskip("orjson")
+    for document, expected in [
+        ('{"id": -9223372036854775809}', True),
+        ('{"id": -9223372036854775808, "other_id": -9000000000000000000}', False),
+        ('{"id": 18446744073709551616}', True),
+        ('{"id": 1844674407370955161, "rt": -12, "time": 1.5e-20}', False),
+    ]:
+        decoded = json_decoding.orjson.loads(document)
+        assert json_decoding.has_large_float(decoded) is expected
+
+
+def test_paused_gc_threads():
+    """The garbage collector should only be enabled once every pause has ended."""
+    assert gc.isenabled()
+    first_paused, second_paused, first_done = (threading.Event() for _ in range(3))
+
+    def pause_first():
+        with json_decoding.paused_gc():
+            first_paused.set()
+            second_paused.wait()
+        first_done.set()
+
+    thread = threading.Thread(target=pause_first)
+    thread.start()
+    first_paused.wait()
+    with json_decoding.paused_gc():
+        second_paused.set()
+        first_done.wait()
+        # the first pause ended, but this one hasn't
+        assert not gc.isenabled()
+    thread.join()
+    assert gc.isenabled()
@@ -1,11 +1,14 @@
 """Test labeler."""
 import secrets
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import dill as pickle
+import numpy as np
+import pandas as pd
 import pytest
 
-from download_tools.labeler import Labeler
+from download_tools.labeler import Labeler, SqliteLabeler, migrate_pickle_labeler
 
 
 class LabelerTestClass:
@@ -132,3 +135,94 @@ def test_adding_to_existing(test_case):
 
     # labeler keys and worker_ids should have the same length
     assert len(labeler_keys) == len(test_case.worker_ids)
+
+
+def label_workers(store_path, worker_ids):
+    """
+    Label workers with a labeler store, in a process of its own.
+
+    :param store_path: path to labeler store
+    :param worker_ids: list of worker ids
+    :return: list of labels
+    """
+    labeler = SqliteLabeler(store_path)
+    labels = [labeler(worker_id) for worker_id in worker_ids]
+    labeler.close()
+    return labels
+
+
+def test_migrate_pickle_labeler(test_case, tmp_path):
+    """Labels migrated to a labeler store should be the same as the pickled ones."""
+    store_path = tmp_path.joinpath("labels.db")
+    with open(test_case.file_name, "rb") as f:
+        saved_labels = pickle.load(f)
+    assert migrate_pickle_labeler(test_case.file_name, store_path) == len(saved_labels)
+    # migrating again copies nothing
+    assert migrate_pickle_labeler(test_case.file_name, store_path) == 0
+
+    labeler = Labeler(already_labeled=dict(saved_labels))
+    store_labeler = SqliteLabeler(store_path)
+    assert store_labeler.get_labels() == saved_labels
+    for worker_id in test_case.worker_ids:
+        assert store_labeler(worker_id) == labeler(worker_id)
+        assert store_labeler.unlabel(labeler(worker_id)) == worker_id
+    assert store_labeler.lookup("not labeled") is None
+    store_labeler.close()
+
+    # labels already given to other workers are not overwritten
+    with open(test_case.file_name, "wb") as f:
+        pickle.dump({"other worker": 0}, f)
+    with pytest.raises(ValueError):
+        migrate_pickle_labeler(test_case.file_name, store_path)
+
+
+def test_sqlite_labeler_processes(tmp_path):
+    """Processes sharing a labeler store should agree on labels, without duplicates."""
+    store_path = tmp_path.joinpath("labels.db")
+    worker_ids = LabelerTestClass.set_up_worker_ids(200)
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        process_labels = list(
+            executor.map(
+                label_workers,
+                [store_path] * 4,
+                [worker_ids[offset:] + worker_ids[:offset] for offset in range(4)],
+            )
+        )
+
+    labels = SqliteLabeler(store_path).get_labels()
+    assert set(labels) == set(worker_ids)
+    assert sorted(labels.values()) == list(range(len(worker_ids)))
+    for offset, worker_labels in enumerate(process_labels):
+        assert worker_labels == [
+            labels[worker_id] for worker_id in worker_ids[offset:] + worker_ids[:offset]
+        ]
+
+
+@pytest.mark.parametrize("labeler_class", [Labeler, SqliteLabeler])
+def test_label_many(test_case, tmp_path, labeler_class):
+    """Labeling keys all at once should give the same labels as one at a time."""
+    with open(test_case.file_name, "rb") as f:
+        saved_labels = pickle.load(f)
+    if labeler_class is Labeler:
+        labeler = Labeler(already_labeled=dict(saved_labels))
+    else:
+        store_path = tmp_path.joinpath("labels.db")
+        migrate_pickle_labeler(test_case.file_name, store_path)
+        labeler = SqliteLabeler(store_path)
+
+    # each worker a few times, in a shuffled order
+    rng = np.random.default_rng(0)
+    worker_ids = pd.Series(rng.permutation(test_case.worker_ids * 3))
+    serial_labeler = Labeler(already_labeled=dict(saved_labels))
+    serial_labels = [serial_labeler(worker_id) for worker_id in worker_ids]
+
+    labels = labeler.label_many(worker_ids)
+    assert labels.dtype == np.int64
+    assert labels.tolist() == serial_labels
+    assert labeler.unlabel_many(labels).tolist() == worker_ids.tolist()
+    # labeling again gives no new labels
+    assert labeler.label_many(worker_ids.to_numpy()).tolist() == serial_labels
+    if labeler_class is SqliteLabeler:
+        assert labeler.get_labels() == serial_labeler.labels
+    else:
+        assert labeler.labels == serial_labeler.labels
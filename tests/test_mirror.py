@@ -0,0 +1,109 @@
+"""Test local SQLite mirror of the participants table."""
+import shutil
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from download_tools.download_from_database import (
+    download_from_database,
+    read_from_mirror,
+    sync_mirror,
+)
+from download_tools.engines import get_engine
+from download_tools.mirror import (
+    create_mirror,
+    prepare_participant_for_mirror,
+    write_participants_to_mirror,
+)
+
+DATA_PATH = Path(__file__).parents[0].joinpath("data")
+
+
+def test_mirror(monkeypatch, tmp_path):
+    """Reading from a synced mirror should give the same participants as a database."""
+    monkeypatch.setenv(
+        "MIRRORED", f"sqlite:///{DATA_PATH.joinpath('databases/first_test.db')}"
+    )
+    hit_id_file_path = DATA_PATH.joinpath("hit_ids/TEST1_A.txt")
+    mirror_path = tmp_path.joinpath("mirror.db")
+
+    from_database = download_from_database(hit_id_file_path, "MIRRORED")
+    assert sync_mirror(hit_id_file_path, "MIRRORED", mirror_path) == len(from_database)
+
+    # reading from the mirror doesn't need a database
+    offline = download_from_database(hit_id_file_path, mirror_path=mirror_path)
+    assert offline == from_database
+
+    synced = download_from_database(
+        hit_id_file_path, "MIRRORED", mirror_path=mirror_path
+    )
+    assert synced == from_database
+
+    # datastrings are stored compressed
+    with sqlite3.connect(mirror_path) as connection:
+        assert connection.execute(
+            "SELECT DISTINCT typeof(datastring) FROM participants"
+        ).fetchall() == [("blob",)]
+
+
+def test_mirror_several_databases(monkeypatch, tmp_path):
+    """Mirrors should keep the first database's participant, as drop_duplicates does."""
+    for database_key in ["FIRST_COPY", "SECOND_COPY"]:
+        database_path = tmp_path.joinpath(f"{database_key}.db")
+        shutil.copy(DATA_PATH.joinpath("databases/first_test.db"), database_path)
+        monkeypatch.setenv(database_key, f"sqlite:///{database_path}")
+    with sqlite3.connect(tmp_path.joinpath("SECOND_COPY.db")) as connection:
+        connection.execute("UPDATE participants SET cond = cond + 100")
+    database_keys = ["FIRST_COPY", "SECOND_COPY"]
+    hit_id_file_path = DATA_PATH.joinpath("hit_ids/TEST1_A.txt")
+    mirror_path = tmp_path.joinpath("mirror.db")
+
+    from_databases = download_from_database(
+        hit_id_file_path, database_keys, drop_duplicates=True
+    )
+    assert sync_mirror(hit_id_file_path, database_keys, mirror_path) == len(
+        from_databases
+    )
+    # a later change in the second database doesn't replace the first's participants
+    with sqlite3.connect(tmp_path.joinpath("SECOND_COPY.db")) as connection:
+        connection.execute("UPDATE participants SET status = 7")
+    sync_mirror(hit_id_file_path, database_keys, mirror_path)
+
+    assert (
+        download_from_database(
+            hit_id_file_path, mirror_path=mirror_path, drop_duplicates=True
+        )
+        == from_databases
+    )
+    with pytest.raises(ValueError):
+        download_from_database(hit_id_file_path, mirror_path=mirror_path)
+
+
+def test_mirror_datetimes(tmp_path):
+    """Datetimes should be stored so filters on them match those of the database."""
+    mirror_path = tmp_path.joinpath("mirror.db")
+    beginexp = datetime(2022, 4, 28, 14, 4, 18)
+    participant_dict = {
+        "uniqueid": "worker:assignment",
+        "assignmentid": "assignment",
+        "workerid": "worker",
+        "hitid": "hit",
+        "beginexp": beginexp,
+        "status": 3,
+        "datastring": "{}",
+    }
+    assert prepare_participant_for_mirror(participant_dict)["beginexp"] == (
+        "2022-04-28 14:04:18.000000"
+    )
+
+    with get_engine(create_mirror(mirror_path)).begin() as connection:
+        write_participants_to_mirror(
+            connection, [("DATABASE", [participant_dict])], "TEST", {}
+        )
+    for filters, expected in [
+        ({"beginexp_after": beginexp}, 1),
+        ({"beginexp_before": beginexp}, 0),
+    ]:
+        assert len(read_from_mirror(["hit"], mirror_path, filters=filters)) == expected
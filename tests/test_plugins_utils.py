@@ -1,8 +1,99 @@
 """Test plugin utility functions."""
 from pathlib import Path
 
-from download_tools.plugins.utils import add_keys_to_df
+import numpy as np
+import pandas as pd
+import pytest
+
+from download_tools.plugins.utils import (
+    add_keys_to_df,
+    decode_nested_column,
+    decode_nested_value,
+)
+from download_tools.save_participant_files import save_participant_files
 
 
 def test_add_keys_to_df():
     raise NotImplementedError
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        [0, -3.5, 12],
+        {"Q0": "yes", "Q1": ["a, b", "it's"], "Q2": None, "Q3": True},
+        {"click": {"state": {"target": ["1", "2"], "time": [1.5e12]}}},
+        "plain string",
+        7,
+    ],
+)
+def test_decode_nested_value(value):
+    """Nested values saved in csv files (as their string representation) should be decoded."""  # noqa: E501
+    assert (
+        decode_nested_value(str(value) if not isinstance(value, str) else repr(value))
+        == value
+    )  # noqa: E501
+
+
+def test_decode_nested_value_special():
+    """nan and inf should be decoded, and code should not be run."""
+    decoded = decode_nested_value("{'Q0': nan, 'Q1': -inf}")
+    assert np.isnan(decoded["Q0"]) and decoded["Q1"] == -np.inf
+    assert decode_nested_value(
+        np.array([np.array([1, 2]), {"a": np.array([3])}], dtype=object)
+    ) == [
+        [1, 2],
+        {"a": [3]},
+    ]  # noqa: E501
+    # strings within values read from columnar files are not decoded again
+    assert decode_nested_value({"Q0": "Yes"}) == {"Q0": "Yes"}
+    assert decode_nested_value(np.array(["4", "[1]"], dtype=object)) == ["4", "[1]"]
+    with pytest.raises(ValueError):
+        decode_nested_value("__import__('os').getcwd()")
+
+
+def test_decode_nested_column():
+    """Columns should be decoded as with eval, skipping missing values."""
+    column = pd.Series(
+        ["[1, 2]", np.nan, "{'Q0': 'a'}", "[1, 2]", [3]], index=[4, 3, 2, 1, 0]
+    )  # noqa: E501
+    decoded = decode_nested_column(column)
+    assert decoded.index.equals(column.index)
+    assert decoded.tolist()[2:] == [{"Q0": "a"}, [1, 2], [3]]
+    assert decoded[4] == [1, 2] and np.isnan(decoded[3])
+
+
+def test_decode_nested_column_columnar(test_case, tmp_path):
+    """Nested columns should be decoded the same from csv and Parquet files."""
+    pytest.importorskip("pyarrow")
+    example_participant_dicts, experiment_name, labeller_path = test_case
+    for save_format in ["csv", "parquet"]:
+        save_participant_files(
+            example_participant_dicts,
+            experiment_name,
+            labeler=labeller_path,
+            save_path=tmp_path.joinpath(save_format),
+            format=save_format,
+        )
+
+    for table_name, column_name in [
+        ("mouselab-mdp", "queries"),
+        ("survey-multi-choice", "correct"),
+    ]:
+        decoded_columns = [
+            decode_nested_column(
+                read_file(
+                    tmp_path.joinpath(
+                        f"{save_format}/{experiment_name}/{table_name}.{save_format}"
+                    )
+                )[column_name]
+            )
+            for save_format, read_file in [
+                ("csv", pd.read_csv),
+                ("parquet", pd.read_parquet),
+            ]
+        ]
+        csv_column, parquet_column = decoded_columns
+        assert csv_column.notna().any()
+        assert csv_column.isna().equals(parquet_column.isna())
+        assert csv_column.dropna().tolist() == parquet_column.dropna().tolist()
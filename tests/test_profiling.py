@@ -0,0 +1,112 @@
+"""Test profiling stages of downloads and exports."""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from download_tools.download_from_database import download_from_database
+from download_tools.profiling import (
+    add_metrics,
+    in_current_context,
+    profile,
+    profiled,
+    stage,
+)
+from download_tools.save_participant_files import save_participant_files
+
+DATA_PATH = Path(__file__).parents[0].joinpath("data")
+
+
+@profiled("square")
+def square(value):
+    """Square a value, counting it as a row."""
+    add_metrics(rows=1, bytes=8)
+    return value**2
+
+
+def test_profile_stages():
+    """Stages should be summed over calls, nested, and recorded on other threads."""
+    assert square(2) == 4
+
+    reports = []
+    with profile(callback=reports.append):
+        with stage("outer"):
+            assert square(3) == 9
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                squares = list(executor.map(in_current_context(square), range(4)))
+            assert squares == [0, 1, 4, 9]
+        # not recorded, as threads don't inherit the context
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(square, range(4)))
+
+    assert square(2) == 4
+    (report,) = reports
+    stages = {stage["stage"]: stage for stage in report["stages"]}
+    assert list(stages) == ["outer/square", "outer"]
+    assert stages["outer/square"]["calls"] == 5
+    assert stages["outer/square"]["rows"] == 5
+    assert stages["outer/square"]["bytes"] == 40
+    assert stages["outer"]["calls"] == 1
+    assert stages["outer"]["rows"] == 0
+    assert report["wall_seconds"] >= stages["outer"]["wall_seconds"]
+    assert (
+        report["process_peak_memory_bytes"]
+        >= stages["outer"]["process_peak_memory_bytes"]
+    )
+
+
+def test_profile_export(test_case, tmp_path):
+    """Profiling an export should report its stages and largest participants."""
+    example_participant_dicts, experiment_name, labeller_path = test_case
+    hit_id_file_path = DATA_PATH.joinpath(f"hit_ids/{experiment_name}.txt")
+    database_name = experiment_name.split("_")[0]
+    reports = []
+    with profile(
+        output_path=tmp_path.joinpath("profile.json"),
+        callback=reports.append,
+        max_participants=2,
+    ):
+        participant_dicts = download_from_database(hit_id_file_path, database_name)
+        file_reports = save_participant_files(
+            participant_dicts,
+            experiment_name,
+            labeler=labeller_path,
+            save_path=tmp_path,
+        )
+
+    (report,) = reports
+    with open(tmp_path.joinpath("profile.json"), "r") as f:
+        assert json.load(f) == report
+
+    stages = {stage["stage"]: stage for stage in report["stages"]}
+    datastring_bytes = sum(
+        len(participant_dict["datastring"]) for participant_dict in participant_dicts
+    )
+    for stage_name in [
+        "download_from_database",
+        "save_participant_files/get_participant_data/decode_datastrings",
+    ]:
+        assert stages[stage_name]["rows"] == len(participant_dicts)
+        assert stages[stage_name]["bytes"] == datastring_bytes
+    download_stage = stages["download_from_database/download_participants_for_hits"]
+    assert download_stage["rows"] == len(participant_dicts)
+    save_table_stage = stages["save_participant_files/save_tables/save_table"]
+    assert save_table_stage["calls"] == len(file_reports)
+    assert save_table_stage["rows"] == sum(
+        file_report["rows"] for file_report in file_reports.values()
+    )
+    assert save_table_stage["bytes"] == sum(
+        file_report["path"].stat().st_size for file_report in file_reports.values()
+    )
+    for stage_report in report["stages"]:
+        assert stage_report["wall_seconds"] >= 0
+        assert stage_report["process_cpu_seconds"] >= 0
+        assert stage_report["process_peak_memory_bytes"] > 0
+
+    largest_sizes = sorted(
+        (len(participant_dict["datastring"]) for participant_dict in participant_dicts),
+        reverse=True,
+    )[:2]
+    assert [
+        participant["datastring_bytes"]
+        for participant in report["largest_participants"]
+    ] == largest_sizes
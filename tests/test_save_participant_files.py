@@ -1,8 +1,27 @@
 """Tests to make sure some files are being generated by the \
 save participant files function."""
+import copy
+import json
 from pathlib import Path
 
-from download_tools.save_participant_files import save_participant_files
+import numpy as np
+import pandas as pd
+import pytest
+
+from download_tools.labeler import Labeler, migrate_pickle_labeler
+from download_tools.save_participant_files import (
+    columnwise,
+    decode_datastrings,
+    get_event_data,
+    get_general_participant_data,
+    get_participant_bonus,
+    get_participant_data,
+    get_question_data,
+    get_trial_data,
+    save_participant_files,
+    save_participant_files_incremental,
+    save_participant_files_streaming,
+)
 
 
 def test_save_participant_files(test_case):
@@ -23,3 +42,264 @@ def test_save_participant_files(test_case):
         )
         is True
     )
+
+
+def test_get_participant_data(test_case):
+    """Decoding datastrings once should give the same dataframes as each extractor."""
+    example_participant_dicts, _, _ = test_case
+    decoded_datastrings = decode_datastrings(example_participant_dicts)
+    original_datastrings = copy.deepcopy(decoded_datastrings)
+
+    participant_data = get_participant_data(
+        example_participant_dicts, Labeler(), decoded_datastrings=decoded_datastrings
+    )
+    # the shared decoded datastrings are left untouched
+    assert decoded_datastrings == original_datastrings
+
+    labeler = Labeler()
+    for table_name, extractor in [
+        ("general_info", get_general_participant_data),
+        ("question_data", get_question_data),
+        ("event_data", get_event_data),
+        ("trial_data", get_trial_data),
+    ]:
+        assert participant_data[table_name].equals(
+            extractor(example_participant_dicts, labeler)
+        )
+
+
+def test_get_participant_data_parallel(test_case):
+    """Parsing in a process pool should give the same dataframes and pids as serial."""
+    example_participant_dicts, _, _ = test_case
+    serial_labeler = Labeler()
+    serial_data = get_participant_data(example_participant_dicts, serial_labeler)
+
+    parallel_labeler = Labeler()
+    parallel_data = get_participant_data(
+        example_participant_dicts, parallel_labeler, n_jobs=2, chunk_size=1
+    )
+    assert parallel_labeler.labels == serial_labeler.labels
+    for table_name, table in serial_data.items():
+        assert parallel_data[table_name].equals(table)
+        assert list(parallel_data[table_name].columns) == list(table.columns)
+        assert parallel_data[table_name].dtypes.equals(table.dtypes)
+        assert parallel_data[table_name].index.equals(table.index)
+
+
+def test_save_participant_files_labeler_store(test_case, tmp_path):
+    """A labeler store should give the same pids as the pickled labeler."""
+    example_participant_dicts, experiment_name, labeller_path = test_case
+    store_path = tmp_path.joinpath("labels.db")
+    migrate_pickle_labeler(labeller_path, store_path)
+    for labeler in [labeller_path, store_path]:
+        save_participant_files(
+            example_participant_dicts,
+            experiment_name,
+            labeler=labeler,
+            save_path=tmp_path.joinpath(labeler.suffix[1:]),
+        )
+
+    pickle_files = sorted(tmp_path.joinpath(f"pickle/{experiment_name}").iterdir())
+    store_files = sorted(tmp_path.joinpath(f"db/{experiment_name}").iterdir())
+    assert [path.name for path in store_files] == [path.name for path in pickle_files]
+    for pickle_file, store_file in zip(pickle_files, store_files):
+        assert store_file.read_text() == pickle_file.read_text()
+
+
+def test_save_participant_files_concurrent(test_case, tmp_path):
+    """Writing files concurrently should save the same files as writing them in turn."""
+    example_participant_dicts, experiment_name, labeller_path = test_case
+    progress_calls = []
+    reports = {}
+    for max_workers in [1, 4]:
+        reports[max_workers] = save_participant_files(
+            example_participant_dicts,
+            experiment_name,
+            labeler=labeller_path,
+            save_path=tmp_path.joinpath(str(max_workers)),
+            max_workers=max_workers,
+            progress=lambda table_name, report: progress_calls.append(table_name),
+        )
+
+    assert list(reports[4]) == list(reports[1])
+    assert sorted(progress_calls) == sorted(list(reports[1]) * 2)
+    for table_name, report in reports[4].items():
+        assert report["path"].read_text() == reports[1][table_name]["path"].read_text()
+        assert report["rows"] == len(pd.read_csv(report["path"]))
+        assert report["seconds"] >= 0
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "feather"])
+def test_save_participant_files_columnar(test_case, tmp_path, file_format):
+    """Columnar formats should save the same tables as csv, keeping nested columns."""
+    pytest.importorskip("pyarrow")
+    example_participant_dicts, experiment_name, labeller_path = test_case
+    for save_format in ["csv", file_format]:
+        save_participant_files(
+            example_participant_dicts,
+            experiment_name,
+            labeler=labeller_path,
+            save_path=tmp_path.joinpath(save_format),
+            format=save_format,
+        )
+
+    csv_files = sorted(tmp_path.joinpath(f"csv/{experiment_name}").iterdir())
+    columnar_files = sorted(
+        tmp_path.joinpath(f"{file_format}/{experiment_name}").iterdir()
+    )
+    assert [file.stem for file in columnar_files] == [file.stem for file in csv_files]
+    for csv_file, columnar_file in zip(csv_files, columnar_files):
+        csv_table = pd.read_csv(csv_file)
+        columnar_table = getattr(pd, f"read_{file_format}")(columnar_file)
+        assert list(columnar_table.columns) == list(csv_table.columns)
+        assert len(columnar_table) == len(csv_table)
+
+        if columnar_file.stem == "mouselab-mdp":
+            # lists are stored as lists, rather than as their string representation
+            assert not isinstance(columnar_table["rewards"].iloc[0], str)
+
+
+@pytest.mark.parametrize("batch_size", [1, 3])
+def test_save_participant_files_streaming(test_case, tmp_path, batch_size):
+    """Saving batch by batch should save the same tables as saving all at once."""
+    example_participant_dicts, experiment_name, labeller_path = test_case
+    save_participant_files(
+        example_participant_dicts,
+        experiment_name,
+        labeler=labeller_path,
+        save_path=tmp_path.joinpath("all"),
+    )
+    assert save_participant_files_streaming(
+        (
+            example_participant_dicts[batch_start : batch_start + batch_size]
+            for batch_start in range(0, len(example_participant_dicts), batch_size)
+        ),
+        experiment_name,
+        labeler=labeller_path,
+        save_path=tmp_path.joinpath("streaming"),
+    ) == len(example_participant_dicts)
+
+    all_files = sorted(tmp_path.joinpath(f"all/{experiment_name}").iterdir())
+    streaming_files = sorted(
+        tmp_path.joinpath(f"streaming/{experiment_name}").iterdir()
+    )
+    assert [file.name for file in streaming_files] == [file.name for file in all_files]
+    for all_file, streaming_file in zip(all_files, streaming_files):
+        all_table, streaming_table = pd.read_csv(all_file), pd.read_csv(streaming_file)
+        if all_file.stem == "bonuses":
+            # bonuses are sorted by worker within each batch
+            all_table = all_table.sort_values("workerid", ignore_index=True)
+            streaming_table = streaming_table.sort_values("workerid", ignore_index=True)
+        pd.testing.assert_frame_equal(streaming_table, all_table, check_dtype=False)
+
+
+@pytest.mark.parametrize("num_saved", [1, 3])
+def test_save_participant_files_incremental(test_case, tmp_path, num_saved):
+    """Appending new participants should save the same files as saving all at once."""
+    example_participant_dicts, experiment_name, labeller_path = test_case
+    num_saved = min(num_saved, len(example_participant_dicts) - 1)
+    data_path = tmp_path.joinpath(f"incremental/{experiment_name}")
+    assert save_participant_files_incremental(
+        example_participant_dicts[:num_saved],
+        experiment_name,
+        labeler=labeller_path,
+        save_path=tmp_path.joinpath("incremental"),
+    ) == {"rebuilt": True, "new_participants": num_saved}
+    result = save_participant_files_incremental(
+        example_participant_dicts,
+        experiment_name,
+        labeler=labeller_path,
+        save_path=tmp_path.joinpath("incremental"),
+    )
+    assert result["new_participants"] == len(example_participant_dicts) - num_saved
+    assert len(
+        json.loads(data_path.joinpath("manifest.json").read_text())["participants"]
+    ) == len(example_participant_dicts)
+    save_participant_files(
+        example_participant_dicts,
+        experiment_name,
+        labeler=labeller_path,
+        save_path=tmp_path.joinpath("all"),
+    )
+
+    all_files = sorted(tmp_path.joinpath(f"all/{experiment_name}").iterdir())
+    incremental_files = sorted(
+        file for file in data_path.iterdir() if file.name != "manifest.json"
+    )
+    assert [file.name for file in incremental_files] == [
+        file.name for file in all_files
+    ]
+    for all_file, incremental_file in zip(all_files, incremental_files):
+        assert incremental_file.read_text() == all_file.read_text()
+
+    # nothing new to save
+    assert save_participant_files_incremental(
+        example_participant_dicts,
+        experiment_name,
+        labeler=labeller_path,
+        save_path=tmp_path.joinpath("incremental"),
+    ) == {"rebuilt": False, "new_participants": 0}
+
+    # a changed status rebuilds all files
+    changed_participant_dicts = copy.deepcopy(example_participant_dicts)
+    changed_participant_dicts[0]["status"] += 1
+    assert save_participant_files_incremental(
+        changed_participant_dicts,
+        experiment_name,
+        labeler=labeller_path,
+        save_path=tmp_path.joinpath("incremental"),
+    ) == {"rebuilt": True, "new_participants": 0}
+
+
+def test_get_participant_bonus_columnwise(test_case):
+    """Column-wise bonus functions should give the same bonuses as row-wise ones."""
+    example_participant_dicts, _, _ = test_case
+    labeler = Labeler()
+    participant_data = get_participant_data(example_participant_dicts, labeler)
+    if "score" not in participant_data["trial_data"]:
+        pytest.skip("No scores in test case")
+    tables = [
+        participant_data[table_name]
+        for table_name in ["trial_data", "question_data", "general_info"]
+    ]
+
+    row_bonus_df = get_participant_bonus(
+        *tables, labeler, bonus_function=lambda row: max(row["score"], 100) / 100
+    )
+    column_bonus_df, bonus_totals = get_participant_bonus(
+        *tables,
+        labeler,
+        bonus_function=columnwise(
+            lambda bonus_df: bonus_df["score"].clip(lower=100) / 100
+        ),
+        return_totals=True,
+    )
+    pd.testing.assert_frame_equal(column_bonus_df, row_bonus_df)
+    assert bonus_totals["participants"].sum() == len(column_bonus_df)
+    assert bonus_totals["calculated_bonus"].sum() == pytest.approx(
+        column_bonus_df["calculated_bonus"].sum()
+    )
+
+    # scores are summed per run, and bonuses calculated on each run's scores
+    trial_data = tables[0].assign(run=tables[0]["pid"] % 2)
+    trial_data.loc[trial_data.groupby("pid").cumcount() % 2 == 0, "run"] += 2
+    run_bonus_df, run_bonus_totals = get_participant_bonus(
+        trial_data, *tables[1:], labeler, return_totals=True
+    )
+    pd.testing.assert_frame_equal(run_bonus_df, get_participant_bonus(*tables, labeler))
+    assert list(run_bonus_totals.columns[:2]) == ["cond", "run"]
+    assert run_bonus_totals["score"].sum() == pytest.approx(run_bonus_df["score"].sum())
+
+    # trials without a run value still count, e.g. for a participant without runs
+    first_pid = trial_data["pid"].iloc[0]
+    trial_data.loc[trial_data["pid"] == first_pid, "run"] = np.nan
+    trial_data.loc[trial_data.index % 3 == 0, "run"] = np.nan
+    nan_run_bonus_df, nan_run_bonus_totals = get_participant_bonus(
+        trial_data, *tables[1:], labeler, return_totals=True
+    )
+    pd.testing.assert_frame_equal(
+        nan_run_bonus_df, get_participant_bonus(*tables, labeler)
+    )
+    assert nan_run_bonus_totals["score"].sum() == pytest.approx(
+        nan_run_bonus_df["score"].sum()
+    )
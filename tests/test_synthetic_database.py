@@ -0,0 +1,37 @@
+"""Test synthetic database generator."""
+import dill as pickle
+
+from download_tools.download_from_database import download_from_database
+from download_tools.labeler import Labeler
+from download_tools.save_participant_files import save_participant_files
+from download_tools.synthetic_database import (
+    create_synthetic_database,
+    write_hit_id_file,
+)
+
+
+def test_create_synthetic_database(monkeypatch, tmp_path):
+    """Synthetic participants should be downloadable and saveable like real ones."""
+    database_path = tmp_path.joinpath("synthetic.db")
+    hit_list = create_synthetic_database(
+        database_path, num_participants=25, num_hits=3, datastring_size=20000
+    )
+    hit_id_file_path = tmp_path.joinpath("SYNTHETIC.txt")
+    write_hit_id_file(hit_list, hit_id_file_path)
+    monkeypatch.setenv("SYNTHETIC", f"sqlite:///{database_path}")
+
+    participant_dicts = download_from_database(hit_id_file_path, "SYNTHETIC")
+    assert len(participant_dicts) == 25
+    assert all(
+        len(participant_dict["datastring"]) >= 20000
+        for participant_dict in participant_dicts
+    )
+
+    labeler_path = tmp_path.joinpath("labeler.pickle")
+    with open(labeler_path, "wb") as f:
+        pickle.dump(Labeler().labels, f)
+    save_participant_files(
+        participant_dicts, "SYNTHETIC", labeler=labeler_path, save_path=tmp_path
+    )
+    assert tmp_path.joinpath("SYNTHETIC/mouselab-mdp.csv").exists()
+    assert tmp_path.joinpath("SYNTHETIC/bonuses.csv").exists()